@@ -0,0 +1,118 @@
+"""Module with the aggregations of the expenses, shared by the app and the CLI.
+
+This module must not import Dash, so that reports can be produced without
+starting the web app.
+"""
+
+from typing import Optional
+
+import pandas as pd
+
+MONTH_LABEL_FORMAT = "%B %Y"
+
+
+def filter_by_date(
+    df: pd.DataFrame, start: Optional[str] = None, end: Optional[str] = None
+) -> pd.DataFrame:
+    """Keep the expenses between the start and end dates, both included."""
+    mask = pd.Series(True, index=df.index)
+    if start is not None:
+        mask &= df["date"] >= pd.Timestamp(start)
+    if end is not None:
+        mask &= df["date"] <= pd.Timestamp(end)
+    return df[mask]
+
+
+def summarize_by_category(df: pd.DataFrame) -> pd.DataFrame:
+    """Total converted cost by category."""
+    return df.groupby("category", observed=True)["converted_cost"].sum().reset_index()
+
+
+def summarize_by_account(df: pd.DataFrame) -> pd.DataFrame:
+    """Total converted cost by account."""
+    return df.groupby("account", observed=True)["converted_cost"].sum().reset_index()
+
+
+def summarize_by_month(df: pd.DataFrame) -> pd.DataFrame:
+    """Total converted cost by month and category."""
+    summary = (
+        df.groupby(
+            [df["date"].dt.to_period("M").rename("month"), "category"], observed=True
+        )["converted_cost"]
+        .sum()
+        .reset_index()
+    )
+    # Format the month labels on the aggregates only, not on every expense
+    summary["month_year"] = summary["month"].dt.strftime(MONTH_LABEL_FORMAT)
+    return summary
+
+
+def total_by_month(df: pd.DataFrame) -> pd.DataFrame:
+    """Total converted cost by month."""
+    totals = (
+        df.groupby(df["date"].dt.to_period("M").rename("month"))["converted_cost"]
+        .sum()
+        .reset_index()
+    )
+    totals["month_year"] = totals["month"].dt.strftime(MONTH_LABEL_FORMAT)
+    return totals
+
+
+def profit_loss_by_month(
+    monthly_totals: pd.DataFrame, monthly_income: Optional[float]
+) -> pd.DataFrame:
+    """Income, expenses and profit/loss of every month.
+
+    The profit/loss is zero if no income is provided.
+    """
+    report = monthly_totals[["month", "converted_cost"]].rename(
+        columns={"converted_cost": "expenses"}
+    )
+    if monthly_income is None:
+        report["income"] = 0.0
+        report["profit_loss"] = 0.0
+    else:
+        report["income"] = monthly_income
+        report["profit_loss"] = monthly_income - report["expenses"]
+    return report
+
+
+def compute_statistics(
+    monthly_totals: pd.DataFrame, monthly_income: Optional[float]
+) -> dict:
+    """Compute the statistics shown in the app from the monthly totals."""
+    report = profit_loss_by_month(monthly_totals, monthly_income)
+    total_income = report["income"].sum()
+    total_expenses = report["expenses"].sum()
+    return {
+        "total_income": total_income,
+        "total_expenses": total_expenses,
+        "total_profit_loss": total_income - total_expenses,
+        "mean_expenses": report["expenses"].mean(),
+        "mean_profit_loss": report["profit_loss"].mean(),
+    }
+
+
+SUMMARIES = ["category", "month", "account", "profit-loss"]
+
+
+def build_summary(
+    df: pd.DataFrame, by: str, monthly_income: Optional[float] = None
+) -> pd.DataFrame:
+    """Compute one of the SUMMARIES of the converted expenses.
+
+    Months are returned as "YYYY-MM" strings, ready to be exported.
+    """
+    if by == "category":
+        summary = summarize_by_category(df)
+    elif by == "account":
+        summary = summarize_by_account(df)
+    elif by == "month":
+        summary = total_by_month(df)[["month", "converted_cost"]]
+    elif by == "profit-loss":
+        summary = profit_loss_by_month(total_by_month(df), monthly_income)
+    else:
+        raise ValueError(f"Unknown summary: {by}")
+    if "month" in summary.columns:
+        summary["month"] = summary["month"].astype(str)
+    return summary
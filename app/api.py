@@ -0,0 +1,151 @@
+"""Module for the JSON API served next to the Dash app.
+
+Endpoints, all under /api/ledgers/<ledger_id>:
+
+- POST /expenses: add a JSON array of expenses with a single storage write.
+  A retried request with the same Idempotency-Key header gets the ids of the
+  first one, without adding the expenses again.
+- GET /expenses?start=&end=: expenses between two dates (YYYY-MM-DD).
+- GET /summary?by=category|month|account|profit-loss&start=&end=&currency=:
+  totals converted to the currency (EUR by default).
+
+GET responses carry an ETag: requests with a matching If-None-Match header get
+a 304 without any recomputation. The ETag of converted totals covers the
+exchange rates too.
+"""
+
+import hashlib
+import zlib
+from typing import Callable, List, Tuple
+
+import pandas as pd
+from flask import Blueprint, Flask, Response, jsonify, request
+
+from .analytics import build_summary
+from .cache import SharedCache, shared_cache
+from .data.registry import TrackerRegistry
+from .data.tracker import Expense, ExpenseTracker
+from .config import CURRENCIES, IDEMPOTENCY_TTL
+from .utils import (
+    convert_costs,
+    expenses_to_records,
+    load_expenses_between,
+    resolve_rates,
+)
+
+
+def validate_expenses(rows) -> Tuple[List[dict], List[dict]]:
+    """Validate a JSON array of expenses, collecting the errors of every row."""
+    if not isinstance(rows, list):
+        return [], [
+            {"row": None, "field": None, "error": "Expected a JSON array of expenses."}
+        ]
+    return Expense.validate_batch(rows)
+
+
+def create_api(
+    registry: TrackerRegistry, cache: SharedCache = shared_cache
+) -> Blueprint:
+    """Create the API blueprint serving the ledgers of the registry.
+
+    The idempotency keys are kept in the shared cache, so that a retry is
+    recognized by any server process.
+    """
+    api = Blueprint("api", __name__, url_prefix="/api/ledgers/<ledger_id>")
+
+    def get_tracker(ledger_id):
+        try:
+            return registry.get(ledger_id)
+        except ValueError as e:
+            return Response(str(e), status=404)
+
+    def conditional(
+        ledger_id: str,
+        compute: Callable[[ExpenseTracker], object],
+        variant: str = "",
+    ):
+        """Serve a GET response, or a 304 if the client copy is still valid.
+
+        The variant identifies the inputs of the response besides the ledger
+        and the query, e.g. the exchange rates.
+        """
+        tracker = get_tracker(ledger_id)
+        if isinstance(tracker, Response):
+            return tracker
+        query = request.query_string.decode()
+        # The content tag is the same in every process having the same entries
+        etag = f"{ledger_id}-{tracker.content_tag}-{zlib.crc32(query.encode()):x}"
+        if variant:
+            etag = f"{etag}-{variant}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            try:
+                response = jsonify(compute(tracker))
+            except ValueError as e:
+                return Response(str(e), status=400)
+        response.set_etag(etag)
+        return response
+
+    def load_range(tracker, raw: bool = True) -> pd.DataFrame:
+        start = request.args.get("start")
+        end = request.args.get("end")
+        return load_expenses_between(tracker, start, end, raw)
+
+    @api.post("/expenses")
+    def add_expenses(ledger_id):
+        tracker = get_tracker(ledger_id)
+        if isinstance(tracker, Response):
+            return tracker
+        expenses, errors = validate_expenses(request.get_json(silent=True))
+        if errors:
+            return jsonify({"errors": errors}), 422
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            ids = tracker.add_expenses(expenses)
+            return jsonify({"added": len(ids), "ids": ids}), 201
+        # A single process adds the expenses of a key, the retries in flight
+        # waiting for its ids
+        body = hashlib.sha256(request.get_data()).hexdigest()
+        (added_body, ids), _ = cache.get_or_compute(
+            ("idempotency", ledger_id, key),
+            lambda: (body, tracker.add_expenses(expenses)),
+            IDEMPOTENCY_TTL,
+        )
+        if added_body != body:
+            error = "Idempotency-Key already used with another request."
+            return (
+                jsonify({"errors": [{"row": None, "field": None, "error": error}]}),
+                422,
+            )
+        return jsonify({"added": len(ids), "ids": ids}), 201
+
+    @api.get("/expenses")
+    def get_expenses(ledger_id):
+        return conditional(
+            ledger_id, lambda tracker: expenses_to_records(load_range(tracker))
+        )
+
+    @api.get("/summary")
+    def get_summary(ledger_id):
+        by = request.args.get("by", "category")
+        currency = request.args.get("currency", "EUR")
+        if currency not in CURRENCIES:
+            return Response(f"Unknown currency: {currency}", status=400)
+        rates = resolve_rates(CURRENCIES, currency)
+
+        def compute(tracker):
+            df = convert_costs(load_range(tracker, raw=False), currency, rates)
+            return build_summary(df, by).to_dict("records")
+
+        variant = f"{zlib.crc32(repr(rates.signature()).encode()):x}"
+        return conditional(ledger_id, compute, variant)
+
+    return api
+
+
+def register_api(
+    server: Flask, registry: TrackerRegistry, cache: SharedCache = shared_cache
+):
+    """Serve the JSON API on the Flask server of the app."""
+    server.register_blueprint(create_api(registry, cache))
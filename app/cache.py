@@ -0,0 +1,149 @@
+"""Module for the cache shared by the server processes.
+
+Every worker process of the server has its own trackers and FX provider, so
+without a shared tier each one would fetch the same rates, spending the API
+quota once per worker, and recompute the same aggregates. The shared cache is
+a SQLite database on the local disk (through diskcache, like the background
+jobs), with a TTL per entry and a size limit evicting the oldest entries.
+
+A missing or expired entry is computed by a single worker at a time: the
+others serve the stale value if there is one, or wait for the result.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+import diskcache
+
+from .config import CACHE_DIR, CACHE_LOCK_TIMEOUT, CACHE_SIZE_LIMIT
+
+POLL_INTERVAL = 0.05  # Seconds between two checks of a worker waiting for another
+
+
+class SharedCache:
+    """Cache of values shared by the processes, with stampede protection.
+
+    Entries are stored with the time until which they are fresh, and kept
+    `stale_ttl` seconds longer, to be served while a worker recomputes them or
+    when they cannot be recomputed (e.g. the FX API is down).
+
+    The database is opened on first use, so that importing the modules
+    sharing the cache creates no file.
+    """
+
+    def __init__(
+        self,
+        directory: Path = CACHE_DIR,
+        size_limit: int = CACHE_SIZE_LIMIT,
+        lock_timeout: float = CACHE_LOCK_TIMEOUT,
+    ):
+        self.directory = Path(directory)
+        self.size_limit = size_limit
+        self.lock_timeout = lock_timeout
+        self._handle: Optional[diskcache.Cache] = None
+        self._open_lock = threading.Lock()
+
+    @property
+    def handle(self) -> diskcache.Cache:
+        """Return the database of the cache, opening it if needed."""
+        if self._handle is None:
+            with self._open_lock:
+                if self._handle is None:
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    self._handle = diskcache.Cache(
+                        str(self.directory), size_limit=self.size_limit
+                    )
+        return self._handle
+
+    @staticmethod
+    def _lock_key(key: Hashable) -> Tuple:
+        return ("lock", key)
+
+    def get(self, key: Hashable) -> Tuple[Any, bool]:
+        """Return the value of a key, or None, and whether it is still fresh."""
+        entry = self.handle.get(key)
+        if entry is None:
+            return None, False
+        value, fresh_until = entry
+        return value, time.time() < fresh_until
+
+    def set(self, key: Hashable, value: Any, ttl: float, stale_ttl: float = 0.0):
+        self.handle.set(key, (value, time.time() + ttl), expire=ttl + stale_ttl)
+
+    def get_or_compute(
+        self,
+        key: Hashable,
+        compute: Callable[[], Any],
+        ttl: float,
+        stale_ttl: float = 0.0,
+    ) -> Tuple[Any, bool]:
+        """Return the value of a key, computing it if it is missing or expired.
+
+        Only the worker holding the lock of the key computes it, while the
+        others return the stale value, or wait up to the lock timeout for the
+        fresh one and compute it themselves after that. A None result of
+        compute is not cached, and the stale value is returned instead, if
+        any. Returns the value and whether it is fresh.
+        """
+        deadline = time.monotonic() + self.lock_timeout
+        token = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        while True:
+            stale, fresh = self.get(key)
+            if fresh:
+                return stale, True
+            if self.handle.add(self._lock_key(key), token, expire=self.lock_timeout):
+                break
+            if stale is not None:
+                return stale, False  # Being recomputed by another worker
+            if time.monotonic() >= deadline:
+                logging.warning(f"Timed out waiting for the cache entry {key}")
+                token = None
+                break
+            time.sleep(POLL_INTERVAL)
+        try:
+            value = compute()
+            if value is not None:
+                self.set(key, value, ttl, stale_ttl)  # Before the waiters see it
+        finally:
+            if token is not None:
+                self._release(key, token)
+        if value is None:
+            return stale, False
+        return value, True
+
+    @contextmanager
+    def lock(self, key: Hashable):
+        """Hold the lock of a key, e.g. around a read-modify-write of a file.
+
+        The lock is shared by the processes, and taken anyway once the lock
+        timeout has elapsed, like in get_or_compute.
+        """
+        deadline = time.monotonic() + self.lock_timeout
+        token = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        while not self.handle.add(self._lock_key(key), token, expire=self.lock_timeout):
+            if time.monotonic() >= deadline:
+                logging.warning(f"Timed out waiting for the lock of {key}")
+                token = None
+                break
+            time.sleep(POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            if token is not None:
+                self._release(key, token)
+
+    def _release(self, key: Hashable, token: str):
+        """Release the lock of a key, unless it expired and was taken again."""
+        with self.handle.transact():
+            if self.handle.get(self._lock_key(key)) == token:
+                self.handle.delete(self._lock_key(key))
+
+
+# Cache shared by the whole app
+shared_cache = SharedCache()
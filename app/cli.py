@@ -0,0 +1,78 @@
+"""Module for the command-line interface of the expense tracker.
+
+Reports are computed with the same analytics as the app, without importing
+Dash, e.g.:
+
+    python -m app report --by month --start 2024-01-01 --format csv
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import List, Optional, TextIO
+
+import pandas as pd
+
+from .analytics import SUMMARIES, build_summary
+from .config import CURRENCIES, DEFAULT_LEDGER_ID
+from .data.registry import TrackerRegistry
+from .utils import convert_amount, convert_costs, load_expense_range, resolve_rates
+
+FORMATS = ["table", "csv", "json"]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    report = commands.add_parser("report", help="Print a summary of the expenses.")
+    ledger = report.add_mutually_exclusive_group()
+    ledger.add_argument("--ledger", default=DEFAULT_LEDGER_ID, help="Ledger id.")
+    ledger.add_argument("--csv", type=Path, help="Path of the ledger CSV file.")
+    report.add_argument("--by", choices=SUMMARIES, default="category")
+    report.add_argument("--start", help="First date included (YYYY-MM-DD).")
+    report.add_argument("--end", help="Last date included (YYYY-MM-DD).")
+    report.add_argument("--income", type=float, help="Monthly income.")
+    report.add_argument("--income-currency", choices=CURRENCIES, default="EUR")
+    report.add_argument(
+        "--currency", choices=CURRENCIES, default="EUR", help="Reporting currency."
+    )
+    report.add_argument("--format", choices=FORMATS, default="table")
+    return parser
+
+
+def write_report(report: pd.DataFrame, output_format: str, out: TextIO):
+    if output_format == "csv":
+        report.to_csv(out, index=False)
+    elif output_format == "json":
+        out.write(report.to_json(orient="records") + "\n")
+    else:
+        out.write(report.to_string(index=False, float_format="{:.2f}".format) + "\n")
+
+
+def run_report(args: argparse.Namespace, out: TextIO) -> int:
+    path = args.csv or TrackerRegistry().ledger_path(args.ledger)
+    if not path.exists():
+        print(f"No ledger found at {path}", file=sys.stderr)
+        return 1
+
+    df = load_expense_range(path, args.start, args.end)
+    rates = resolve_rates(
+        [*df["currency"].astype("category").cat.categories, args.income_currency],
+        args.currency,
+    )
+    df = convert_costs(df, args.currency, rates)
+    monthly_income_converted = None
+    if args.income is not None:
+        monthly_income_converted = convert_amount(
+            args.income, args.income_currency, args.currency, rates
+        )
+    write_report(build_summary(df, args.by, monthly_income_converted), args.format, out)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None, out: TextIO = sys.stdout) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == "report":
+        return run_report(args, out)
+    return 2
@@ -1,14 +1,113 @@
 """Module to store configuration variables."""
 
+import os
 from pathlib import Path
 
-API_KEY_FILE = "app/key.txt"
+# The key of the FX API is read from FX_API_KEY, or from the key file. The API
+# can be replaced, e.g. by the local mock of app/fx_mock.py, with FX_BASE_URL.
+API_KEY_FILE = os.environ.get("FX_API_KEY_FILE", "app/key.txt")
 
-with open(API_KEY_FILE, "r") as file:
-    API_KEY = file.read().strip()
-BASE_URL = f"https://v6.exchangerate-api.com/v6/{API_KEY}/latest/"
+API_KEY = os.environ.get("FX_API_KEY", "")
+if not API_KEY and os.path.exists(API_KEY_FILE):
+    with open(API_KEY_FILE, "r") as file:
+        API_KEY = file.read().strip()
+BASE_URL = os.environ.get(
+    "FX_BASE_URL", f"https://v6.exchangerate-api.com/v6/{API_KEY}/latest/"
+)
+
+# Calls to the FX API: monthly budget (1500 requests on the free plan), token
+# bucket of FX_BURST calls refilled at FX_RATE_LIMIT calls per second, circuit
+# breaker opened for FX_COOLDOWN seconds after FX_FAILURE_THRESHOLD failures,
+# and rates cached for FX_CACHE_TTL seconds.
+FX_MONTHLY_BUDGET = int(os.environ.get("FX_MONTHLY_BUDGET", 1500))
+FX_RATE_LIMIT = 1.0
+FX_BURST = 5
+FX_FAILURE_THRESHOLD = 3
+FX_COOLDOWN = 60.0
+FX_CACHE_TTL = 3600.0
+FX_TIMEOUT = 5.0
+FX_USAGE_FILE = Path("app/data") / "fx_usage.json"
 CSV_PATH = Path("app/data") / "expenses.csv"
 DATE_FORMAT = "%d-%m-%Y"
+CURRENCIES = ["EUR", "USD", "GBP", "CHF"]
+CURRENCY_SYMBOLS = {"EUR": "€", "USD": "$", "GBP": "£", "CHF": "CHF"}
+
+# Multi-ledger settings: the default ledger keeps using CSV_PATH, every other
+# ledger is stored as LEDGER_DIR / "<ledger_id>.csv".
+LEDGER_DIR = Path("app/data") / "ledgers"
+DEFAULT_LEDGER_ID = "default"
+MAX_LOADED_LEDGERS = 8  # Max number of trackers kept in memory
+MAX_LOADED_EXPENSES = 2_000_000  # Max number of expenses kept in memory
+# Counters of hits, loads and evictions kept for the MAX_LEDGER_STATS ledgers
+# requested last, loaded or not
+MAX_LEDGER_STATS = 1024
+
+# The CSV file is an append-only log of expense versions and tombstones: it is
+# compacted in the background once the share of dead entries exceeds the
+# threshold.
+COMPACTION_THRESHOLD = 0.5
+COMPACTION_MIN_ENTRIES = 1000
+
+# Every entry is first written to a write-ahead log, and the state of the
+# tracker is saved to a snapshot every SNAPSHOT_INTERVAL entries.
+SNAPSHOT_INTERVAL = 1000
+WAL_FSYNC = True
+
+# Optional time-partitioned layout: with a period ("year" or "month"), the
+# compactions archive the expenses to one CSV file per period, and the ledger
+# file only keeps the entries written since. The archive is also compacted
+# every PARTITION_FOLD_ENTRIES entries.
+PARTITION_PERIOD = None
+PARTITION_FOLD_ENTRIES = 10_000
+
+# Bounded-memory mode: with a number of months, only the expenses of the last
+# RESIDENT_MONTHS months are kept in memory. Older periods stay in the
+# partitions (monthly ones unless PARTITION_PERIOD is set), represented by
+# their aggregates, and are read from disk when their expenses are needed.
+RESIDENT_MONTHS = None
+
+# Heavy callbacks (full recomputations and imports) run as background jobs on
+# JOB_WORKERS threads of the server, see app/jobs.py. Their results and
+# progress are kept in a disk cache in JOB_DIR, shared by the server
+# processes, for JOB_RESULT_TTL seconds at most if nobody reads them.
+JOB_DIR = Path("app/data") / ".jobs"
+JOB_WORKERS = 2
+JOB_RESULT_TTL = 600.0
+JOB_POLL_INTERVAL = 250  # Milliseconds between two polls of a job
+
+# Cache shared by the server processes (FX rates and aggregates), see
+# app/cache.py: a SQLite database in CACHE_DIR of CACHE_SIZE_LIMIT bytes at
+# most. A worker waits CACHE_LOCK_TIMEOUT seconds at most for another one
+# computing an entry. Rates older than FX_CACHE_TTL are served for
+# FX_STALE_TTL more seconds if they cannot be fetched, and the aggregates of a
+# ledger version are kept AGGREGATE_CACHE_TTL seconds. The ids added by a
+# POST of the API with an Idempotency-Key are kept IDEMPOTENCY_TTL seconds.
+CACHE_DIR = Path("app/data") / ".cache"
+CACHE_SIZE_LIMIT = 256 * 2**20
+CACHE_LOCK_TIMEOUT = 30.0
+FX_STALE_TTL = 30 * 24 * 3600.0
+AGGREGATE_CACHE_TTL = 3600.0
+IDEMPOTENCY_TTL = 24 * 3600.0
+
+# Quantile sketches (t-digests) of the costs by month and category or account:
+# the higher the compression, the more accurate and larger the sketches.
+SKETCH_COMPRESSION = 200
+
+# Running sums of the costs of each account by day: writes are buffered and
+# merged into the sums once BALANCE_BUFFER of them are pending for an account.
+# The spend-over-time lines of the accounts have ACCOUNT_SPEND_POINTS points.
+BALANCE_BUFFER = 256
+ACCOUNT_SPEND_POINTS = 200
+
+# Readers of a tracker get versioned views of its columns without taking the
+# writer lock. The rows killed by the last KILL_LOG_VERSIONS writes are logged,
+# so that a view can be taken while a write is in progress.
+KILL_LOG_VERSIONS = 64
+
+# Aggregations over at least PARALLEL_AGGREGATION_MIN_ROWS expenses are split
+# into partitions summed by a pool of AGGREGATION_WORKERS processes.
+AGGREGATION_WORKERS = os.cpu_count() or 1
+PARALLEL_AGGREGATION_MIN_ROWS = 500_000
 
 dark_mode_colors = {
     "title": "#FFD700",  # Gold
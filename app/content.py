@@ -4,7 +4,7 @@ from datetime import datetime
 
 from dash import dash_table, dcc, html
 
-from .utils import load_expenses
+from .utils import describe_archived, expenses_to_records, load_expenses
 
 
 def create_app_content(colors, expense_tracker):
@@ -398,18 +398,28 @@ def create_app_content(colors, expense_tracker):
                             dash_table.DataTable(
                                 id="expenses-table",
                                 columns=[
-                                    {"name": i, "id": i}
-                                    for i in [
-                                        "category",
-                                        "cost",
-                                        "note",
-                                        "date",
-                                        "currency",
-                                        "account",
-                                        "cost_euro",
-                                    ]
+                                    {"name": "category", "id": "category"},
+                                    {"name": "cost", "id": "cost", "type": "numeric"},
+                                    {"name": "note", "id": "note"},
+                                    {"name": "date", "id": "date"},
+                                    {"name": "currency", "id": "currency"},
+                                    {"name": "account", "id": "account"},
+                                    {
+                                        "name": "converted_cost",
+                                        "id": "converted_cost",
+                                        "editable": False,
+                                    },
+                                    {
+                                        "name": "rate",
+                                        "id": "rate_source",
+                                        "editable": False,
+                                    },
                                 ],
-                                data=load_expenses(expense_tracker).to_dict("records"),
+                                editable=True,
+                                row_deletable=True,
+                                data=expenses_to_records(
+                                    load_expenses(expense_tracker)
+                                ),
                                 style_table={
                                     "overflowX": "auto",
                                     "borderRadius": "8px",
@@ -435,6 +445,14 @@ def create_app_content(colors, expense_tracker):
                                 sort_action="native",
                                 filter_action="native",
                             ),
+                            html.P(
+                                describe_archived(expense_tracker),
+                                id="archived-notice",
+                                style={
+                                    "color": colors["text"],
+                                    "textAlign": "center",
+                                },
+                            ),
                         ],
                         style={
                             "backgroundColor": colors["block"],
@@ -442,6 +460,64 @@ def create_app_content(colors, expense_tracker):
                             "borderRadius": "8px",
                         },
                     ),
+                    html.Div(
+                        [
+                            html.H3(
+                                "Search",
+                                style={
+                                    "color": colors["subtitle"],
+                                    "textAlign": "center",
+                                    "fontSize": "30px",
+                                    "marginBottom": "5px",
+                                    "marginTop": "5px",
+                                },
+                            ),
+                            dcc.Input(
+                                id="search-query",
+                                type="search",
+                                value="",
+                                debounce=True,
+                                placeholder="Search notes and categories",
+                                style={
+                                    "width": "60%",
+                                    "margin": "0 auto 10px auto",
+                                    "borderRadius": "5px",
+                                    "display": "block",
+                                    "height": "30px",
+                                },
+                            ),
+                            dcc.Checklist(
+                                id="search-archived",
+                                options=[
+                                    {
+                                        "label": " Include archived expenses",
+                                        "value": "archived",
+                                    }
+                                ],
+                                value=[],
+                                style={
+                                    "color": colors["text"],
+                                    "textAlign": "center",
+                                    "marginBottom": "10px",
+                                    "display": (
+                                        "block"
+                                        if expense_tracker.archived()[0]
+                                        else "none"
+                                    ),
+                                },
+                            ),
+                            html.Div(
+                                id="search-results",
+                                style={"color": colors["text"]},
+                            ),
+                        ],
+                        style={
+                            "backgroundColor": colors["block"],
+                            "padding": "20px",
+                            "borderRadius": "8px",
+                            "marginTop": "20px",
+                        },
+                    ),
                 ],
                 style={
                     "width": "48%",
@@ -499,6 +575,40 @@ def create_app_content(colors, expense_tracker):
                             "borderRadius": "8px",
                         },
                     ),
+                    html.Div(
+                        [
+                            html.H3(
+                                "Spending by Account",
+                                style={
+                                    "color": colors["subtitle"],
+                                    "textAlign": "center",
+                                    "fontSize": "30px",
+                                    "marginBottom": "5px",
+                                    "marginTop": "5px",
+                                },
+                            ),
+                            dcc.DatePickerRange(
+                                id="account-date-range",
+                                display_format="DD-MM-YYYY",
+                                clearable=True,
+                                style={
+                                    "margin": "0 auto 10px auto",
+                                    "display": "block",
+                                    "textAlign": "center",
+                                },
+                            ),
+                            dcc.Graph(
+                                id="account-spend",
+                                style={"height": "400px", "borderRadius": "8px"},
+                            ),
+                        ],
+                        style={
+                            "backgroundColor": colors["block"],
+                            "padding": "20px",
+                            "borderRadius": "8px",
+                            "marginTop": "20px",
+                        },
+                    ),
                 ],
                 style={
                     "width": "48%",
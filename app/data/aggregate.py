@@ -0,0 +1,182 @@
+"""Module to aggregate the expenses in parallel over partitions of the rows."""
+
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import date
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..config import AGGREGATION_WORKERS, PARALLEL_AGGREGATION_MIN_ROWS
+from .records import ExpenseColumns
+
+CUBE_COLUMNS = ["date", "category", "account", "currency", "cost", "count"]
+UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+EPOCH_MONTH = 1970 * 12
+
+# Partial sums of a partition: keys of the non-empty cells, sums and counts
+Partial = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def month_of(days: np.ndarray) -> np.ndarray:
+    """Convert day ordinals into month numbers, counted from January of year 0."""
+    dates = (days.astype(np.int64) - UNIX_EPOCH_ORDINAL).astype("datetime64[D]")
+    return dates.astype("datetime64[M]").astype(np.int64) + EPOCH_MONTH
+
+
+def month_start(months: np.ndarray) -> np.ndarray:
+    """Convert month numbers into the datetime64 of the first day of the month."""
+    return (months - EPOCH_MONTH).astype("datetime64[M]").astype("datetime64[ns]")
+
+
+def partial_cube(
+    cost: np.ndarray,
+    day: np.ndarray,
+    category: np.ndarray,
+    account: np.ndarray,
+    currency: np.ndarray,
+    shape: Tuple[int, int, int],
+) -> Partial:
+    """Sum the costs of a partition by month, category, account and currency.
+
+    Every cell is identified by a single integer key, so that the partials of
+    several partitions can be merged by key.
+    """
+    n_categories, n_accounts, n_currencies = shape
+    keys = month_of(day) * n_categories + category
+    keys = keys * n_accounts + account
+    keys = keys * n_currencies + currency
+    cells, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse, weights=cost, minlength=len(cells))
+    counts = np.bincount(inverse, minlength=len(cells))
+    return cells, sums, counts
+
+
+def merge_partials(partials: List[Partial]) -> Partial:
+    """Merge the partial sums of several partitions."""
+    if len(partials) == 1:
+        return partials[0]
+    keys = np.concatenate([partial[0] for partial in partials])
+    cells, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(
+        inverse,
+        weights=np.concatenate([partial[1] for partial in partials]),
+        minlength=len(cells),
+    )
+    counts = np.bincount(
+        inverse,
+        weights=np.concatenate([partial[2] for partial in partials]),
+        minlength=len(cells),
+    ).astype(np.int64)
+    return cells, sums, counts
+
+
+def pool_context() -> multiprocessing.context.BaseContext:
+    """Return the context starting the workers of the aggregation pools.
+
+    The server runs many threads, and a forked worker would inherit the locks
+    they hold: the workers are started from a fork server, or spawned where
+    there is none. Both import this module anew, preloaded by the fork server.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def get_executor() -> Optional[ProcessPoolExecutor]:
+    """Return the process pool shared by the aggregations, starting it if needed."""
+    global _executor
+    if AGGREGATION_WORKERS <= 1:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=AGGREGATION_WORKERS, mp_context=pool_context()
+            )
+        return _executor
+
+
+def aggregate_expenses(
+    columns: ExpenseColumns,
+    rows: Optional[np.ndarray] = None,
+    executor: Optional[Executor] = None,
+    min_parallel_rows: int = PARALLEL_AGGREGATION_MIN_ROWS,
+    partitions: int = AGGREGATION_WORKERS,
+) -> pd.DataFrame:
+    """Sum the expenses by month, category, account and currency.
+
+    Only the given rows are summed, by default all the live expenses. They are
+    split into contiguous partitions whose partial sums are computed in a
+    process pool and merged. Small inputs, or a failing pool, are aggregated
+    in-process.
+
+    Every row of the returned frame is one non-empty cell, dated on the first
+    day of its month, so that the summaries of the analytics module can be
+    computed from it as if it were the expenses themselves.
+    """
+    if rows is None:
+        rows = np.flatnonzero(columns.view("live"))
+    shape = (len(columns.categories), len(columns.accounts), len(columns.currencies))
+    # Fancy indexing copies the values, so the workers never see the arrays
+    # of the tracker grow under them
+    cost = columns.view("cost")[rows]
+    day = columns.view("day")[rows]
+    category = columns.view("category")[rows]
+    account = columns.view("account")[rows]
+    currency = columns.view("currency")[rows]
+
+    if executor is None and len(rows) >= min_parallel_rows:
+        executor = get_executor()
+    partials = None
+    if executor is not None and len(rows) >= min_parallel_rows:
+        bounds = np.linspace(0, len(rows), partitions + 1, dtype=np.intp)
+        try:
+            futures = [
+                executor.submit(
+                    partial_cube,
+                    cost[start:stop],
+                    day[start:stop],
+                    category[start:stop],
+                    account[start:stop],
+                    currency[start:stop],
+                    shape,
+                )
+                for start, stop in zip(bounds[:-1], bounds[1:])
+                if stop > start
+            ]
+            partials = [future.result() for future in futures]
+        except Exception as e:
+            logging.error(f"Parallel aggregation failed, running in-process: {e}")
+    if partials is None:
+        partials = [partial_cube(cost, day, category, account, currency, shape)]
+    cells, sums, counts = merge_partials(partials)
+
+    n_categories, n_accounts, n_currencies = shape
+    cells, currency = np.divmod(cells, n_currencies)
+    cells, account = np.divmod(cells, n_accounts)
+    months, category = np.divmod(cells, n_categories)
+    return pd.DataFrame(
+        {
+            "date": month_start(months),
+            "category": pd.Categorical.from_codes(
+                category, categories=columns.categories.values
+            ),
+            "account": pd.Categorical.from_codes(
+                account, categories=columns.accounts.values
+            ),
+            "currency": pd.Categorical.from_codes(
+                currency, categories=columns.currencies.values
+            ),
+            "cost": sums,
+            "count": counts,
+        },
+        columns=CUBE_COLUMNS,
+    )
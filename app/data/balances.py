@@ -0,0 +1,244 @@
+"""Module for the running sums of the expenses of each account, by day."""
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from ..config import BALANCE_BUFFER
+from .locks import atomic_write
+from .records import ExpenseColumns
+
+FORMAT_VERSION = 1
+
+# (account, currency) of a running sum
+BalanceKey = Tuple[str, str]
+
+
+class RunningSum:
+    """Cumulative sums of the costs of one account in one currency, by day.
+
+    `days` are the sorted days with expenses, and `sums[i]` is the total of
+    the costs up to `days[i]` included, so that the total between two days
+    takes two binary searches and a subtraction. The writes are buffered as
+    (day, cost) deltas, a removal being a negative cost, and merged into the
+    arrays once BALANCE_BUFFER of them are pending.
+    """
+
+    __slots__ = ("days", "sums", "_pending_days", "_pending_costs")
+
+    def __init__(self, days: np.ndarray = None, sums: np.ndarray = None):
+        self.days = np.empty(0, dtype=np.int32) if days is None else days
+        self.sums = np.empty(0) if sums is None else sums
+        self._pending_days: List[int] = []
+        self._pending_costs: List[float] = []
+
+    @classmethod
+    def from_costs(cls, days: np.ndarray, costs: np.ndarray) -> "RunningSum":
+        """Build the running sum of costs, in any order.
+
+        The days whose costs cancel out, e.g. of deleted expenses, are dropped.
+        """
+        cells, inverse = np.unique(days, return_inverse=True)
+        totals = np.bincount(inverse.ravel(), weights=costs, minlength=len(cells))
+        kept = totals != 0
+        return cls(cells[kept].astype(np.int32), np.cumsum(totals[kept]))
+
+    def add(self, day: int, cost: float):
+        self._pending_days.append(day)
+        self._pending_costs.append(cost)
+        if len(self._pending_days) >= BALANCE_BUFFER:
+            self.flush()
+
+    def _merged(self, days: np.ndarray, costs: np.ndarray) -> "RunningSum":
+        """Return the running sum with the pending deltas and costs merged in."""
+        return RunningSum.from_costs(
+            np.concatenate((self.days, days, self._pending_days)),
+            np.concatenate(
+                (np.diff(self.sums, prepend=0.0), costs, self._pending_costs)
+            ),
+        )
+
+    def extend(self, days: np.ndarray, costs: np.ndarray):
+        """Add many costs at once, merging them into the cumulative sums."""
+        merged = self._merged(days, costs)
+        self.days, self.sums = merged.days, merged.sums
+        self._pending_days, self._pending_costs = [], []
+
+    def flush(self):
+        """Merge the pending deltas into the cumulative sums."""
+        if self._pending_days:
+            self.extend(np.empty(0, dtype=np.int32), np.empty(0))
+
+    def flushed(self) -> "RunningSum":
+        """Return the running sum with the pending deltas merged, leaving it as is."""
+        if not self._pending_days:
+            return self
+        return self._merged(np.empty(0, dtype=np.int32), np.empty(0))
+
+    def copy(self) -> "RunningSum":
+        """Return an independent copy, sharing the arrays (never modified)."""
+        running = RunningSum(self.days, self.sums)
+        running._pending_days = list(self._pending_days)
+        running._pending_costs = list(self._pending_costs)
+        return running
+
+    @property
+    def first_day(self) -> Optional[int]:
+        days = self.flushed().days
+        return int(days[0]) if len(days) else None
+
+    def totals_at(self, days: np.ndarray) -> np.ndarray:
+        """Return the total of the costs up to each of the days, included."""
+        positions = np.searchsorted(self.days, days, side="right")
+        totals = np.concatenate(([0.0], self.sums))[positions]
+        if self._pending_days:
+            pending_days = np.array(self._pending_days)
+            pending_costs = np.array(self._pending_costs)
+            order = np.argsort(pending_days, kind="stable")
+            pending = np.concatenate(([0.0], np.cumsum(pending_costs[order])))
+            totals = (
+                totals
+                + pending[np.searchsorted(pending_days[order], days, side="right")]
+            )
+        return totals
+
+    def between(self, start: Optional[int], end: Optional[int]) -> float:
+        """Return the total of the costs between two days, both included."""
+        low = -np.inf if start is None else start - 1
+        high = np.inf if end is None else end
+        below, upto = self.totals_at(np.array([low, high]))
+        return float(upto - below)
+
+
+class AccountBalances:
+    """Running sums of the costs of every account, one per currency.
+
+    The sums are kept in the currency of the expenses, and converted when
+    queried: the exchange rates change, while the sums of an account only
+    change with its expenses.
+
+    The queries leave the sums as they are, so that the frozen copies of the
+    readers (see freeze) are never modified.
+    """
+
+    def __init__(self):
+        self.sums: Dict[BalanceKey, RunningSum] = {}
+        # Last frozen copy, and the keys of the sums changed since
+        self._frozen: Optional["AccountBalances"] = None
+        self._changed: Set[BalanceKey] = set()
+
+    def add(self, day: int, account: str, currency: str, cost: float):
+        """Add the cost of a new expense, or remove it with a negative cost."""
+        running = self.sums.get((account, currency))
+        if running is None:
+            running = self.sums[(account, currency)] = RunningSum()
+        running.add(day, cost)
+        self._changed.add((account, currency))
+
+    def add_columns(self, columns: ExpenseColumns):
+        """Add the costs of the live expenses of columns, e.g. when loading."""
+        rows = np.flatnonzero(columns.view("live"))
+        if not len(rows):
+            return
+        days = columns.view("day")[rows]
+        cost = columns.view("cost")[rows]
+        cells, groups = np.unique(
+            np.stack([columns.view("account")[rows], columns.view("currency")[rows]]),
+            axis=1,
+            return_inverse=True,
+        )
+        groups = groups.ravel()
+        for group, (account, currency) in enumerate(cells.T):
+            key = (
+                columns.accounts.values[account],
+                columns.currencies.values[currency],
+            )
+            running = self.sums.get(key)
+            if running is None:
+                running = self.sums[key] = RunningSum()
+            selected = groups == group
+            running.extend(days[selected], cost[selected])
+            self._changed.add(key)
+
+    def spend(
+        self, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Dict[BalanceKey, float]:
+        """Return the spend of every account and currency between two days."""
+        return {key: running.between(start, end) for key, running in self.sums.items()}
+
+    def totals_at(self, days: Iterable[int]) -> Dict[BalanceKey, np.ndarray]:
+        """Return the cumulative spend of every account and currency at days."""
+        days = np.asarray(list(days))
+        return {key: running.totals_at(days) for key, running in self.sums.items()}
+
+    def first_day(self) -> Optional[int]:
+        """Return the day of the first expense, if any."""
+        days = [running.first_day for running in self.sums.values()]
+        return min([day for day in days if day is not None], default=None)
+
+    def copy(self) -> "AccountBalances":
+        balances = AccountBalances()
+        balances.sums = {key: running.copy() for key, running in self.sums.items()}
+        return balances
+
+    def freeze(self) -> "AccountBalances":
+        """Return a copy of the sums for the readers, which must not modify it.
+
+        The sums unchanged since the previous frozen copy are shared with it.
+        """
+        previous = self._frozen
+        if previous is None:
+            frozen = self.copy()
+        elif not self._changed:
+            return previous
+        else:
+            frozen = AccountBalances()
+            frozen.sums = dict(previous.sums)
+            for key in self._changed:
+                frozen.sums[key] = self.sums[key].copy()
+        self._frozen, self._changed = frozen, set()
+        return frozen
+
+    def save(self, path: Path):
+        """Persist the running sums, as a header and flat arrays."""
+        keys = sorted(self.sums)
+        flushed = [self.sums[key].flushed() for key in keys]
+        header = {"version": FORMAT_VERSION, "keys": keys}
+        with atomic_write(path) as file:
+            np.savez(
+                file,
+                header=np.array(json.dumps(header)),
+                sizes=np.array(
+                    [len(running.days) for running in flushed], dtype=np.int64
+                ),
+                days=np.concatenate(
+                    [running.days for running in flushed]
+                    or [np.empty(0, dtype=np.int32)]
+                ),
+                sums=np.concatenate(
+                    [running.sums for running in flushed] or [np.empty(0)]
+                ),
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["AccountBalances"]:
+        """Load persisted running sums, or return None if they are unusable."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                header = json.loads(str(data["header"]))
+                if header["version"] != FORMAT_VERSION:
+                    return None
+                bounds = np.concatenate(([0], np.cumsum(data["sizes"])))
+                days, sums = data["days"], data["sums"]
+                balances = cls()
+                for i, key in enumerate(header["keys"]):
+                    balances.sums[tuple(key)] = RunningSum(
+                        days[bounds[i] : bounds[i + 1]], sums[bounds[i] : bounds[i + 1]]
+                    )
+        except Exception as e:
+            logging.error(f"Failed to load account balances {path}: {str(e)}")
+            return None
+        return balances
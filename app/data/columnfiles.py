@@ -0,0 +1,134 @@
+"""Module for the memory-mapped binary files of the expense columns."""
+
+import json
+import mmap
+import os
+from array import array
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+
+from .records import COLUMN_TYPES, ExpenseColumns, StringPool
+
+FORMAT_VERSION = 1
+
+
+class MappedStrings(Sequence[str]):
+    """Read-only sequence of UTF-8 strings, decoded on access from a mapped file."""
+
+    __slots__ = ("data", "offsets")
+
+    def __init__(self, data: memoryview, offsets: memoryview):
+        self.data = data
+        self.offsets = offsets  # Start of every string, and end of the last one
+
+    def __len__(self) -> int:
+        return max(len(self.offsets) - 1, 0)
+
+    def __getitem__(self, row: int) -> str:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return str(self.data[self.offsets[row] : self.offsets[row + 1]], "utf-8")
+
+
+def _map(path: Path) -> memoryview:
+    """Map a whole file read-only."""
+    with path.open(mode="rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return memoryview(b"")  # Empty files cannot be mapped
+        return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _write(path: Path, data):
+    with path.open(mode="wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def column_files(directory: Path, generation: str) -> dict:
+    """Return the paths of the files of a generation, keyed by column."""
+    names = [*COLUMN_TYPES, "live", "notes", "note_offsets", "dictionary"]
+    return {name: Path(directory) / f"{generation}.{name}" for name in names}
+
+
+def write_columns(directory: Path, generation: str, columns: ExpenseColumns):
+    """Write the columns as a new generation of column files.
+
+    Numeric columns are written as raw native arrays (cost as float64, day
+    ordinals as int32, codes as int32), the notes as concatenated UTF-8 with
+    their offsets, and the string pools to a JSON dictionary sidecar, written
+    last.
+    """
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    files = column_files(directory, generation)
+    for name in COLUMN_TYPES:
+        _write(files[name], getattr(columns, name))
+    _write(files["live"], columns.live)
+
+    notes = bytearray()
+    offsets = array("q", [0])
+    for note in columns.notes:
+        notes += note.encode()
+        offsets.append(len(notes))
+    _write(files["notes"], notes)
+    _write(files["note_offsets"], offsets)
+
+    dictionary = {
+        "version": FORMAT_VERSION,
+        "rows": len(columns),
+        "categories": columns.categories.values,
+        "currencies": columns.currencies.values,
+        "accounts": columns.accounts.values,
+    }
+    _write(files["dictionary"], json.dumps(dictionary).encode())
+
+
+def map_columns(directory: Path, generation: str) -> ExpenseColumns:
+    """Open a generation of column files without reading or copying them.
+
+    Only the liveness flags, which are modified in place, are copied.
+    """
+    files = column_files(directory, generation)
+    dictionary = json.loads(files["dictionary"].read_text())
+    if dictionary["version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported column files version: {dictionary['version']}")
+
+    arrays = {
+        name: np.frombuffer(_map(files[name]), dtype=typecode)
+        for name, typecode in COLUMN_TYPES.items()
+    }
+    live = np.frombuffer(_map(files["live"]), dtype=np.uint8).copy()
+    notes = MappedStrings(_map(files["notes"]), _map(files["note_offsets"]).cast("q"))
+
+    rows = dictionary["rows"]
+    if (
+        len(live) != rows
+        or len(notes) != rows
+        or any(len(column) != rows for column in arrays.values())
+    ):
+        raise ValueError(f"Truncated column files of generation {generation}")
+    columns = ExpenseColumns.from_arrays(
+        arrays,
+        live,
+        notes,
+        StringPool.from_values(dictionary["categories"]),
+        StringPool.from_values(dictionary["currencies"]),
+        StringPool.from_values(dictionary["accounts"]),
+    )
+    return columns
+
+
+def remove_columns(directory: Path, keep: str):
+    """Delete the column files of all the generations but one."""
+    if not Path(directory).exists():
+        return
+    for path in Path(directory).iterdir():
+        if not path.name.startswith(f"{keep}."):
+            try:
+                path.unlink()
+            except OSError:
+                pass  # Still mapped on some platforms: removed next time
@@ -0,0 +1,81 @@
+"""Module for the files of the ledgers shared between processes.
+
+Every file is either locked while it is modified in place, or written to a
+temporary file of its own and swapped in, so that concurrent writers never
+see or clobber each other's partial files.
+"""
+
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: the lock only serializes the threads
+    fcntl = None
+
+
+class FileLock:
+    """Exclusive lock of a file, held by one thread of one process at a time.
+
+    The lock is reentrant, like threading.RLock: the file is locked (with
+    flock) by the outermost acquisition only. Two FileLock objects on the same
+    path exclude each other, even within a process.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self) -> "FileLock":
+        self._lock.acquire()
+        try:
+            if self._depth == 0:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = self.path.open(mode="ab")
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._lock.release()
+            raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            # Closing the file releases the flock
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+@contextmanager
+def atomic_write(path: Path, fsync: bool = False) -> Iterator[BinaryIO]:
+    """Write a file through a temporary file, swapped in once complete.
+
+    The temporary file has a unique name, in the directory of the file so
+    that the swap is atomic, and is removed if the write fails.
+    """
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(
+        dir=path.parent, prefix=f"{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, mode="wb") as file:
+            yield file
+            file.flush()
+            if fsync:
+                os.fsync(file.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
@@ -0,0 +1,282 @@
+"""Module for the time-partitioned archive of a ledger."""
+
+import csv
+import io
+import json
+import logging
+import zlib
+from dataclasses import asdict, dataclass
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .aggregate import CUBE_COLUMNS, aggregate_expenses
+from .locks import atomic_write
+from .records import ExpenseColumns, format_day, parse_day
+
+PERIODS = ("year", "month")
+MANIFEST_VERSION = 1
+# Same columns as the ledger log, so archived rows are plain "add" entries
+FIELDS = ["id", "op", *ExpenseColumns.FIELDS]
+
+
+def period_of(day: int, period: str) -> str:
+    """Return the key of the partition holding the given day ordinal."""
+    value = date.fromordinal(day)
+    if period == "year":
+        return f"{value.year:04d}"
+    return f"{value.year:04d}-{value.month:02d}"
+
+
+@dataclass
+class Partition:
+    """Manifest entry of a partition file."""
+
+    file: str
+    rows: int
+    first_date: str
+    last_date: str
+    min_id: int
+    max_id: int
+    checksum: int  # CRC32 of the file
+    # Sums by month, category, account and currency, as
+    # [month ("YYYY-MM"), category, account, currency, cost, count] lists
+    aggregates: List[list]
+
+    def overlaps(self, start: Optional[int], end: Optional[int]) -> bool:
+        return (start is None or parse_day(self.last_date) >= start) and (
+            end is None or parse_day(self.first_date) <= end
+        )
+
+    def within(self, start: Optional[int], end: Optional[int]) -> bool:
+        return (start is None or parse_day(self.first_date) >= start) and (
+            end is None or parse_day(self.last_date) <= end
+        )
+
+
+class PartitionStore:
+    """Archive of the expenses of a ledger, with one CSV file per period.
+
+    A manifest records the row count, date bounds, id bounds and checksum of
+    every partition, along with its aggregates. Partition files are named
+    after their checksum and never modified: a compaction only writes the
+    partitions whose content changed, then swaps the manifest, so unchanged
+    historical partitions keep their file and cached aggregates.
+
+    The archive only holds the expenses as of the last compaction: the entries
+    written since are in the ledger file, which must be replayed on top of it.
+    """
+
+    def __init__(self, directory: Path, period: Optional[str] = None):
+        if period is not None and period not in PERIODS:
+            raise ValueError(f"Unknown partition period: {period}")
+        self.directory = Path(directory)
+        self.period = period
+
+    @property
+    def manifest_file(self) -> Path:
+        return self.directory / "manifest.json"
+
+    def exists(self) -> bool:
+        return self.manifest_file.exists()
+
+    def load(self) -> Dict[str, Partition]:
+        """Read the manifest, keyed and sorted by partition key."""
+        if not self.exists():
+            return {}
+        with self.manifest_file.open(mode="r") as file:
+            manifest = json.load(file)
+        if manifest["version"] != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest version: {manifest['version']}")
+        partitions = manifest["partitions"]
+        return {key: Partition(**partitions[key]) for key in sorted(partitions)}
+
+    def read(self, partition: Partition) -> Iterator[dict]:
+        """Iterate over the entries of a partition file."""
+        data = (self.directory / partition.file).read_bytes()
+        if zlib.crc32(data) != partition.checksum:
+            logging.warning(f"Checksum mismatch of partition {partition.file}")
+        yield from csv.DictReader(io.StringIO(data.decode(), newline=""))
+
+    def entries(self) -> Iterator[dict]:
+        """Iterate over the entries of all the partitions, in period order."""
+        for partition in self.load().values():
+            yield from self.read(partition)
+
+    def write(
+        self,
+        columns: ExpenseColumns,
+        ranges: Dict[str, Tuple[int, int]],
+        keep: Iterable[str] = (),
+    ) -> List[Path]:
+        """Archive the rows of the columns, split by period into row ranges.
+
+        The partitions of the `keep` periods are kept as they are, all the
+        others are replaced. Returns the files which are no longer referenced
+        by the manifest: they must only be deleted once the ledger file has
+        been truncated.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        previous = self.load()
+        partitions = {key: previous[key] for key in keep if key not in ranges}
+        for key, (start, stop) in ranges.items():
+            buffer = io.StringIO(newline="")
+            writer = csv.writer(buffer)
+            writer.writerow(FIELDS)
+            for row in range(start, stop):
+                record = columns[row]
+                writer.writerow([record.id, "add", *record[1:]])
+            data = buffer.getvalue().encode()
+            checksum = zlib.crc32(data)
+            old = previous.get(key)
+            if old is not None and old.checksum == checksum:
+                partitions[key] = old  # Unchanged: keep the cached aggregates
+                continue
+            partition = Partition(
+                file=f"{key}.{checksum:08x}.csv",
+                rows=stop - start,
+                first_date=format_day(int(columns.day[start])),
+                last_date=format_day(int(columns.day[stop - 1])),
+                min_id=int(columns.ids[start:stop].min()),
+                max_id=int(columns.ids[start:stop].max()),
+                checksum=checksum,
+                aggregates=self._aggregate(columns, start, stop),
+            )
+            self._write_file(self.directory / partition.file, data)
+            partitions[key] = partition
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "period": self.period,
+            "partitions": {key: asdict(p) for key, p in partitions.items()},
+        }
+        self._write_file(self.manifest_file, json.dumps(manifest).encode())
+        referenced = {p.file for p in partitions.values()} | {self.manifest_file.name}
+        return [
+            path for path in self.directory.iterdir() if path.name not in referenced
+        ]
+
+    def read_columns(
+        self,
+        partitions: Iterable[Partition],
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> ExpenseColumns:
+        """Read the expenses of partitions between two day ordinals, both included.
+
+        Only valid for partitions not modified by the ledger file.
+        """
+        columns = ExpenseColumns()
+        for partition in partitions:
+            for entry in self.read(partition):
+                try:
+                    day = parse_day(entry["date"])
+                    if (start is None or day >= start) and (end is None or day <= end):
+                        columns.append(
+                            int(entry["id"]),
+                            entry["category"],
+                            float(entry["cost"]),
+                            entry["note"],
+                            day,
+                            entry["currency"],
+                            entry["account"],
+                        )
+                except (KeyError, TypeError, ValueError) as e:
+                    logging.error(f"Skipping invalid entry {entry}: {str(e)}")
+        return columns
+
+    def remove(self) -> List[Path]:
+        """Return all the files of the archive, the manifest first, to delete it."""
+        if not self.directory.exists():
+            return []
+        files = [
+            path for path in self.directory.iterdir() if path != self.manifest_file
+        ]
+        return [self.manifest_file] + files if self.exists() else files
+
+    def delete(self, files: List[Path]):
+        """Delete files returned by write or remove, and the archive if empty."""
+        for path in files:
+            path.unlink(missing_ok=True)
+        if self.directory.exists() and not any(self.directory.iterdir()):
+            self.directory.rmdir()
+
+    @staticmethod
+    def _aggregate(columns: ExpenseColumns, start: int, stop: int) -> List[list]:
+        cube = aggregate_expenses(columns, np.arange(start, stop))
+        cube["date"] = cube["date"].dt.strftime("%Y-%m")
+        return [
+            [month, category, account, currency, float(cost), int(count)]
+            for month, category, account, currency, cost, count in cube.itertuples(
+                index=False
+            )
+        ]
+
+    @staticmethod
+    def _write_file(path: Path, data: bytes):
+        with atomic_write(path, fsync=True) as file:
+            file.write(data)
+
+    def read_range(
+        self, log_file: Path, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Tuple[ExpenseColumns, pd.DataFrame]:
+        """Read the expenses between two day ordinals, both included.
+
+        Only the partitions overlapping the range are opened. Partitions fully
+        inside the range, and not modified by the ledger file, are served from
+        their cached aggregates, returned as a frame with the columns of
+        aggregate_expenses. All the other expenses are returned as columns.
+        """
+        log = []
+        if log_file.exists():
+            with log_file.open(mode="r", newline="") as file:
+                log = list(csv.DictReader(file))
+        modified = sorted(int(entry["id"]) for entry in log)
+
+        def is_modified(partition: Partition) -> bool:
+            position = np.searchsorted(modified, partition.min_id)
+            return position < len(modified) and modified[position] <= partition.max_id
+
+        latest: Dict[int, Optional[dict]] = {}
+        aggregates = []
+        for partition in self.load().values():
+            if not partition.overlaps(start, end):
+                continue
+            if partition.within(start, end) and not is_modified(partition):
+                aggregates.extend(partition.aggregates)
+                continue
+            for entry in self.read(partition):
+                latest[int(entry["id"])] = entry
+        for entry in log:
+            latest[int(entry["id"])] = None if entry["op"] == "delete" else entry
+
+        columns = ExpenseColumns()
+        for expense_id, entry in latest.items():
+            if entry is None:
+                continue
+            try:
+                day = parse_day(entry["date"])
+                if (start is None or day >= start) and (end is None or day <= end):
+                    columns.append(
+                        expense_id,
+                        entry["category"],
+                        float(entry["cost"]),
+                        entry["note"],
+                        day,
+                        entry["currency"],
+                        entry["account"],
+                    )
+            except (KeyError, TypeError, ValueError) as e:
+                logging.error(f"Skipping invalid entry {entry}: {str(e)}")
+
+        return columns, aggregates_frame(aggregates)
+
+
+def aggregates_frame(aggregates: List[list]) -> pd.DataFrame:
+    """Convert the aggregates of partitions into a frame like aggregate_expenses."""
+    cube = pd.DataFrame(aggregates, columns=CUBE_COLUMNS)
+    cube["date"] = pd.to_datetime(cube["date"], format="%Y-%m")
+    return cube
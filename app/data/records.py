@@ -0,0 +1,353 @@
+"""Module for the compact in-memory representation of the expenses."""
+
+import sys
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Iterator, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from ..config import DATE_FORMAT, KILL_LOG_VERSIONS
+
+# Type codes of the numeric columns, shared by the arrays and the column files
+COLUMN_TYPES = {
+    "ids": "q",
+    "cost": "d",
+    "day": "i",
+    "category": "i",
+    "currency": "i",
+    "account": "i",
+}
+
+MIN_CAPACITY = 1024  # Rows allocated by the first append
+
+
+@lru_cache(maxsize=None)
+def parse_day(value: str) -> int:
+    """Parse a date string into its day ordinal, validating its format."""
+    try:
+        return datetime.strptime(value, DATE_FORMAT).toordinal()
+    except (TypeError, ValueError):
+        raise ValueError(f"Date must be in the format {DATE_FORMAT}")
+
+
+@lru_cache(maxsize=None)
+def format_day(day: int) -> str:
+    """Format a day ordinal as a date string."""
+    return date.fromordinal(day).strftime(DATE_FORMAT)
+
+
+class StringPool:
+    """Dictionary coder mapping repeated strings to small integer codes."""
+
+    __slots__ = ("values", "_codes")
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        """Return the code of the value, adding it to the pool if necessary."""
+        code = self._codes.get(value)
+        if code is None:
+            value = sys.intern(value)
+            code = len(self.values)
+            self.values.append(value)
+            self._codes[value] = code
+        return code
+
+    def decode(self, code: int) -> str:
+        return self.values[code]
+
+    @classmethod
+    def from_values(cls, values: List[str]) -> "StringPool":
+        pool = cls()
+        for value in values:
+            pool.encode(value)
+        return pool
+
+    def copy(self) -> "StringPool":
+        pool = StringPool()
+        pool.values = list(self.values)
+        pool._codes = dict(self._codes)
+        return pool
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class ExpenseRecord(NamedTuple):
+    """Read-only view of a single expense."""
+
+    id: int
+    category: str
+    cost: float
+    note: str
+    date: str
+    currency: str
+    account: str
+
+    def dict(self) -> dict:
+        return self._asdict()
+
+
+class Prefix(Sequence[str]):
+    """Read-only view of the first items of a sequence which only grows."""
+
+    __slots__ = ("items", "length")
+
+    def __init__(self, items: Sequence[str], length: int):
+        self.items = items
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, row: int) -> str:
+        if row < 0:
+            row += self.length
+        if not 0 <= row < self.length:
+            raise IndexError(row)
+        return self.items[row]
+
+    def __iter__(self) -> Iterator[str]:
+        return islice(self.items, self.length)
+
+
+def _column(name: str) -> property:
+    return property(
+        lambda self: self._arrays[name][: self._length],
+        doc=f"The {name} of the rows, as a NumPy array.",
+    )
+
+
+class ExpenseColumns:
+    """Column store holding the expenses of a tracker.
+
+    Costs and dates (as day ordinals) are kept in typed arrays, while category,
+    currency and account are dictionary-coded through a StringPool, so that
+    every repeated value is stored only once. Values are expected to be
+    validated before being appended.
+
+    Every row is a version of the expense with the given id: rows superseded
+    by a newer version or deleted are only marked as dead in `live`.
+
+    The arrays have spare capacity, doubled when full, so rows are appended
+    in place and the rows already written never move. The columns may also be
+    read-only views, of memory-mapped column files (see columnfiles) or of
+    other columns (see read_view): they are then copied on the first append.
+
+    A single writer appends and kills rows, and publishes them with commit.
+    Readers on other threads get consistent views of the committed rows from
+    read_view, without any lock: the committed rows are only ever modified by
+    kills, which are logged with the version of the write making them.
+    """
+
+    FIELDS = ("category", "cost", "note", "date", "currency", "account")
+
+    ids = _column("ids")
+    cost = _column("cost")
+    day = _column("day")
+    category = _column("category")
+    currency = _column("currency")
+    account = _column("account")
+
+    def __init__(self):
+        self._arrays: Dict[str, np.ndarray] = {
+            name: np.empty(0, dtype=typecode) for name, typecode in COLUMN_TYPES.items()
+        }
+        self._live = np.empty(0, dtype=np.uint8)
+        self._length = 0
+        self.notes: Sequence[str] = []
+        self.categories = StringPool()
+        self.currencies = StringPool()
+        self.accounts = StringPool()
+        self._head: Tuple[int, int] = (0, 0)  # Committed rows, and their version
+        # Version before which the kill log was pruned, and the (version, row)
+        # of the rows killed since
+        self._kills: Tuple[int, List[Tuple[int, int]]] = (0, [])
+
+    @classmethod
+    def from_arrays(
+        cls,
+        arrays: Dict[str, np.ndarray],
+        live: np.ndarray,
+        notes: Sequence[str],
+        categories: StringPool,
+        currencies: StringPool,
+        accounts: StringPool,
+    ) -> "ExpenseColumns":
+        """Wrap existing arrays of the same length, committed as they are.
+
+        Read-only arrays are copied on the first append, while live is
+        modified in place and must be a private copy.
+        """
+        columns = cls()
+        columns._arrays = dict(arrays)
+        columns._live = live
+        columns._length = len(live)
+        columns.notes = notes
+        columns.categories = categories
+        columns.currencies = currencies
+        columns.accounts = accounts
+        columns._head = (len(live), 0)
+        return columns
+
+    @property
+    def live(self) -> np.ndarray:
+        """Whether each row is live (1) or dead (0)."""
+        return self._live[: self._length]
+
+    def append(
+        self,
+        expense_id: int,
+        category: str,
+        cost: float,
+        note: str,
+        day: int,
+        currency: str,
+        account: str,
+    ) -> int:
+        """Append an expense and return its row number."""
+        row = self._length
+        if row == len(self._live) or self.mapped:
+            self._grow(max(MIN_CAPACITY, 2 * row))
+        arrays = self._arrays
+        arrays["ids"][row] = expense_id
+        arrays["category"][row] = self.categories.encode(category)
+        arrays["cost"][row] = cost
+        arrays["day"][row] = day
+        arrays["currency"][row] = self.currencies.encode(currency)
+        arrays["account"][row] = self.accounts.encode(account)
+        self._live[row] = 1
+        self.notes.append(note)
+        self._length = row + 1
+        return row
+
+    @property
+    def mapped(self) -> bool:
+        """Whether the columns are read-only views, copied on the first append."""
+        return not self._arrays["cost"].flags.writeable
+
+    def _grow(self, capacity: int):
+        """Move the rows to new arrays with the given capacity.
+
+        The new arrays are swapped in at once: readers keep reading the rows
+        they need from the old ones.
+        """
+        length = self._length
+        arrays = {}
+        for name, typecode in COLUMN_TYPES.items():
+            arrays[name] = np.empty(capacity, dtype=typecode)
+            arrays[name][:length] = self._arrays[name][:length]
+        live = np.zeros(capacity, dtype=np.uint8)
+        live[:length] = self._live[:length]
+        if not isinstance(self.notes, list):
+            self.notes = list(self.notes)
+        self._arrays, self._live = arrays, live
+
+    def view(self, name: str) -> np.ndarray:
+        """Return a NumPy view of a column, without copying it."""
+        return getattr(self, name)
+
+    def commit(self):
+        """Publish the rows appended and killed so far to read_view."""
+        length, version = self._length, self._head[1] + 1
+        cutoff, kills = self._kills
+        if kills and kills[0][0] <= version - KILL_LOG_VERSIONS:
+            cutoff = version - KILL_LOG_VERSIONS
+            self._kills = (cutoff, [kill for kill in kills if kill[0] > cutoff])
+        self._head = (length, version)
+
+    @property
+    def version(self) -> int:
+        """Number of commits of the columns."""
+        return self._head[1]
+
+    def read_view(self) -> "ExpenseColumns":
+        """Return a read-only view of the committed rows, safe from any thread.
+
+        Only the liveness flags are copied: the rows killed after the commit
+        are restored from the kill log, and the rows appended after it are
+        cut off. The view is copied on the first append, like mapped columns.
+        """
+        while True:
+            length, version = self._head
+            arrays, live = self._arrays, self._live
+            live = live[:length].copy()
+            cutoff, kills = self._kills
+            if cutoff > version:
+                continue  # The kills of the commit were pruned meanwhile
+            for kill_version, row in list(kills):
+                if kill_version > version and row < length:
+                    live[row] = 1
+            break
+        view = {}
+        for name, column in arrays.items():
+            view[name] = column[:length]
+            view[name].flags.writeable = False
+        return ExpenseColumns.from_arrays(
+            view,
+            live,
+            Prefix(self.notes, length),
+            StringPool.from_values(self.categories.values[:]),
+            StringPool.from_values(self.currencies.values[:]),
+            StringPool.from_values(self.accounts.values[:]),
+        )
+
+    def tail(self, start: int) -> "ExpenseColumns":
+        """Return an independent copy of the rows from the given one on."""
+        return ExpenseColumns.from_arrays(
+            {name: column[start:].copy() for name, column in self._columns()},
+            self.live[start:].copy(),
+            [self.notes[row] for row in range(start, len(self))],
+            self.categories.copy(),
+            self.currencies.copy(),
+            self.accounts.copy(),
+        )
+
+    def _columns(self) -> Iterator[Tuple[str, np.ndarray]]:
+        return ((name, getattr(self, name)) for name in COLUMN_TYPES)
+
+    def kill(self, row: int):
+        """Mark a row as dead, as of the next commit."""
+        self._kills[1].append((self._head[1] + 1, row))
+        self._live[row] = 0
+
+    def live_rows(self) -> List[int]:
+        """Return the row numbers of the live expenses."""
+        return np.flatnonzero(self.live).tolist()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, row: int) -> ExpenseRecord:
+        if not 0 <= row < self._length:
+            raise IndexError(row)
+        arrays = self._arrays
+        return ExpenseRecord(
+            id=int(arrays["ids"][row]),
+            category=self.categories.values[arrays["category"][row]],
+            cost=float(arrays["cost"][row]),
+            note=self.notes[row],
+            date=format_day(int(arrays["day"][row])),
+            currency=self.currencies.values[arrays["currency"][row]],
+            account=self.accounts.values[arrays["account"][row]],
+        )
+
+    def __iter__(self) -> Iterator[ExpenseRecord]:
+        """Iterate over the live expenses."""
+        return (self[row] for row in self.live_rows())
+
+    def nbytes(self) -> int:
+        """Approximate memory used by the columns, in bytes.
+
+        Memory-mapped columns are shared with the page cache and not counted,
+        nor are the columns of views.
+        """
+        size = self._live.nbytes
+        if not self.mapped:
+            size += sum(column.nbytes for column in self._arrays.values())
+            size += sys.getsizeof(self.notes) + sum(map(sys.getsizeof, self.notes))
+        return size
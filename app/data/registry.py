@@ -0,0 +1,173 @@
+"""Module to manage the expense trackers of several ledgers."""
+
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ..config import (
+    CSV_PATH,
+    DEFAULT_LEDGER_ID,
+    LEDGER_DIR,
+    MAX_LEDGER_STATS,
+    MAX_LOADED_EXPENSES,
+    MAX_LOADED_LEDGERS,
+)
+from .tracker import ExpenseTracker
+
+LEDGER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+@dataclass
+class LedgerStats:
+    hits: int = 0
+    loads: int = 0
+    evictions: int = 0
+
+
+class TrackerRegistry:
+    """LRU registry of the expense trackers, keyed by ledger id.
+
+    Trackers are loaded on demand and the least recently used ones are evicted
+    as soon as the number of loaded ledgers or the total number of loaded
+    expenses exceeds the configured budget. The most recently requested
+    tracker is never evicted, even if it exceeds the budget on its own.
+
+    The counters of a ledger outlive its eviction, so that reloads show up in
+    its loads. They are kept for the max_stats ledgers requested last only,
+    so that the memory used does not grow with the ids requested. An
+    evicted tracker may still be in use by a
+    request while the ledger is loaded again: both stay consistent, since
+    the trackers of a ledger serialize their writes through its lock file.
+    """
+
+    def __init__(
+        self,
+        ledger_dir: Path = LEDGER_DIR,
+        max_trackers: int = MAX_LOADED_LEDGERS,
+        max_expenses: int = MAX_LOADED_EXPENSES,
+        default_ledger_id: str = DEFAULT_LEDGER_ID,
+        default_csv_file: Path = CSV_PATH,
+        max_stats: int = MAX_LEDGER_STATS,
+    ):
+        if max_trackers < 1:
+            raise ValueError("max_trackers must be at least 1")
+        self.ledger_dir = Path(ledger_dir)
+        self.max_trackers = max_trackers
+        self.max_expenses = max_expenses
+        self.default_ledger_id = default_ledger_id
+        self.default_csv_file = Path(default_csv_file)
+        self.max_stats = max_stats
+        self._trackers: "OrderedDict[str, ExpenseTracker]" = OrderedDict()
+        self._stats: "OrderedDict[str, LedgerStats]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self.evictions = 0
+
+    def ledger_path(self, ledger_id: str) -> Path:
+        """Return the CSV file backing the given ledger."""
+        if ledger_id == self.default_ledger_id:
+            return self.default_csv_file
+        if not LEDGER_ID_PATTERN.match(ledger_id):
+            raise ValueError(f"Invalid ledger id: {ledger_id!r}")
+        return self.ledger_dir / f"{ledger_id}.csv"
+
+    def get(self, ledger_id: Optional[str] = None) -> ExpenseTracker:
+        """Return the tracker of the given ledger, loading it if necessary."""
+        ledger_id = ledger_id or self.default_ledger_id
+        path = self.ledger_path(ledger_id)
+
+        with self._lock:
+            stats = self._ledger_stats(ledger_id)
+            tracker = self._trackers.get(ledger_id)
+            if tracker is not None:
+                self._trackers.move_to_end(ledger_id)
+                stats.hits += 1
+                return tracker
+            load_lock = self._load_locks.setdefault(ledger_id, threading.Lock())
+
+        # Load outside of the registry lock so that other ledgers stay available,
+        # while concurrent requests for the same ledger wait for a single load.
+        with load_lock:
+            with self._lock:
+                tracker = self._trackers.get(ledger_id)
+                if tracker is not None:
+                    self._trackers.move_to_end(ledger_id)
+                    self._ledger_stats(ledger_id).hits += 1
+                    return tracker
+
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tracker = ExpenseTracker(path)
+            except BaseException:
+                with self._lock:
+                    if ledger_id not in self._trackers:
+                        self._forget(ledger_id)
+                raise
+
+            with self._lock:
+                self._trackers[ledger_id] = tracker
+                self._ledger_stats(ledger_id).loads += 1
+                self._enforce_budget()
+            return tracker
+
+    def evict(self, ledger_id: str) -> bool:
+        """Drop the tracker of the given ledger from memory."""
+        with self._lock:
+            if self._trackers.pop(ledger_id, None) is None:
+                return False
+            self._evicted(ledger_id)
+            return True
+
+    def _ledger_stats(self, ledger_id: str) -> LedgerStats:
+        """Return the counters of a ledger, dropping the least recently
+        requested ones of the ledgers not loaded beyond max_stats."""
+        stats = self._stats.get(ledger_id)
+        if stats is None:
+            stats = self._stats[ledger_id] = LedgerStats()
+            for old_id in list(self._stats):
+                if len(self._stats) <= self.max_stats:
+                    break
+                if old_id not in self._trackers and old_id != ledger_id:
+                    del self._stats[old_id]
+        self._stats.move_to_end(ledger_id)
+        return stats
+
+    def _evicted(self, ledger_id: str):
+        """Count the eviction of a ledger, and drop its bookkeeping."""
+        # The counters of the loaded ledgers are never dropped
+        self._stats[ledger_id].evictions += 1
+        self.evictions += 1
+        self._forget(ledger_id)
+
+    def _forget(self, ledger_id: str):
+        """Drop the load lock of a ledger which is not loaded."""
+        self._load_locks.pop(ledger_id, None)
+
+    def _enforce_budget(self):
+        """Evict least recently used trackers until the budget is respected."""
+        while len(self._trackers) > 1 and (
+            len(self._trackers) > self.max_trackers
+            or self._loaded_expenses() > self.max_expenses
+        ):
+            ledger_id, _ = self._trackers.popitem(last=False)
+            self._evicted(ledger_id)
+
+    def _loaded_expenses(self) -> int:
+        return sum(len(tracker.expenses) for tracker in self._trackers.values())
+
+    def loaded_ledgers(self) -> List[str]:
+        """Return the loaded ledger ids, from least to most recently used."""
+        with self._lock:
+            return list(self._trackers)
+
+    def get_stats(self) -> Dict[str, dict]:
+        """Return the hit/load/eviction counters of the ledgers requested
+        last, loaded or not."""
+        with self._lock:
+            return {
+                ledger_id: {**asdict(stats), "loaded": ledger_id in self._trackers}
+                for ledger_id, stats in self._stats.items()
+            }
@@ -0,0 +1,108 @@
+"""Module for the full-text search index over the expenses."""
+
+import logging
+import pickle
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from .locks import atomic_write
+
+MIN_QUERY_LENGTH = 3
+
+
+def trigrams(text: str) -> Set[str]:
+    """Return the set of lowercase trigrams of a text."""
+    text = text.lower()
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def _contains(posting: array, row: int) -> bool:
+    position = bisect_left(posting, row)
+    return position < len(posting) and posting[position] == row
+
+
+class TrigramIndex:
+    """Inverted index from trigrams to the rows whose text contains them.
+
+    Rows are expected to be added in increasing order, so every posting list
+    stays sorted. The index only returns candidates: the caller must check
+    that the query really is a substring of the candidate texts.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self):
+        self.postings: Dict[str, array] = {}
+        self.rows = 0  # Number of rows indexed so far
+        self.last_text: Optional[str] = None
+
+    def add(self, row: int, text: str):
+        """Index the text of a row."""
+        for trigram in trigrams(text):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                posting = self.postings[trigram] = array("i")
+            posting.append(row)
+        self.rows = row + 1
+        self.last_text = text
+
+    def candidates(self, query: str) -> Optional[List[int]]:
+        """Return the rows which may contain the query, in increasing order.
+
+        Returns None when the query is too short to use the index.
+        """
+        query_trigrams = trigrams(query)
+        if len(query) < MIN_QUERY_LENGTH or not query_trigrams:
+            return None
+        postings = []
+        for trigram in query_trigrams:
+            posting = self.postings.get(trigram)
+            if posting is None:
+                return []
+            postings.append(posting)
+        # Probe the longer posting lists with binary searches, starting from
+        # the shortest one, so the cost depends on the rarest trigram only.
+        postings.sort(key=len)
+        result = postings[0].tolist()
+        for posting in postings[1:]:
+            result = [row for row in result if _contains(posting, row)]
+            if not result:
+                break
+        return result
+
+    def save(self, path: Path):
+        """Persist the index to a file."""
+        state = {
+            "version": self.FORMAT_VERSION,
+            "rows": self.rows,
+            "last_text": self.last_text,
+            "postings": {
+                key: posting.tobytes() for key, posting in self.postings.items()
+            },
+        }
+        with atomic_write(path) as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: Path) -> "TrigramIndex":
+        """Load a persisted index, or return an empty one if it is unusable."""
+        index = cls()
+        if not path.exists():
+            return index
+        try:
+            with path.open("rb") as file:
+                state = pickle.load(file)
+            if state["version"] != cls.FORMAT_VERSION:
+                return index
+            for key, data in state["postings"].items():
+                posting = array("i")
+                posting.frombytes(data)
+                index.postings[key] = posting
+            index.rows = state["rows"]
+            index.last_text = state["last_text"]
+        except Exception as e:
+            logging.error(f"Failed to load search index {path}: {str(e)}")
+            return cls()
+        return index
@@ -0,0 +1,502 @@
+"""Module for the mergeable quantile sketches of the expense costs."""
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from ..config import SKETCH_COMPRESSION
+from .aggregate import month_of
+from .locks import atomic_write
+from .partitions import period_of
+from .records import ExpenseColumns
+
+FORMAT_VERSION = 1
+BUFFER_FACTOR = 5  # Values buffered by a digest, per unit of compression
+# Dimensions of the sketches, and the string pools of their values
+DIMENSIONS = {"category": "categories", "account": "accounts"}
+
+# (dimension, value of the dimension, currency) of a sketch
+SketchKey = Tuple[str, str, str]
+
+
+def compress(
+    means: np.ndarray, weights: np.ndarray, groups: np.ndarray, compression: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Merge sorted centroids into the clusters of a t-digest, group by group.
+
+    The centroids must be sorted by group, then by mean. Every centroid goes
+    to the cluster of its quantile in its group, through the logarithmic k2
+    scale function of the t-digest: the clusters are about compression / 4
+    wide at the median and shrink geometrically towards single values in the
+    tails, so that outliers are not blurred with the bulk of the values. The
+    first and last centroids of a group are always kept apart. Returns the
+    means, weights and groups of the clusters, in the same order.
+    """
+    if not len(means):
+        return means, weights, groups
+    ends = np.cumsum(weights)
+    boundaries = np.flatnonzero(np.diff(groups)) + 1
+    starts = np.concatenate(([0], boundaries))
+    before = np.concatenate(([0.0], ends[boundaries - 1]))
+    sizes = np.diff(np.concatenate((before, [ends[-1]])))
+    group_index = np.repeat(np.arange(len(starts)), np.diff([*starts, len(means)]))
+    q = (ends - weights / 2 - before[group_index]) / sizes[group_index]
+    normalizer = 4 * np.log(np.maximum(sizes / compression, 1.0)) + 24
+    k = np.floor(compression / normalizer[group_index] * np.log(q / (1 - q)))
+    breaks = np.concatenate(([True], (np.diff(groups) != 0) | (np.diff(k) != 0)))
+    breaks[np.minimum(starts + 1, len(means) - 1)] = True
+    breaks[np.concatenate((boundaries - 1, [len(means) - 1]))] = True
+    first = np.flatnonzero(breaks)
+    cluster_weights = np.add.reduceat(weights, first)
+    cluster_means = np.add.reduceat(means * weights, first) / cluster_weights
+    return cluster_means, cluster_weights, groups[first]
+
+
+class TDigest:
+    """Mergeable sketch of a distribution, for approximate quantiles (t-digest).
+
+    The values are summarized by weighted centroids, small in the tails, so
+    that the extreme quantiles stay accurate. Added values are buffered and
+    merged into the centroids in batches. Digests of disjoint sets of values
+    are merged by merging their centroids, e.g. to sum up several months.
+    """
+
+    __slots__ = (
+        "compression",
+        "means",
+        "weights",
+        "minimum",
+        "maximum",
+        "_buffer",
+        "_merged_centroids",
+    )
+
+    def __init__(self, compression: float = SKETCH_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self._buffer: List[float] = []
+        # Centroids with the buffered values merged, computed once per buffer
+        self._merged_centroids: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    @property
+    def count(self) -> int:
+        return int(self.weights.sum()) + len(self._buffer)
+
+    def add(self, value: float):
+        self._buffer.append(value)
+        self._merged_centroids = None
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        if len(self._buffer) >= BUFFER_FACTOR * self.compression:
+            self._flush()
+
+    def _merged(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the means and weights of the centroids, buffered values merged.
+
+        The digest is left as it is, so it may be read by several threads:
+        the result is only cached, the buffer of a frozen copy never changing.
+        """
+        if not self._buffer:
+            return self.means, self.weights
+        merged = self._merged_centroids
+        if merged is None:
+            means = np.concatenate((self.means, self._buffer))
+            weights = np.concatenate((self.weights, np.ones(len(self._buffer))))
+            order = np.argsort(means, kind="stable")
+            means, weights, _ = compress(
+                means[order], weights[order], np.zeros(len(means)), self.compression
+            )
+            merged = self._merged_centroids = (means, weights)
+        return merged
+
+    def _flush(self):
+        """Merge the buffered values into the centroids."""
+        if self._buffer:
+            self.means, self.weights = self._merged()
+            self._buffer = []
+            self._merged_centroids = None
+
+    @classmethod
+    def merge(
+        cls,
+        digests: List["TDigest"],
+        scales: Optional[List[float]] = None,
+        compression: float = SKETCH_COMPRESSION,
+    ) -> "TDigest":
+        """Merge digests, optionally scaling their values, e.g. by FX rates."""
+        scales = [1.0] * len(digests) if scales is None else scales
+        merged = cls(compression)
+        pairs = [(d, s) for d, s in zip(digests, scales) if d.count]
+        if not pairs:
+            return merged
+        digests, scales = zip(*pairs)
+        centroids = [digest._merged() for digest in digests]
+        means = np.concatenate([m * s for (m, _), s in zip(centroids, scales)])
+        weights = np.concatenate([w for _, w in centroids])
+        order = np.argsort(means, kind="stable")
+        merged.means, merged.weights, _ = compress(
+            means[order], weights[order], np.zeros(len(means)), compression
+        )
+        merged.minimum = min(d.minimum * s for d, s in zip(digests, scales))
+        merged.maximum = max(d.maximum * s for d, s in zip(digests, scales))
+        return merged
+
+    def _points(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the cumulative weights at the centroids, and their means."""
+        self._flush()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        total = self.weights.sum()
+        return (
+            np.concatenate(([0.0], centers, [total])),
+            np.concatenate(([self.minimum], self.means, [self.maximum])),
+        )
+
+    def quantile(self, q: float) -> float:
+        """Return the approximate q-quantile of the values, NaN if empty."""
+        if not self.count:
+            return np.nan
+        ranks, values = self._points()
+        return float(np.interp(q * ranks[-1], ranks, values))
+
+    def count_above(self, value: float) -> float:
+        """Return the approximate number of values above the given one.
+
+        The values of a centroid are assumed to be spread evenly around its
+        mean, no further than half-way to the nearest centroid, so that a
+        lone extreme value does not count the centroid next to it as above.
+        """
+        if not self.count:
+            return 0.0
+        self._flush()
+        means = self.means
+        bounds = np.concatenate(([self.minimum], means, [self.maximum]))
+        spreads = np.minimum(means - bounds[:-2], bounds[2:] - means) / 2
+        spreads[self.weights == 1] = 0.0
+        ends = np.cumsum(self.weights)
+        below = np.interp(
+            value,
+            np.column_stack((means - spreads, means + spreads)).ravel(),
+            np.column_stack((ends - self.weights, ends)).ravel(),
+        )
+        return float(ends[-1] - below)
+
+    def copy(self) -> "TDigest":
+        """Return an independent copy, without modifying the digest."""
+        digest = TDigest(self.compression)
+        digest.means, digest.weights = self.means, self.weights  # Never modified
+        digest.minimum, digest.maximum = self.minimum, self.maximum
+        digest._buffer = list(self._buffer)
+        digest._merged_centroids = self._merged_centroids
+        return digest
+
+
+def month_key(month: int) -> str:
+    """Format a month number of aggregate.month_of as "YYYY-MM"."""
+    return f"{month // 12:04d}-{month % 12 + 1:02d}"
+
+
+class ExpenseSketches:
+    """Quantile sketches of the costs, by month and category or account.
+
+    There is one TDigest per month, dimension ("category" or "account"),
+    value of the dimension and currency, and the digests of all the months
+    are kept merged too, so that the distributions of the whole ledger are
+    answered in constant time.
+
+    A digest cannot forget a value: when an expense is updated or deleted,
+    its month is marked stale, and rebuilt from the columns by the next
+    refresh.
+
+    The readers of other threads get frozen copies (see freeze), which only
+    copy the digests changed since the previous one, and are never modified.
+    """
+
+    def __init__(self, compression: float = SKETCH_COMPRESSION):
+        self.compression = compression
+        self.months: Dict[str, Dict[SketchKey, TDigest]] = {}
+        self.totals: Optional[Dict[SketchKey, TDigest]] = {}  # None if outdated
+        self.stale: Set[str] = set()
+        # Last frozen copy, and the (month, key) of the digests changed since,
+        # the month being None for the merged digests. No copy once replaced.
+        self._frozen: Optional["ExpenseSketches"] = None
+        self._changed: Set[Tuple[Optional[str], SketchKey]] = set()
+        # Frozen copy thawed, whose digests are copied before being modified
+        self._borrowed: Optional["ExpenseSketches"] = None
+
+    def add(self, day: int, category: str, account: str, currency: str, cost: float):
+        """Add the cost of a new expense."""
+        month = period_of(day, "month")
+        if month in self.stale:
+            return  # Rebuilt from the columns anyway
+        borrowed = self._borrowed
+        shared = {} if borrowed is None else borrowed.months.get(month, {})
+        shared_totals = {} if borrowed is None else borrowed.totals or {}
+        digests = self.months.setdefault(month, {})
+        if digests is shared:
+            digests = self.months[month] = dict(digests)
+        for key in (("category", category, currency), ("account", account, currency)):
+            digest = digests.get(key)
+            if digest is None:
+                digest = digests[key] = TDigest(self.compression)
+            elif digest is shared.get(key):
+                digest = digests[key] = digest.copy()
+            digest.add(cost)
+            self._changed.add((month, key))
+            if self.totals is not None:
+                total = self.totals.get(key)
+                if total is None:
+                    total = self.totals[key] = TDigest(self.compression)
+                elif total is shared_totals.get(key):
+                    total = self.totals[key] = total.copy()
+                total.add(cost)
+                self._changed.add((None, key))
+
+    def invalidate(self, day: int):
+        """Mark the month of a day as stale, e.g. after a deletion."""
+        self.stale.add(period_of(day, "month"))
+        self.totals = None
+
+    def invalidate_period(self, period: str):
+        """Mark the months of a partition key as stale."""
+        for month in self.months:
+            if month.startswith(period):
+                self.stale.add(month)
+                self.totals = None
+
+    def rebuild(self, columns: ExpenseColumns, months: Optional[Set[str]] = None):
+        """Rebuild the digests of months from the live expenses of the columns.
+
+        By default all the months of the columns are rebuilt.
+        """
+        rows = np.flatnonzero(columns.view("live"))
+        month_numbers = month_of(columns.view("day")[rows])
+        if months is not None:
+            keep = np.isin(
+                month_numbers, [int(m[:4]) * 12 + int(m[5:]) - 1 for m in months]
+            )
+            rows, month_numbers = rows[keep], month_numbers[keep]
+        for month in months if months is not None else ():
+            self.months.pop(month, None)
+        if self._borrowed is not None:
+            # Digests are added to the dictionaries shared with a thawed copy
+            self.months = {
+                month: dict(digests) for month, digests in self.months.items()
+            }
+        self.totals = None
+        self._frozen = None
+        if not len(rows):
+            return
+        cost = columns.view("cost")[rows]
+        currency = columns.view("currency")[rows]
+        for dimension, pool_name in DIMENSIONS.items():
+            codes = columns.view(dimension)[rows]
+            cells, groups = np.unique(
+                np.stack([month_numbers, codes, currency]), axis=1, return_inverse=True
+            )
+            groups = groups.ravel()
+            order = np.lexsort((cost, groups))
+            values, groups = cost[order], groups[order]
+            means, weights, centroid_groups = compress(
+                values, np.ones(len(values)), groups, self.compression
+            )
+            starts = np.flatnonzero(np.diff(groups, prepend=-1))
+            minima = values[starts]
+            maxima = values[np.concatenate((starts[1:], [len(values)])) - 1]
+            bounds = np.searchsorted(centroid_groups, np.arange(len(starts) + 1))
+            pool = getattr(columns, pool_name)
+            for group, (month, code, currency_code) in enumerate(cells.T):
+                digest = TDigest(self.compression)
+                digest.means = means[bounds[group] : bounds[group + 1]]
+                digest.weights = weights[bounds[group] : bounds[group + 1]]
+                digest.minimum, digest.maximum = minima[group], maxima[group]
+                key = (
+                    dimension,
+                    pool.values[code],
+                    columns.currencies.values[currency_code],
+                )
+                self.months.setdefault(month_key(month), {})[key] = digest
+
+    def refresh(self, columns: ExpenseColumns):
+        """Rebuild the stale months from the columns, and the merged digests."""
+        if self.stale:
+            self.rebuild(columns, self.stale)
+            self.stale = set()
+        if self.totals is None:
+            by_key: Dict[SketchKey, List[TDigest]] = {}
+            for digests in self.months.values():
+                for key, digest in digests.items():
+                    by_key.setdefault(key, []).append(digest)
+            self.totals = {
+                key: TDigest.merge(digests, compression=self.compression)
+                for key, digests in by_key.items()
+            }
+            self._frozen = None
+
+    def refreshed(self, columns: ExpenseColumns) -> "ExpenseSketches":
+        """Return a refreshed copy, leaving these digests as they are.
+
+        The digests which are up to date are shared with the copy.
+        """
+        sketches = ExpenseSketches(self.compression)
+        sketches.months = dict(self.months)
+        sketches.totals = self.totals
+        sketches.stale = set(self.stale)
+        sketches.refresh(columns)
+        return sketches
+
+    def freeze(self) -> "ExpenseSketches":
+        """Return a copy of the digests for the readers, which must not modify it.
+
+        The digests unchanged since the previous frozen copy are shared with
+        it, so that freezing after every write only copies a few digests.
+        """
+        previous, changed = self._frozen, self._changed
+        if previous is None or (self.totals is not None and previous.totals is None):
+            frozen = ExpenseSketches(self.compression)
+            frozen.months = {
+                month: {key: digest.copy() for key, digest in digests.items()}
+                for month, digests in self.months.items()
+            }
+            if self.totals is not None:
+                frozen.totals = {
+                    key: digest.copy() for key, digest in self.totals.items()
+                }
+        elif (
+            not changed
+            and previous.stale == self.stale
+            and (previous.totals is None) == (self.totals is None)
+        ):
+            return previous
+        else:
+            frozen = ExpenseSketches(self.compression)
+            frozen.months = dict(previous.months)
+            frozen.totals = None if self.totals is None else dict(previous.totals)
+            for month, key in changed:
+                if month is None:
+                    if frozen.totals is not None:
+                        frozen.totals[key] = self.totals[key].copy()
+                    continue
+                if frozen.months.get(month) is previous.months.get(month):
+                    frozen.months[month] = dict(previous.months.get(month, {}))
+                frozen.months[month][key] = self.months[month][key].copy()
+        if self.totals is None:
+            frozen.totals = None
+        frozen.stale = set(self.stale)
+        self._frozen, self._changed = frozen, set()
+        return frozen
+
+    def distributions(
+        self, dimension: str, months: Optional[Iterable[str]] = None
+    ) -> Dict[Tuple[str, str], TDigest]:
+        """Return the digests of a dimension by value and currency.
+
+        The digests cover all the months, or only the given ones, merged.
+        Must be called after refresh.
+        """
+        if months is None:
+            return {
+                (value, currency): digest.copy()
+                for (name, value, currency), digest in self.totals.items()
+                if name == dimension
+            }
+        by_key: Dict[Tuple[str, str], List[TDigest]] = {}
+        for month in months:
+            for (name, value, currency), digest in self.months.get(month, {}).items():
+                if name == dimension:
+                    by_key.setdefault((value, currency), []).append(digest)
+        return {
+            key: TDigest.merge(digests, compression=self.compression)
+            for key, digests in by_key.items()
+        }
+
+    def subset(self, periods: Iterable[str]) -> "ExpenseSketches":
+        """Return a copy of the digests of the months of some partition keys."""
+        periods = tuple(periods)
+        sketches = ExpenseSketches(self.compression)
+        sketches.totals = None
+        for month, digests in self.months.items():
+            if periods and month.startswith(periods):
+                sketches.months[month] = {k: d.copy() for k, d in digests.items()}
+        return sketches
+
+    def copy(self) -> "ExpenseSketches":
+        """Return an independent copy of the digests."""
+        sketches = ExpenseSketches(self.compression)
+        sketches.months = {
+            month: {key: digest.copy() for key, digest in digests.items()}
+            for month, digests in self.months.items()
+        }
+        if self.totals is not None:
+            sketches.totals = {key: d.copy() for key, d in self.totals.items()}
+        else:
+            sketches.totals = None
+        sketches.stale = set(self.stale)
+        return sketches
+
+    def thaw(self) -> "ExpenseSketches":
+        """Return a modifiable copy of frozen digests, e.g. refreshed by a reader.
+
+        They are left as they are: the copy shares them until it modifies
+        them, and with the next frozen copies.
+        """
+        sketches = ExpenseSketches(self.compression)
+        sketches.months = dict(self.months)
+        sketches.totals = None if self.totals is None else dict(self.totals)
+        sketches.stale = set(self.stale)
+        sketches._frozen = sketches._borrowed = self
+        return sketches
+
+    def save(self, path: Path):
+        """Persist the digests of the months, as a header and flat arrays."""
+        keys = []
+        digests = []
+        for month, month_digests in sorted(self.months.items()):
+            for key, digest in month_digests.items():
+                keys.append([month, *key])
+                digests.append(digest)
+        centroids = [digest._merged() for digest in digests]
+        header = {
+            "version": FORMAT_VERSION,
+            "compression": self.compression,
+            "keys": keys,
+        }
+        with atomic_write(path) as file:
+            np.savez(
+                file,
+                header=np.array(json.dumps(header)),
+                sizes=np.array([len(m) for m, _ in centroids], dtype=np.int64),
+                means=np.concatenate([m for m, _ in centroids] or [np.empty(0)]),
+                weights=np.concatenate([w for _, w in centroids] or [np.empty(0)]),
+                minima=np.array([d.minimum for d in digests], dtype=float),
+                maxima=np.array([d.maximum for d in digests], dtype=float),
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["ExpenseSketches"]:
+        """Load persisted digests, or return None if they are unusable."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                header = json.loads(str(data["header"]))
+                if header["version"] != FORMAT_VERSION:
+                    return None
+                sketches = cls(header["compression"])
+                bounds = np.concatenate(([0], np.cumsum(data["sizes"])))
+                means, weights = data["means"], data["weights"]
+                minima, maxima = data["minima"], data["maxima"]
+                for i, (month, *key) in enumerate(header["keys"]):
+                    digest = TDigest(sketches.compression)
+                    digest.means = means[bounds[i] : bounds[i + 1]]
+                    digest.weights = weights[bounds[i] : bounds[i + 1]]
+                    digest.minimum, digest.maximum = minima[i], maxima[i]
+                    sketches.months.setdefault(month, {})[tuple(key)] = digest
+        except Exception as e:
+            logging.error(f"Failed to load quantile sketches {path}: {str(e)}")
+            return None
+        sketches.totals = None
+        return sketches
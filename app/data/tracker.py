@@ -1,13 +1,105 @@
 """Main module for the expense tracker."""
 
 import csv
-from datetime import datetime
+import io
+import logging
+import math
+import numbers
+import os
+import pickle
+import threading
+import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime
 from pathlib import Path
-from typing import List
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
 
-from pydantic import BaseModel, validator
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, ValidationError, root_validator
 
-from ..config import CSV_PATH, DATE_FORMAT
+from ..config import (
+    COMPACTION_MIN_ENTRIES,
+    COMPACTION_THRESHOLD,
+    CSV_PATH,
+    CURRENCIES,
+    DATE_FORMAT,
+    PARTITION_FOLD_ENTRIES,
+    PARTITION_PERIOD,
+    RESIDENT_MONTHS,
+    SNAPSHOT_INTERVAL,
+    WAL_FSYNC,
+)
+from .aggregate import aggregate_expenses
+from .balances import AccountBalances, BalanceKey
+from .columnfiles import map_columns, remove_columns, write_columns
+from .dedup import FingerprintIndex, fingerprint
+from .locks import FileLock, atomic_write
+from .partitions import Partition, PartitionStore, aggregates_frame, period_of
+from .records import ExpenseColumns, ExpenseRecord, parse_day
+from .search import TrigramIndex
+from .sketch import ExpenseSketches, TDigest
+from .wal import WriteAheadLog
+
+
+def _is_name(value) -> bool:
+    return isinstance(value, str) and value != ""
+
+
+def _is_cost(value) -> bool:
+    """Whether a value is a finite number, or the text of one, as in CSV files."""
+    if isinstance(value, (bool, np.bool_)):
+        return False
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return False
+    elif not isinstance(value, numbers.Real):
+        return False
+    return math.isfinite(value)
+
+
+def _is_date(value) -> bool:
+    if not isinstance(value, str):
+        return False
+    try:
+        datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        return False
+    return True
+
+
+# The rules of the fields of an expense, checked by Expense for a single one and
+# by Expense.validate_batch for many: (check of the value, error message)
+EXPENSE_RULES: Dict[str, Tuple[Callable[[object], bool], str]] = {
+    "category": (_is_name, "Category must be a non-empty string."),
+    "cost": (_is_cost, "Cost must be a finite number."),
+    "note": (lambda value: isinstance(value, str), "Note must be a string."),
+    "date": (_is_date, f"Date must be a valid date in {DATE_FORMAT}"),
+    "currency": (
+        lambda value: isinstance(value, str) and value in CURRENCIES,
+        f"Currency must be one of {', '.join(CURRENCIES)}.",
+    ),
+    "account": (_is_name, "Account must be a non-empty string."),
+}
+
+
+def _check_column(values: list, check: Callable[[object], bool]) -> np.ndarray:
+    """Check the values of a field, each distinct value only once."""
+    results: Dict[Tuple[type, object], bool] = {}
+    valid = np.empty(len(values), dtype=bool)
+    for row, value in enumerate(values):
+        try:
+            key = (type(value), value)
+            result = results.get(key)
+            if result is None:
+                result = results[key] = check(value)
+        except TypeError:  # Unhashable, e.g. a JSON array
+            result = check(value)
+        valid[row] = result
+    return valid
 
 
 class Expense(BaseModel):
@@ -26,37 +118,762 @@ class Expense(BaseModel):
     #     "account",
     # ]
 
-    @validator("date")
-    def validate_date(cls, v):
-        """Validate and ensure the date is in the correct format."""
+    @root_validator(pre=True)
+    def validate_fields(cls, values):
+        """Validate the fields against EXPENSE_RULES; a missing note is "".
+
+        The errors of all the invalid fields are reported at once.
+        """
+        values = {**values, "note": values.get("note") or ""}
+        errors = [
+            message
+            for field, (check, message) in EXPENSE_RULES.items()
+            if not check(values.get(field))
+        ]
+        if errors:
+            raise ValueError(" ".join(errors))
+        return values
+
+    @classmethod
+    def validate_batch(cls, rows: List[dict]) -> Tuple[List[dict], List[dict]]:
+        """Validate many expenses at once, one column at a time.
+
+        The fields follow the same EXPENSE_RULES as a single Expense, each
+        distinct value of a column being checked only once. Returns the valid
+        expenses as dicts, without building a model per row, and an error for
+        every offending field of every row, as {"row", "field", "error"} dicts.
+        """
+        is_object = np.array([isinstance(row, dict) for row in rows], dtype=bool)
+        objects = [row if ok else {} for row, ok in zip(rows, is_object)]
+        columns = {
+            field: [row.get(field) for row in objects] for field in EXPENSE_RULES
+        }
+        columns["note"] = [note or "" for note in columns["note"]]
+
+        errors = [
+            {"row": int(row), "field": None, "error": "Expected a JSON object."}
+            for row in np.flatnonzero(~is_object)
+        ]
+        invalid = ~is_object
+        for field, (check, message) in EXPENSE_RULES.items():
+            mask = ~_check_column(columns[field], check) & is_object
+            invalid |= mask
+            errors.extend(
+                {"row": int(row), "field": field, "error": message}
+                for row in np.flatnonzero(mask)
+            )
+        errors.sort(key=lambda error: error["row"])
+
+        expenses = [
+            {
+                field: (
+                    float(columns[field][row])
+                    if field == "cost"
+                    else columns[field][row]
+                )
+                for field in ExpenseColumns.FIELDS
+            }
+            for row in np.flatnonzero(~invalid)
+        ]
+        return expenses, errors
+
+
+class PublishedState(NamedTuple):
+    """State of a tracker as of its last write, read by the readers without lock.
+
+    The sketches and balances are frozen copies, never modified.
+    """
+
+    expenses: ExpenseColumns
+    spilled: Dict[str, Partition]
+    search_index: Optional[TrigramIndex]
+    sketches: ExpenseSketches
+    balances: AccountBalances
+    content_tag: str
+    version: int  # Of the expenses, see ExpenseColumns.commit
+
+
+LOG_FIELDS = ["id", "op", "category", "cost", "note", "date", "currency", "account"]
+SNAPSHOT_VERSION = 2
+SNAPSHOT_CHECK_BYTES = 4096  # Bytes of the CSV file checksummed by a snapshot
+
+
+def csv_checksum(csv_file: Path, size: int) -> int:
+    """Checksum the bytes of a CSV file right before the given size."""
+    with Path(csv_file).open(mode="rb") as file:
+        start = max(0, size - SNAPSHOT_CHECK_BYTES)
+        file.seek(start)
+        return zlib.crc32(file.read(size - start))
+
+
+def map_snapshot(csv_file: Path) -> Optional[Tuple[dict, ExpenseColumns]]:
+    """Read the snapshot of a ledger file, and map its columns.
+
+    Returns None if there is no snapshot, or if it does not match the start
+    of the ledger file anymore.
+    """
+    csv_file = Path(csv_file)
+    snapshot_file = csv_file.with_suffix(".snapshot")
+    if not snapshot_file.exists() or not csv_file.exists():
+        return None
+    try:
+        with snapshot_file.open(mode="rb") as file:
+            state = pickle.load(file)
+        if state["version"] != SNAPSHOT_VERSION:
+            return None
+        size = state["csv_size"]
+        if (
+            csv_file.stat().st_size < size
+            or csv_checksum(csv_file, size) != state["csv_checksum"]
+        ):
+            logging.warning(f"Ignoring outdated snapshot of {csv_file}")
+            return None
+        return state, map_columns(csv_file.with_suffix(".columns"), state["columns"])
+    except Exception as e:
+        logging.error(f"Failed to load snapshot of {csv_file}: {str(e)}")
+        return None
+
+
+def rows_by_live_id(columns: ExpenseColumns) -> Dict[int, int]:
+    """Return the rows of the live expenses of columns, by expense id."""
+    rows = np.flatnonzero(columns.live)
+    return dict(zip(columns.ids[rows].tolist(), rows.tolist()))
+
+
+def read_ledger(csv_file: Path) -> ExpenseColumns:
+    """Read the expenses of a ledger file without loading a tracker.
+
+    Unlike ExpenseTracker, nothing is written: no migration, repair, snapshot
+    or compaction, and no lock file. The columns of the snapshot are mapped
+    if it still matches the ledger file, and only the entries written after
+    it are parsed, followed by the WAL records which never reached the file.
+    A torn last entry, being written, is ignored. The partitions, if any, are
+    not read: see PartitionStore.read_range.
+    """
+    csv_file = Path(csv_file)
+    columns, rows_by_id, offset, entries = ExpenseColumns(), {}, 0, 0
+    mapped = map_snapshot(csv_file)
+    if mapped is not None:
+        state, columns = mapped
+        rows_by_id = rows_by_live_id(columns)
+        offset, entries = state["csv_size"], state["log_entries"]
+
+    def apply(expense_id: int, op: str, values: dict):
+        if op not in ("add", "update", "delete"):
+            raise ValueError(f"Unknown operation: {op}")
+        expense = ()
+        if op != "delete":
+            expense = (
+                values["category"],
+                float(values["cost"]),
+                values["note"],
+                parse_day(values["date"]),
+                values["currency"],
+                values["account"],
+            )
+        previous = rows_by_id.pop(expense_id, None)
+        if previous is not None:
+            columns.kill(previous)
+        if op != "delete":
+            rows_by_id[expense_id] = columns.append(expense_id, *expense)
+
+    data = b""
+    if csv_file.exists():
+        with csv_file.open(mode="rb") as file:
+            file.seek(offset)
+            data = file.read()
+    data = data[: data.rfind(b"\n") + 1]
+    reader = csv.DictReader(
+        io.StringIO(data.decode(), newline=""),
+        fieldnames=LOG_FIELDS if offset else None,
+    )
+    legacy = "id" not in (reader.fieldnames or LOG_FIELDS)
+    for entry, row in enumerate(reader):
         try:
-            datetime.strptime(v, DATE_FORMAT)
-        except ValueError:
-            raise ValueError(f"Date must be in the format {DATE_FORMAT}")
-        return v
+            if legacy:
+                apply(entry, "add", row)
+            else:
+                apply(int(row["id"]), row["op"], row)
+            entries += 1
+        except (KeyError, TypeError, ValueError) as e:
+            logging.error(f"Skipping invalid entry {row} of {csv_file}: {str(e)}")
+
+    if not legacy:
+        for record in WriteAheadLog(csv_file.with_suffix(".wal")).records():
+            if record["seq"] < entries:
+                continue  # Already in the CSV file
+            if record["seq"] > entries:
+                logging.error(f"Missing WAL records before {record['seq']}")
+                break
+            entry = record["entry"]
+            apply(entry["id"], entry["op"], entry)
+            entries += 1
+    columns.commit()
+    return columns
 
 
 class ExpenseTracker:
-    def __init__(self, csv_file: Path = CSV_PATH):
+    """Tracker of the expenses stored in a CSV file.
+
+    The CSV file is an append-only log: every line records a new version of
+    the expense with the given id ("add" or "update") or its deletion
+    ("delete"), so that editing an expense never rewrites the file. The latest
+    version of each expense is found through the id index, and the file is
+    compacted in a background thread once enough entries are dead.
+
+    To restart quickly and safely, the in-memory state is periodically saved
+    to a snapshot, with the columns in binary files which are memory-mapped on
+    startup (shared between the processes loading the same ledger until they
+    write to it), and every entry is first written to a checksummed
+    write-ahead log (WAL). On startup the snapshot is loaded, only the CSV
+    entries written after it are parsed, and the WAL is replayed to restore
+    the entries which never reached the CSV file.
+
+    Optionally, compactions move the expenses to a PartitionStore with one
+    file per year or month, and the CSV file only keeps the entries written
+    since the last compaction.
+
+    With a number of resident months, the partitions of older periods are
+    spilled: their expenses are not loaded, only their aggregates are, so the
+    memory used does not grow with the history. A spilled partition is paged
+    back in as soon as one of its expenses is modified, or an expense is added
+    to its period, and spilled again by the next compaction.
+
+    The fingerprints of the live expenses in memory are kept in a
+    FingerprintIndex, saved with the snapshot, so that imports can skip the
+    expenses already in the ledger.
+
+    The distributions of the costs, spilled or not, are summarized by the
+    quantile sketches of ExpenseSketches, updated on every write and saved
+    with the snapshot too. The spend of each account between two days is
+    answered by the running sums of AccountBalances, saved with the snapshot
+    as well.
+
+    The tracker is shared by the threads of the server. The writes are
+    serialized by the writer lock, and published as a whole once applied,
+    while the readers work on immutable views of the published expenses
+    (see read_view), taken without waiting for the writers. Several trackers,
+    in one or several processes, may load the same ledger: their writes are
+    serialized by its lock file, and each tracker applies the entries of the
+    others before writing, so that the ids stay unique.
+    """
+
+    def __init__(
+        self,
+        csv_file: Path = CSV_PATH,
+        partition_period: Optional[str] = PARTITION_PERIOD,
+        resident_months: Optional[int] = RESIDENT_MONTHS,
+    ):
         self.csv_file = Path(csv_file)
-        self.expenses: List[Expense] = []
-        self._load_expenses()
+        if resident_months is not None and partition_period is None:
+            partition_period = "month"
+        self.resident_months = resident_months
+        self.partitions = PartitionStore(
+            self.csv_file.with_suffix(".parts"), partition_period
+        )
+        # Sums of the spilled partitions, and the spilled dict they were made of
+        self._history: Optional[Tuple[Dict[str, Partition], pd.DataFrame]] = None
+        # Published state with stale sketches, and its refreshed sketches
+        self._refreshed: Optional[Tuple[PublishedState, ExpenseSketches]] = None
+        # Taken by the readers only, so that a single one refreshes the sketches
+        self._refresh_lock = threading.Lock()
+        self._wal = WriteAheadLog(self.csv_file.with_suffix(".wal"), WAL_FSYNC)
+        self._lock = threading.RLock()
+        # Serializes the writes of all the trackers of the ledger, in any process
+        self._file_lock = FileLock(self.csv_file.with_suffix(".lock"))
+        # Serializes the snapshots and compactions of the ledger, in any process.
+        # Taken before the writer locks, never while holding them.
+        self._maintenance_lock = FileLock(
+            self.csv_file.with_suffix(".maintenance.lock")
+        )
+        self._maintenance: Optional[threading.Thread] = None
+        self._instance = uuid.uuid4().hex[:12]
+        self.version = 0  # Incremented on every write
+        with self._maintenance_lock, self._lock, self._file_lock:
+            self._reset()
+            self._recover()
+            self._load_search_index()
+            self._commit()
+
+    def _reset(self):
+        """Empty the in-memory state, before loading it from the files."""
+        self.spilled: Dict[str, Partition] = {}  # Partitions not in memory
+        self.search_index: Optional[TrigramIndex] = None
+        self.expenses = ExpenseColumns()
+        self._rows_by_id: Dict[int, int] = {}
+        self.fingerprints = FingerprintIndex()
+        self.sketches = ExpenseSketches()
+        self.balances = AccountBalances()
+        self._next_id = 0
+        self._log_entries = 0  # Number of entries in the CSV file
+        self._archived_entries = 0  # Number of expenses in the partitions
+        self._snapshot_entries = 0  # Number of entries covered by the snapshot
+        # Hash of the entries applied, equal in the processes which applied
+        # the same log
+        self._content_hash = 0
+        # (device, inode, size) of the CSV file once its entries were applied
+        self._synced: Optional[Tuple[int, int, int]] = None
+
+    @property
+    def snapshot_file(self) -> Path:
+        return self.csv_file.with_suffix(".snapshot")
+
+    @property
+    def columns_dir(self) -> Path:
+        return self.csv_file.with_suffix(".columns")
+
+    def _recover(self, maintain: bool = True):
+        """Restore the in-memory state from the snapshot, the CSV file and the WAL.
+
+        Unless `maintain`, the ledger is only read, and the compaction or
+        snapshot it may need is scheduled in the background.
+        """
+        self._repair_torn_csv()
+        offset = self._load_snapshot()
+        if not offset:
+            self._load_partitions()
+        if self._load_expenses(offset):
+            self.compact()  # Migrate the file to the log format
+            return
+        self._replay_wal()
+        if not maintain:
+            self._schedule_maintenance()
+            return
+        if (
+            self.resident_months is not None
+            and self._log_entries >= PARTITION_FOLD_ENTRIES
+        ):
+            self.compact()  # Spill the history out of memory right away
+            return
+        # Start from a fresh snapshot and an empty WAL, so that new records are
+        # never appended after a torn one
+        if (self._log_entries or self._archived_entries) and (
+            not offset or not self._wal.is_empty()
+        ):
+            self.snapshot()
+
+    def _repair_torn_csv(self):
+        """Drop the last line of the CSV file if its write was interrupted."""
+        if not self.csv_file.exists():
+            return
+        with self.csv_file.open(mode="rb+") as file:
+            size = file.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            file.seek(max(0, size - 65536))
+            tail = file.read()
+            if tail.endswith(b"\n"):
+                return
+            end = size - len(tail) + tail.rfind(b"\n") + 1
+            logging.warning(f"Dropping torn entry at the end of {self.csv_file}")
+            file.truncate(max(end, 0))
+
+    def _csv_state(self) -> Optional[Tuple[int, int, int]]:
+        """Return the (device, inode, size) of the CSV file, None if missing."""
+        try:
+            stat = self.csv_file.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_dev, stat.st_ino, stat.st_size
+
+    def _mark_synced(self):
+        """Record that the entries of the CSV file are all applied."""
+        self._synced = self._csv_state()
+
+    def _catch_up(self):
+        """Apply the entries written to the ledger by other trackers since.
 
-    def _load_expenses(self):
-        """Load existing expenses from the CSV file."""
-        if self.csv_file.exists():
-            with self.csv_file.open(mode="r", newline="") as file:
+        The other trackers may run in other processes. If one of them
+        rewrote the CSV file (compacted it), the whole state is reloaded.
+        Must hold the writer locks.
+        """
+        state, synced = self._csv_state(), self._synced
+        if state == synced:
+            return
+        if state is None or (
+            synced is not None and (state[:2] != synced[:2] or state[2] < synced[2])
+        ):
+            logging.info(f"Reloading {self.csv_file}, rewritten by another tracker")
+            self._reset()
+            self._recover(maintain=False)
+            self._load_search_index()
+        else:
+            rows = len(self.expenses)
+            self._load_expenses(synced[2] if synced else 0)
+            for row in range(rows, len(self.expenses)):
+                self.search_index.add(row, self._search_text(row))
+        self.version += 1
+        self._commit()
+
+    def _current(self) -> PublishedState:
+        """Return the published state, once caught up with the other trackers.
+
+        Comparing the (device, inode, size) of the CSV file with the one
+        applied is cheap, so it is done on every read: the reader only takes
+        the writer locks when another tracker wrote to the ledger since, to
+        apply its entries and publish them before serving them.
+        """
+        if self._csv_state() != self._synced:
+            with self._lock, self._file_lock:
+                self._catch_up()
+        return self._published
+
+    @contextmanager
+    def _write_lock(self):
+        """Hold the writer locks of the ledger, and catch up with its entries.
+
+        The writes are serialized between the threads by the writer lock, and
+        between the trackers of the ledger, in any process, by its file lock.
+        """
+        with self._lock, self._file_lock:
+            self._catch_up()
+            yield
+
+    def _load_partitions(self):
+        """Load the expenses archived in the partitions, if any.
+
+        The partitions of the periods before the resident window are spilled.
+        """
+        resident_from = self._resident_from()
+        for key, partition in self.partitions.load().items():
+            if resident_from is not None and key < resident_from:
+                self.spilled[key] = partition
+                continue
+            for entry in self.partitions.read(partition):
+                try:
+                    self._apply_entry(int(entry["id"]), "add", entry)
+                except (KeyError, TypeError, ValueError) as e:
+                    logging.error(f"Skipping invalid archived entry {entry}: {str(e)}")
+        if self.spilled:
+            # Read once, to sketch and sum the expenses which are not loaded
+            columns = self.partitions.read_columns(self.spilled.values())
+            self.sketches.rebuild(columns)
+            self.balances.add_columns(columns)
+        # The entries of the partitions are not part of the CSV file
+        self._archived_entries, self._log_entries = self._log_entries, 0
+
+    def _resident_from(self) -> Optional[str]:
+        """Return the key of the first period kept in memory, if bounded."""
+        if self.resident_months is None:
+            return None
+        today = date.today()
+        month = today.year * 12 + today.month - 1 - self.resident_months
+        first_day = date(month // 12, month % 12 + 1, 1)
+        return period_of(first_day.toordinal(), self.partitions.period)
+
+    def _ensure_resident(self, expense_id: Optional[int], day: Optional[int]):
+        """Page in the spilled partitions holding an expense or a day, if any."""
+        if not self.spilled:
+            return
+        if day is not None:
+            key = period_of(day, self.partitions.period)
+            if key in self.spilled:
+                self._page_in(key)
+        if expense_id is None or expense_id in self._rows_by_id:
+            return
+        for key, partition in list(self.spilled.items()):
+            if partition.min_id <= expense_id <= partition.max_id and any(
+                int(entry["id"]) == expense_id
+                for entry in self.partitions.read(partition)
+            ):
+                self._page_in(key)
+                return
+
+    def _page_in(self, key: str):
+        """Load the expenses of a spilled partition back into memory."""
+        partition = self.spilled[key]
+        # Copied on write: the readers may hold the previous dict
+        self.spilled = {k: p for k, p in self.spilled.items() if k != key}
+        self.sketches.invalidate_period(key)  # Rebuilt from the columns
+        log_entries = self._log_entries
+        for entry in self.partitions.read(partition):
+            self._apply_entry(int(entry["id"]), "add", entry, replay=True)
+            if self.search_index is not None:
+                row = self._rows_by_id[int(entry["id"])]
+                self.search_index.add(row, self._search_text(row))
+        self._archived_entries += self._log_entries - log_entries
+        self._log_entries = log_entries
+
+    def _load_expenses(self, offset: int = 0) -> bool:
+        """Load the expenses from the CSV file, starting at the given offset.
+
+        Rows are validated once here, while being parsed, and stored directly
+        in the column store without building an Expense model per row. Invalid
+        entries are logged and skipped.
+
+        Returns True for files written before the log format: their row
+        numbers are used as expense ids, and they must be migrated.
+        """
+        if not self.csv_file.exists():
+            return False
+        with self.csv_file.open(mode="r", newline="") as file:
+            if offset:
+                file.seek(offset)
+                reader = csv.DictReader(file, fieldnames=LOG_FIELDS)
+            else:
                 reader = csv.DictReader(file)
-                for row in reader:
-                    expense = Expense(
-                        category=row["category"],
-                        cost=float(row["cost"]),
-                        note=row["note"],
-                        date=row["date"],  # Already in dd-mm-yyyy format
-                        currency=row["currency"],
-                        account=row["account"],
+            legacy = "id" not in (reader.fieldnames or [])
+            for entry, row in enumerate(reader):
+                try:
+                    if legacy:
+                        self._apply_entry(entry, "add", row)
+                    else:
+                        self._apply_entry(int(row["id"]), row["op"], row)
+                except (KeyError, TypeError, ValueError) as e:
+                    logging.error(
+                        f"Skipping invalid entry {row} of {self.csv_file}: {str(e)}"
                     )
-                    self.expenses.append(expense)
+        self._mark_synced()
+        return legacy
+
+    def _apply_entry(
+        self,
+        expense_id: int,
+        op: str,
+        values: dict,
+        fingerprints: bool = True,
+        replay: bool = False,
+    ):
+        """Apply a log entry to the in-memory state.
+
+        The fingerprint index is updated too, unless `fingerprints` is False
+        because it already reflects the entry. A replayed entry (paged in, or
+        rewritten by a compaction) is already part of the content of the
+        ledger: the account balances and content hash are left as they are.
+        """
+        if op not in ("add", "update", "delete"):
+            raise ValueError(f"Unknown operation: {op}")
+        expense = ()
+        if op != "delete":
+            expense = (
+                values["category"],
+                float(values["cost"]),
+                values["note"],
+                parse_day(values["date"]),  # Already in dd-mm-yyyy format
+                values["currency"],
+                values["account"],
+            )
+        self._ensure_resident(
+            None if op == "add" else expense_id,
+            None if op == "delete" else expense[3],
+        )
+        previous = self._rows_by_id.pop(expense_id, None)
+        if previous is not None:
+            self.expenses.kill(previous)
+            self.sketches.invalidate(int(self.expenses.day[previous]))
+            if not replay:
+                columns = self.expenses
+                self.balances.add(
+                    int(columns.day[previous]),
+                    columns.accounts.values[columns.account[previous]],
+                    columns.currencies.values[columns.currency[previous]],
+                    -float(columns.cost[previous]),
+                )
+            if fingerprints:
+                self.fingerprints.remove(self._row_fingerprint(previous))
+        if op != "delete":
+            self._rows_by_id[expense_id] = self.expenses.append(expense_id, *expense)
+            category, cost, note, day, currency, account = expense
+            self.sketches.add(day, category, account, currency, cost)
+            if not replay:
+                self.balances.add(day, account, currency, cost)
+            if fingerprints:
+                self.fingerprints.add(fingerprint(day, cost, currency, account, note))
+        if not replay:
+            self._content_hash = zlib.crc32(
+                "\x1f".join([str(expense_id), op, *map(str, expense)]).encode(),
+                self._content_hash,
+            )
+        self._next_id = max(self._next_id, expense_id + 1)
+        self._log_entries += 1
+
+    def _load_snapshot(self) -> int:
+        """Restore the snapshot and return the CSV offset it covers.
+
+        Returns 0, leaving the state empty, if there is no usable snapshot.
+        """
+        mapped = map_snapshot(self.csv_file)
+        if mapped is None:
+            return 0
+        state, expenses = mapped
+        size = state["csv_size"]
+        try:
+            manifest = self.partitions.load()
+            spilled = {key: manifest[key] for key in state.get("spilled", [])}
+            if spilled and self.resident_months is None:
+                raise ValueError("spilled partitions, but no resident window")
+        except Exception as e:
+            logging.error(f"Ignoring snapshot of {self.csv_file}: {str(e)}")
+            return 0
+        self.expenses = expenses
+        self.spilled = spilled
+        self._rows_by_id = rows_by_live_id(expenses)
+        fingerprints = FingerprintIndex.load(self._fingerprints_file(state["columns"]))
+        if fingerprints is None or len(fingerprints) != len(self._rows_by_id):
+            fingerprints = FingerprintIndex()
+            for row in self._rows_by_id.values():
+                fingerprints.add(self._row_fingerprint(row))
+        self.fingerprints = fingerprints
+        sketches = ExpenseSketches.load(self._sketches_file(state["columns"]))
+        rebuild_sketches = sketches is None
+        if rebuild_sketches:
+            sketches = ExpenseSketches()
+            sketches.rebuild(self.expenses)
+        balances = AccountBalances.load(self._balances_file(state["columns"]))
+        rebuild_balances = balances is None
+        if rebuild_balances:
+            balances = AccountBalances()
+            balances.add_columns(self.expenses)
+        if rebuild_sketches or rebuild_balances:
+            for partition in self.spilled.values():
+                # One partition at a time, to bound the memory taken
+                columns = self.partitions.read_columns([partition])
+                if rebuild_balances:
+                    balances.add_columns(columns)
+                if rebuild_sketches:
+                    sketches.rebuild(columns)
+        self.sketches = sketches
+        self.balances = balances
+        self._next_id = state["next_id"]
+        self._log_entries = self._snapshot_entries = state["log_entries"]
+        self._archived_entries = state.get("archived_entries", 0)
+        # Unknown for older snapshots: unique to this instance then
+        self._content_hash = state.get(
+            "content_hash", zlib.crc32(self._instance.encode())
+        )
+        return size
+
+    def _replay_wal(self):
+        """Write to the CSV file and apply the WAL entries it is missing."""
+        for record in self._wal.records():
+            if record["seq"] < self._log_entries:
+                continue  # Already in the CSV file
+            if record["seq"] > self._log_entries:
+                logging.error(f"Missing WAL records before {record['seq']}")
+                break
+            entry = record["entry"]
+            self._save_entries_to_csv([entry])
+            self._apply_entry(entry["id"], entry["op"], entry)
+
+    def snapshot(self):
+        """Save the in-memory state to the snapshot file and truncate the WAL.
+
+        The columns are viewed, and the published sketches and balances and a
+        copy on write of the fingerprints taken, under the writer lock: they
+        are refreshed and serialized outside it.
+        The columns are written to a new generation of column files first, and
+        the previous generations are deleted once the snapshot file is swapped.
+        """
+        with self._maintenance_lock:
+            with self._write_lock():
+                size = self.csv_file.stat().st_size if self.csv_file.exists() else 0
+                state = {
+                    "version": SNAPSHOT_VERSION,
+                    "csv_size": size,
+                    "csv_checksum": csv_checksum(self.csv_file, size) if size else 0,
+                    "log_entries": self._log_entries,
+                    "archived_entries": self._archived_entries,
+                    "next_id": self._next_id,
+                    "spilled": sorted(self.spilled),
+                    "columns": uuid.uuid4().hex[:12],
+                    "content_hash": self._content_hash,
+                }
+                self._commit()
+                published = self._published
+                expenses = self.expenses.read_view()
+                fingerprints = self.fingerprints.copy()
+                self._wal.rotate()
+
+            sketches = published.sketches
+            if sketches.stale or sketches.totals is None:
+                sketches = sketches.refreshed(expenses)
+                self._adopt_sketches(published, sketches)
+            write_columns(self.columns_dir, state["columns"], expenses)
+            fingerprints.save(self._fingerprints_file(state["columns"]))
+            with self._lock:
+                self.fingerprints.release(fingerprints)
+            sketches.save(self._sketches_file(state["columns"]))
+            published.balances.save(self._balances_file(state["columns"]))
+            with atomic_write(self.snapshot_file, fsync=True) as file:
+                pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+            self._wal.discard_rotated()
+            remove_columns(self.columns_dir, keep=state["columns"])
+            self._snapshot_entries = state["log_entries"]
+
+    def _fingerprints_file(self, generation: str) -> Path:
+        """Return the file of the fingerprint index saved with column files."""
+        return self.columns_dir / f"{generation}.fingerprints"
+
+    def _sketches_file(self, generation: str) -> Path:
+        """Return the file of the quantile sketches saved with column files."""
+        return self.columns_dir / f"{generation}.sketches"
+
+    def _balances_file(self, generation: str) -> Path:
+        """Return the file of the account balances saved with column files."""
+        return self.columns_dir / f"{generation}.balances"
+
+    def _row_fingerprint(self, row: int) -> int:
+        """Return the fingerprint of the expense stored in the given row."""
+        columns = self.expenses
+        return fingerprint(
+            int(columns.day[row]),
+            float(columns.cost[row]),
+            columns.currencies.values[columns.currency[row]],
+            columns.accounts.values[columns.account[row]],
+            columns.notes[row],
+        )
+
+    @property
+    def search_index_file(self) -> Path:
+        return self.csv_file.with_suffix(".search.idx")
+
+    def _search_text(self, row: int, columns: Optional[ExpenseColumns] = None) -> str:
+        """Return the text searched for the given row of the columns."""
+        if columns is None:
+            columns = self.expenses
+        category = columns.categories.values[columns.category[row]]
+        return f"{columns.notes[row]}\n{category}"
+
+    def _load_search_index(self):
+        """Load the persisted search index and index the rows added since."""
+        index = TrigramIndex.load(self.search_index_file)
+        if index.rows > len(self.expenses) or (
+            index.rows and index.last_text != self._search_text(index.rows - 1)
+        ):
+            # The CSV file was modified behind our back: rebuild from scratch
+            index = TrigramIndex()
+        if index.rows < len(self.expenses):
+            for row in range(index.rows, len(self.expenses)):
+                index.add(row, self._search_text(row))
+            index.save(self.search_index_file)
+        self.search_index = index
+
+    def search_expenses(
+        self, query: str, columns: Optional[ExpenseColumns] = None
+    ) -> List[int]:
+        """Return the live rows whose note or category contains the query.
+
+        The rows are those of the view `columns`, a new one by default. The
+        candidates of the index are checked against the text of the view, so
+        a view older than the index (from before a compaction) can only miss
+        rows.
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+        if columns is None:
+            columns = self.read_view()
+        rows = self._current().search_index.candidates(query)
+        if rows is None:
+            rows = range(len(columns))  # Query too short for the index
+        live = columns.live
+        return [
+            row
+            for row in rows
+            if row < len(columns)
+            and live[row]
+            and query in self._search_text(row, columns).lower()
+        ]
 
     def add_expense(
         self,
@@ -66,45 +883,530 @@ class ExpenseTracker:
         date: str,
         currency: str,
         account: str,
+    ) -> int:
+        """Add a new expense and return its id."""
+        expense = self._validate(category, cost, note, date, currency, account)
+        with self._write_lock():
+            expense_id = self._next_id
+            self._write_entry(expense_id, "add", expense.dict())
+        return expense_id
+
+    def update_expense(
+        self,
+        expense_id: int,
+        category: str,
+        cost: float,
+        note: str,
+        date: str,
+        currency: str,
+        account: str,
     ):
-        """Add a new expense."""
+        """Record a new version of an existing expense."""
+        expense = self._validate(category, cost, note, date, currency, account)
+        with self._write_lock():
+            self._ensure_resident(expense_id, None)
+            self._commit()
+            if expense_id not in self._rows_by_id:
+                raise KeyError(f"Unknown expense id: {expense_id}")
+            self._write_entry(expense_id, "update", expense.dict())
+
+    def delete_expense(self, expense_id: int):
+        """Record the deletion of an expense."""
+        with self._write_lock():
+            self._ensure_resident(expense_id, None)
+            self._commit()
+            if expense_id not in self._rows_by_id:
+                raise KeyError(f"Unknown expense id: {expense_id}")
+            self._write_entry(expense_id, "delete", None)
+
+    def _validate(self, category, cost, note, date, currency, account) -> Expense:
+        """Validate an expense, raising a ValueError with the broken rules."""
         try:
-            datetime.strptime(date, DATE_FORMAT)
-        except ValueError:
-            raise ValueError(f"Date must be in the format {DATE_FORMAT}")
-
-        expense = Expense(
-            category=category,
-            cost=cost,
-            note=note,
-            date=date,
-            currency=currency,
-            account=account,
+            return Expense(
+                category=category,
+                cost=cost,
+                note=note,
+                date=date,
+                currency=currency,
+                account=account,
+            )
+        except ValidationError as e:
+            messages = (
+                error["msg"].removeprefix("Value error, ") for error in e.errors()
+            )
+            raise ValueError(" ".join(messages)) from None
+
+    def add_expenses(self, expenses: List[dict]) -> List[int]:
+        """Add several expenses with a single write, returning their ids.
+
+        The expenses must have been validated, e.g. by Expense.validate_batch.
+        """
+        with self._write_lock():
+            first_id = self._next_id
+            ids = list(range(first_id, first_id + len(expenses)))
+            self._write_entries(
+                [(expense_id, "add", e) for expense_id, e in zip(ids, expenses)]
+            )
+        return ids
+
+    def import_expenses(self, expenses: List[dict]) -> Tuple[List[int], int]:
+        """Add the expenses which are not in the ledger yet.
+
+        An expense is a duplicate if the ledger holds an expense with the same
+        fingerprint (see dedup.fingerprint). Identical expenses are counted,
+        so a transaction appearing twice in the import and once in the ledger
+        is added once. Returns the ids of the added expenses and the number
+        of duplicates skipped. The expenses must have been validated.
+        """
+        with self._write_lock():
+            seen: Dict[int, int] = {}
+            new_expenses = []
+            for expense in expenses:
+                day = parse_day(expense["date"])
+                # The fingerprints of spilled expenses are not in memory
+                self._ensure_resident(None, day)
+                value = fingerprint(
+                    day,
+                    float(expense["cost"]),
+                    expense["currency"],
+                    expense["account"],
+                    expense["note"],
+                )
+                seen[value] = seen.get(value, 0) + 1
+                if seen[value] > self.fingerprints.count(value):
+                    new_expenses.append(expense)
+            self._commit()
+            ids = self.add_expenses(new_expenses)
+        return ids, len(expenses) - len(new_expenses)
+
+    def _write_entry(self, expense_id: int, op: str, expense: Optional[dict]):
+        self._write_entries([(expense_id, op, expense)])
+
+    def _write_entries(self, changes: List[Tuple[int, str, Optional[dict]]]):
+        """Append entries to the WAL and the CSV file, and apply them in memory."""
+        if not changes:
+            return
+        entries = []
+        for expense_id, op, expense in changes:
+            entry = {"id": expense_id, "op": op}
+            if expense is not None:
+                entry.update(expense)
+            entries.append(entry)
+        self._wal.append_many(
+            {"seq": self._log_entries + i, "entry": entry}
+            for i, entry in enumerate(entries)
+        )
+        self._save_entries_to_csv(entries)
+        for entry in entries:
+            self._apply_entry(entry["id"], entry["op"], entry)
+            if entry["op"] != "delete":
+                row = self._rows_by_id[entry["id"]]
+                self.search_index.add(row, self._search_text(row))
+        self.version += 1
+        self._commit()
+        self._schedule_maintenance()
+
+    def _commit(self):
+        """Publish the writes applied so far to the readers, see read_view.
+
+        The columns, the spilled partitions, the search index, frozen copies
+        of the sketches and balances, and the content tag are published
+        together, so that readers never count an expense twice or miss one
+        while a compaction moves it. Must hold the writer lock.
+        """
+        self.expenses.commit()
+        self._published = PublishedState(
+            self.expenses,
+            self.spilled,
+            self.search_index,
+            self.sketches.freeze(),
+            self.balances.freeze(),
+            f"{self._log_entries + self._archived_entries}-{self._content_hash:08x}",
+            self.expenses.version,
         )
-        self.expenses.append(expense)
-        self._save_expense_to_csv(expense)
 
-    def _save_expense_to_csv(self, expense: Expense):
-        """Save a single expense to the CSV file."""
+    def read_view(self) -> ExpenseColumns:
+        """Return an immutable view of the expenses in memory, as of the last write.
+
+        It takes no lock, so readers never wait for writers, unless another
+        tracker wrote to the ledger since: see _current and
+        ExpenseColumns.read_view.
+        """
+        return self._current().expenses.read_view()
+
+    def _save_entries_to_csv(self, entries: List[dict]):
+        """Save log entries to the CSV file."""
         file_exists = self.csv_file.is_file()
         with self.csv_file.open(mode="a", newline="") as file:
-            writer = csv.DictWriter(file, fieldnames=Expense.__fields__.keys())
+            writer = csv.DictWriter(file, fieldnames=LOG_FIELDS)
             if not file_exists:
                 writer.writeheader()
-            writer.writerow(expense.dict())
+            writer.writerows(entries)
+        self._mark_synced()
+
+    @property
+    def etag(self) -> str:
+        """Tag identifying the current content of this tracker instance."""
+        return f"{self._instance}-{self.version}"
+
+    @property
+    def content_tag(self) -> str:
+        """Tag identifying the content of the ledger, across processes.
+
+        Unlike the etag, it is the same in every process which applied the
+        same entries, so it can key the values shared between them.
+        """
+        return self._current().content_tag
 
-    def get_expenses(self) -> List[Expense]:
+    def dead_ratio(self) -> float:
+        """Return the share of entries of the CSV file and partitions which are dead."""
+        entries = self._archived_entries + self._log_entries
+        if not entries:
+            return 0.0
+        return 1 - len(self._rows_by_id) / entries
+
+    def _schedule_maintenance(self):
+        """Start a background compaction or snapshot if one is due."""
+        if self._maintenance is not None and self._maintenance.is_alive():
+            return
+        if (
+            self._log_entries >= COMPACTION_MIN_ENTRIES
+            and self.dead_ratio() > COMPACTION_THRESHOLD
+        ) or (
+            self.partitions.period is not None
+            and self._log_entries >= PARTITION_FOLD_ENTRIES
+        ):
+            target = self.compact
+        elif self._log_entries - self._snapshot_entries >= SNAPSHOT_INTERVAL:
+            target = self.snapshot
+        else:
+            return
+        self._maintenance = threading.Thread(
+            target=target, name="expenses-maintenance", daemon=True
+        )
+        self._maintenance.start()
+
+    def compact(self):
+        """Rewrite the CSV file keeping only the latest version of each expense.
+
+        The live expenses are written to a temporary file, and copied to fresh
+        in-memory columns, without holding the writer lock. The lock is only
+        taken at the end, to copy and apply the entries appended in the
+        meantime and swap the files. Since the entries are renumbered, the WAL
+        is cleared and a new snapshot is written.
+
+        With a partition period, the expenses are archived in date order to
+        the partitions instead, and the CSV file is left with the entries
+        appended in the meantime only. The partitions are written first, so
+        that after a crash the old CSV file is replayed on top of them. The
+        spilled partitions are kept as they are, and the periods which left
+        the resident window are spilled.
+        """
+        period = self.partitions.period
+        resident_from = self._resident_from()
+        with self._maintenance_lock:
+            with self._write_lock():
+                offset = self.csv_file.stat().st_size if self.csv_file.exists() else 0
+                generation = self._synced
+                self._commit()
+                current = self.expenses.read_view()
+                spilled = set(self.spilled)
+                published_sketches = self._published.sketches
+            rows = current.live_rows()
+            sketches = published_sketches.subset(spilled)
+            if period is not None:
+                rows.sort(key=current.day.__getitem__)
+
+            expenses = ExpenseColumns()
+            rows_by_id = {}
+            ranges: Dict[str, Tuple[int, int]] = {}
+            tmp_file = self.csv_file.with_name(
+                f"{self.csv_file.name}.{self._instance}.compact"
+            )
+            with tmp_file.open(mode="w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(LOG_FIELDS)
+                for row in rows:
+                    record = current[row]
+                    if period is None:
+                        writer.writerow([record.id, "add", *record[1:]])
+                    new_row = expenses.append(
+                        record.id,
+                        record.category,
+                        record.cost,
+                        record.note,
+                        parse_day(record.date),
+                        record.currency,
+                        record.account,
+                    )
+                    rows_by_id[record.id] = new_row
+                    if period is not None:
+                        key = period_of(expenses.day[new_row], period)
+                        ranges[key] = (ranges.get(key, (new_row,))[0], new_row + 1)
+            if period is None:
+                obsolete = self.partitions.remove()
+            else:
+                obsolete = self.partitions.write(expenses, ranges, keep=spilled)
+            sketches.rebuild(expenses)
+
+            # Spill the periods before the resident window: the rows are
+            # sorted by day, so the resident ones are the last rows
+            fingerprints = None
+            if resident_from is not None:
+                spilled |= {key for key in ranges if key < resident_from}
+                first = min(
+                    [start for key, (start, _) in ranges.items() if key not in spilled],
+                    default=len(expenses),
+                )
+                expenses = expenses.tail(first)
+                rows_by_id = {
+                    expense_id: row - first
+                    for expense_id, row in rows_by_id.items()
+                    if row >= first
+                }
+                fingerprints = FingerprintIndex()
+            search_index = TrigramIndex()
+            for row in range(len(expenses)):
+                note = expenses.notes[row]
+                category = expenses.categories.values[expenses.category[row]]
+                search_index.add(row, f"{note}\n{category}")
+                if fingerprints is not None:
+                    fingerprints.add(
+                        fingerprint(
+                            int(expenses.day[row]),
+                            float(expenses.cost[row]),
+                            expenses.currencies.values[expenses.currency[row]],
+                            expenses.accounts.values[expenses.account[row]],
+                            note,
+                        )
+                    )
+            search_index.save(self.search_index_file)
+            manifest = self.partitions.load()
+            archived = 0 if period is None else len(expenses)
+
+            with self._write_lock():
+                if (self._synced or (None, None))[:2] != (generation or (None, None))[
+                    :2
+                ]:
+                    # Rewritten by the compaction of another tracker meanwhile
+                    tmp_file.unlink(missing_ok=True)
+                    return
+                tail = b""
+                if self.csv_file.exists():
+                    with self.csv_file.open(mode="rb") as source:
+                        source.seek(offset)
+                        tail = source.read()
+                with tmp_file.open(mode="ab") as file:
+                    file.write(tail)
+                    file.flush()
+                    os.fsync(file.fileno())
+                tmp_file.replace(self.csv_file)
+                self._mark_synced()
+                self._wal.reset()
+                self.snapshot_file.unlink(missing_ok=True)
+
+                self.expenses = expenses
+                self._rows_by_id = rows_by_id
+                self.search_index = search_index
+                self.sketches = sketches
+                self.spilled = {key: manifest[key] for key in sorted(spilled)}
+                if fingerprints is not None:
+                    self.fingerprints = fingerprints
+                self._log_entries = len(expenses) - archived
+                self._archived_entries = archived
+                self._snapshot_entries = 0
+                reader = csv.DictReader(
+                    io.StringIO(tail.decode(), newline=""), fieldnames=LOG_FIELDS
+                )
+                for entry in reader:
+                    expense_id = int(entry["id"])
+                    # Unless rebuilt, the fingerprints of the tail are already
+                    # indexed
+                    self._apply_entry(
+                        expense_id,
+                        entry["op"],
+                        entry,
+                        fingerprints=fingerprints is not None,
+                        replay=True,
+                    )
+                    if entry["op"] != "delete":
+                        row = self._rows_by_id[expense_id]
+                        self.search_index.add(row, self._search_text(row))
+                self._commit()
+
+            self.partitions.delete(obsolete)
+            self.snapshot()
+
+    def get_expenses(self) -> List[ExpenseRecord]:
         """Return the list of expenses."""
-        return self.expenses
+        return list(self.read_view())
+
+    def get_expense(self, expense_id: int) -> ExpenseRecord:
+        """Return the latest version of an expense."""
+        self._current()
+        with self._lock:
+            return self.expenses[self._rows_by_id[expense_id]]
+
+    def row_of(self, expense_id: int) -> int:
+        """Return the row holding the latest version of an expense.
+
+        A compaction renumbers the rows: check the id of the row in the view
+        it is read from.
+        """
+        self._current()
+        with self._lock:
+            return self._rows_by_id[expense_id]
+
+    def history(self, spilled: Optional[Dict[str, Partition]] = None) -> pd.DataFrame:
+        """Return the sums of the spilled expenses, like aggregate_expenses.
+
+        They are cached until the spilled partitions change, and computed
+        from the published ones by default.
+        """
+        if spilled is None:
+            spilled = self._current().spilled
+        cached = self._history
+        if cached is None or cached[0] is not spilled:
+            cached = self._history = (
+                spilled,
+                aggregates_frame(
+                    [row for p in spilled.values() for row in p.aggregates]
+                ),
+            )
+        return cached[1]
+
+    def aggregate(self) -> pd.DataFrame:
+        """Sum all the expenses, spilled or not, see aggregate_expenses."""
+        expenses, spilled = self._current()[:2]
+        cube = aggregate_expenses(expenses.read_view())
+        if not spilled:
+            return cube
+        return pd.concat([cube, self.history(spilled)], ignore_index=True)
+
+    def read_history(
+        self, start: Optional[int] = None, end: Optional[int] = None, raw: bool = True
+    ) -> Tuple[ExpenseColumns, pd.DataFrame]:
+        """Read the spilled expenses between two day ordinals, both included.
+
+        The expenses are read from the partition files, without paging them
+        in. Unless raw, the partitions fully inside the range are returned as
+        their aggregates instead.
+        """
+        spilled = self._current().spilled
+        partitions = [p for p in spilled.values() if p.overlaps(start, end)]
+        summarized = [] if raw else [p for p in partitions if p.within(start, end)]
+        columns = self.partitions.read_columns(
+            [p for p in partitions if p not in summarized], start, end
+        )
+        return columns, aggregates_frame(
+            [row for p in summarized for row in p.aggregates]
+        )
+
+    def archived(self) -> Tuple[int, Optional[int]]:
+        """Return the number of spilled expenses, and the last day they cover."""
+        spilled = self._current().spilled
+        if not spilled:
+            return 0, None
+        return (
+            sum(partition.rows for partition in spilled.values()),
+            max(parse_day(partition.last_date) for partition in spilled.values()),
+        )
+
+    def search_history(self, query: str) -> ExpenseColumns:
+        """Return the spilled expenses whose note or category contains the query.
+
+        The partition files are read one at a time, without paging them in,
+        so that only the matches are kept in memory.
+        """
+        query = query.strip().lower()
+        matches = ExpenseColumns()
+        if not query:
+            return matches
+        for partition in self._current().spilled.values():
+            columns = self.partitions.read_columns([partition])
+            for row in range(len(columns)):
+                if query in self._search_text(row, columns).lower():
+                    matches.append(
+                        int(columns.ids[row]),
+                        columns.categories.values[columns.category[row]],
+                        float(columns.cost[row]),
+                        columns.notes[row],
+                        int(columns.day[row]),
+                        columns.currencies.values[columns.currency[row]],
+                        columns.accounts.values[columns.account[row]],
+                    )
+        return matches
+
+    def distributions(self, dimension: str) -> Dict[Tuple[str, str], TDigest]:
+        """Return the sketches of the costs of all the expenses, spilled or not.
+
+        They are keyed by value of the dimension ("category" or "account")
+        and currency, the costs being in that currency. The published
+        sketches are shared with the other readers: stale ones are refreshed
+        on a copy, kept until the next write.
+        """
+        published = self._current()
+        sketches = published.sketches
+        if sketches.stale or sketches.totals is None:
+            with self._refresh_lock:
+                cached = self._refreshed
+                if cached is None or cached[0] is not published:
+                    published, columns = self._published_view()
+                    refreshed = published.sketches.refreshed(columns)
+                    self._adopt_sketches(published, refreshed)
+                    cached = self._refreshed = (published, refreshed)
+            sketches = cached[1]
+        return sketches.distributions(dimension)
+
+    def _published_view(self) -> Tuple[PublishedState, ExpenseColumns]:
+        """Return the published state, and a view of its expenses as of the same write.
+
+        The stale months of the sketches are rebuilt from this view: a later
+        one may have killed rows whose new versions the other months of the
+        sketches do not hold yet.
+        """
+        while True:
+            published = self._current()
+            columns = published.expenses.read_view()
+            # The view is of a later write if the expenses were committed since
+            if published.expenses.version == published.version:
+                return published, columns
+
+    def _adopt_sketches(self, published: PublishedState, sketches: ExpenseSketches):
+        """Take refreshed copies of the published sketches, if nothing was written since.
+
+        The writer lock is only tried, so that readers never wait for it.
+        """
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._published is published:
+                self.sketches = sketches.thaw()
+        finally:
+            self._lock.release()
+
+    def account_spend(
+        self, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Dict[BalanceKey, float]:
+        """Return the spend of every account and currency between two days.
+
+        Both days are included, and None leaves the range open. The costs are
+        in the currency of their key.
+        """
+        return self._current().balances.spend(start, end)
+
+    def account_spend_at(self, days: Iterable[int]) -> Dict[BalanceKey, np.ndarray]:
+        """Return the cumulative spend of every account and currency at days."""
+        return self._current().balances.totals_at(days)
+
+    def first_day(self) -> Optional[int]:
+        """Return the day of the first expense, spilled or not, if any."""
+        return self._current().balances.first_day()
 
     def get_summary_by_category(self):
         """Generate a summary of expenses by category."""
-        summary = {}
-        for expense in self.expenses:
-            if expense.category not in summary:
-                summary[expense.category] = 0
-            summary[expense.category] += expense.cost
-        return summary
+        totals = self.aggregate().groupby("category", observed=False)["cost"].sum()
+        return dict(zip(totals.index, totals.tolist()))
 
     # def check_csv_columns(self):
     #     """Check if the CSV file has the required columns."""
@@ -0,0 +1,91 @@
+"""Module for the write-ahead log of the expense tracker."""
+
+import json
+import logging
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Iterable, Iterator
+
+# Every record is framed by its payload length and the CRC32 of the payload
+HEADER = struct.Struct("<II")
+
+
+class WriteAheadLog:
+    """Append-only file of checksummed JSON records.
+
+    Records are written (and optionally fsynced) before the corresponding
+    change reaches the CSV file, so they can be replayed after a crash. When
+    reading, the log stops at the first torn or corrupted record.
+
+    The log can be rotated: the current file is moved aside while a snapshot
+    is being written, and discarded once the snapshot is safely on disk.
+    """
+
+    def __init__(self, path: Path, fsync: bool = True):
+        self.path = Path(path)
+        self.rotated_path = self.path.with_name(self.path.name + ".prev")
+        self.fsync = fsync
+
+    def is_empty(self) -> bool:
+        return not (self.path.exists() or self.rotated_path.exists())
+
+    def append(self, record: dict):
+        """Durably append a single record."""
+        self.append_many([record])
+
+    def append_many(self, records: Iterable[dict]):
+        """Durably append several records with a single write."""
+        data = bytearray()
+        for record in records:
+            payload = json.dumps(record, separators=(",", ":")).encode()
+            data += HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self.path.open(mode="ab") as file:
+            file.write(data)
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+
+    def records(self) -> Iterator[dict]:
+        """Iterate over the valid records, the rotated ones first."""
+        for path in (self.rotated_path, self.path):
+            if path.exists():
+                yield from self._read(path)
+
+    @staticmethod
+    def _read(path: Path) -> Iterator[dict]:
+        with path.open(mode="rb") as file:
+            data = file.read()
+        position = 0
+        while position < len(data):
+            if position + HEADER.size > len(data):
+                logging.warning(f"Skipping torn record at the end of {path}")
+                return
+            length, checksum = HEADER.unpack_from(data, position)
+            payload = data[position + HEADER.size : position + HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                logging.warning(f"Skipping torn or corrupted records of {path}")
+                return
+            yield json.loads(payload)
+            position += HEADER.size + length
+
+    def rotate(self):
+        """Move the current records aside, keeping any previous rotated ones."""
+        if not self.path.exists():
+            return
+        if self.rotated_path.exists():
+            with self.rotated_path.open(mode="ab") as file:
+                file.write(self.path.read_bytes())
+            self.path.unlink()
+        else:
+            self.path.replace(self.rotated_path)
+
+    def discard_rotated(self):
+        """Delete the rotated records."""
+        self.rotated_path.unlink(missing_ok=True)
+
+    def reset(self):
+        """Delete all the records."""
+        self.discard_rotated()
+        self.path.unlink(missing_ok=True)
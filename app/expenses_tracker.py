@@ -1,19 +1,49 @@
 """Module to create the Dash app for the Expense Tracker."""
 
 from datetime import datetime
+from urllib.parse import parse_qs
 
 import dash
 import pandas as pd
-from dash import Input, Output, State, dcc, html
-
-from .config import color_palette, dark_mode_colors, light_mode_colors
+from dash import Input, Output, Patch, State, dash_table, dcc, html
+
+from .api import register_api
+from .analytics import (
+    MONTH_LABEL_FORMAT,
+    compute_statistics,
+    summarize_by_category,
+    summarize_by_month,
+    total_by_month,
+)
+from .cache import shared_cache
+from .config import (
+    AGGREGATE_CACHE_TTL,
+    CURRENCIES,
+    CURRENCY_SYMBOLS,
+    DEFAULT_LEDGER_ID,
+    JOB_POLL_INTERVAL,
+    color_palette,
+    dark_mode_colors,
+    light_mode_colors,
+)
 from .content import create_app_content
-from .data.tracker import ExpenseTracker
+from .data.registry import TrackerRegistry
+from .fx import LIVE
+from .jobs import LocalJobManager
 from .utils import (
-    convert_income_to_euro,
-    convert_to_euro,
+    account_spend_over_time,
+    aggregate_shared,
+    apply_table_edits,
+    columns_to_frame,
+    convert_amount,
+    convert_costs,
+    describe_archived,
     ensure_csv_exists,
+    expenses_to_records,
+    import_csv_files,
     load_expenses,
+    resolve_rates,
+    summarize_distributions,
 )
 
 colors = dark_mode_colors
@@ -21,10 +51,10 @@ colors = dark_mode_colors
 # Ensure the CSV file exists
 ensure_csv_exists()
 
-# Initialize the ExpenseTracker
-expense_tracker = ExpenseTracker()
+# Initialize the registry of the ExpenseTrackers, one per ledger
+tracker_registry = TrackerRegistry()
 
-# Initialize Dash app
+# Initialize Dash app, running the heavy callbacks as background jobs
 app = dash.Dash(
     __name__,
     external_stylesheets=[
@@ -32,6 +62,7 @@ app = dash.Dash(
         "/assets/style.css",
         "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css",
     ],
+    background_callback_manager=LocalJobManager(),
 )
 
 style = {
@@ -54,11 +85,17 @@ buttons_style = {
     "fontSize": "15px",
 }
 
+# JSON API served by the same Flask server
+register_api(app.server, tracker_registry)
+
 # Layout of the app
 app.layout = html.Div(
     id="main-container",
     style=style,
     children=[
+        dcc.Location(id="url", refresh=False),
+        # Ledger of the current browser session, selected with "?ledger=<id>"
+        dcc.Store(id="ledger-id", storage_type="session"),
         html.Button(
             "Toggle Light/Dark Mode",
             id="toggle-button",
@@ -87,6 +124,37 @@ app.layout = html.Div(
             },
             multiple=True,
         ),
+        html.Div(id="upload-message", style={"margin": "10px"}),
+        # Progress of the background jobs, shown while one is running
+        html.Div(
+            [
+                html.Progress(id="job-progress", style={"display": "none"}),
+                html.Button(
+                    "Cancel",
+                    id="cancel-job-button",
+                    style={"display": "none"},
+                ),
+            ],
+            style={"margin": "10px"},
+        ),
+        # Etag of the ledger, changed by the writes to refresh the view
+        dcc.Store(id="ledger-version"),
+        # Etag of the ledger once patched in the view, to update the other panels
+        dcc.Store(id="ledger-delta"),
+        # Labels and totals of the summary figures, see index_figures
+        dcc.Store(id="figure-index"),
+        # Currency of the converted costs, figures and statistics
+        dcc.Dropdown(
+            id="reporting-currency",
+            options=[
+                {"label": f"Report in {currency}", "value": currency}
+                for currency in CURRENCIES
+            ],
+            value="EUR",
+            clearable=False,
+            persistence=True,
+            style={"width": "200px", "margin": "10px"},
+        ),
         html.H1(
             "The Expense Tracker",
             style={
@@ -98,19 +166,41 @@ app.layout = html.Div(
                 "marginTop": "5px",
             },
         ),
-        create_app_content(colors, expense_tracker),
+        create_app_content(colors, tracker_registry.get()),
     ],
 )
 
 
+def get_session_tracker(ledger_id):
+    """Return the ExpenseTracker of the ledger selected by the session."""
+    return tracker_registry.get(ledger_id or DEFAULT_LEDGER_ID)
+
+
+# Callback to select the ledger of the session from the URL
+@app.callback(
+    Output("ledger-id", "data"),
+    Input("url", "search"),
+    State("ledger-id", "data"),
+)
+def select_ledger(search, current_ledger_id):
+    requested = parse_qs((search or "").lstrip("?")).get("ledger", [None])[0]
+    ledger_id = requested or current_ledger_id or DEFAULT_LEDGER_ID
+    try:
+        tracker_registry.ledger_path(ledger_id)
+    except ValueError:
+        ledger_id = DEFAULT_LEDGER_ID
+    return ledger_id
+
+
 # Callback to toggle between light and dark mode
 @app.callback(
     Output("main-container", "style"),
     Output("toggle-button", "style"),
     Output("app-content", "children"),
     Input("toggle-button", "n_clicks"),
+    Input("ledger-id", "data"),
 )
-def toggle_light_dark_mode(n_clicks):
+def toggle_light_dark_mode(n_clicks, ledger_id):
     if n_clicks is None or n_clicks % 2 == 0:
         colors = dark_mode_colors
     else:
@@ -120,48 +210,366 @@ def toggle_light_dark_mode(n_clicks):
 
     button_style = buttons_style
 
-    app_content = (create_app_content(colors, expense_tracker),)
+    app_content = (create_app_content(colors, get_session_tracker(ledger_id)),)
 
     return container_style, button_style, app_content
 
 
-# @app.callback(
-#     # Output("output-data-upload", "children"),
-#     Input("upload-data", "contents"),
-#     State("upload-data", "filename"),
-#     State("upload-data", "last_modified"),
-# )
-# def update_output(list_of_contents, list_of_names, list_of_dates):
-#     if list_of_contents is not None:
-#         for content, name in zip(list_of_contents, list_of_names):
-#             # Save the uploaded content to a temporary file
-#             content_type, content_string = content.split(",")
-#             decoded = base64.b64decode(content_string)
-#             with open(name, "wb") as f:
-#                 f.write(decoded)
-
-#             # Create an instance of ExpenseTracker with the uploaded file
-#             tracker = ExpenseTracker(name)
-
-#             # Check the CSV columns
-#             try:
-#                 tracker.check_csv_columns()
-#                 # Load expenses if the check is successful
-#                 tracker._load_expenses()
-#                 return f"Successfully loaded {name} with required columns."
-#             except ValueError as e:
-#                 return str(e)
+# The table and search only cover the expenses in memory: show the archived ones
+@app.callback(
+    Output("archived-notice", "children"),
+    Output("search-archived", "style"),
+    Input("ledger-id", "data"),
+    Input("ledger-version", "data"),
+    Input("ledger-delta", "data"),
+    State("search-archived", "style"),
+)
+def update_archived_notice(ledger_id, ledger_version, ledger_delta, checklist_style):
+    notice = describe_archived(get_session_tracker(ledger_id))
+    return notice, {**(checklist_style or {}), "display": "block" if notice else "none"}
 
 
 @app.callback(
-    Output("expenses-table", "data"),
-    Output("category-summary", "figure"),
-    Output("monthly-summary", "figure"),
-    Output("statistics-output", "children"),
-    Output("income-update-message", "children"),
+    Output("search-results", "children"),
+    Input("search-query", "value"),
+    Input("ledger-id", "data"),
+    Input("reporting-currency", "value"),
+    Input("search-archived", "value"),
+)
+def search_expenses(query, ledger_id, reporting_currency, search_archived):
+    if not query or not query.strip():
+        return ""
+
+    expense_tracker = get_session_tracker(ledger_id)
+    columns = expense_tracker.read_view()
+    rows = expense_tracker.search_expenses(query, columns)
+    df = columns_to_frame(columns, rows)
+    archived = 0
+    if search_archived:
+        # Read from the partition files on demand, without paging them in
+        archived_df = columns_to_frame(expense_tracker.search_history(query))
+        archived = len(archived_df)
+        df = pd.concat([df, archived_df], ignore_index=True)
+    if df.empty:
+        return f"No expenses matching '{query}'."
+
+    df = convert_costs(df, reporting_currency)
+    symbol = CURRENCY_SYMBOLS[reporting_currency]
+    archived_text = f" ({archived} archived)" if archived else ""
+    return [
+        html.P(
+            f"{len(df)} expenses matching '{query}'{archived_text}, "
+            f"total: {df['converted_cost'].sum():.2f} {symbol}",
+            style={"textAlign": "center"},
+        ),
+        dash_table.DataTable(
+            columns=[
+                {"name": i, "id": i}
+                for i in [
+                    "category",
+                    "cost",
+                    "note",
+                    "date",
+                    "currency",
+                    "converted_cost",
+                ]
+            ],
+            data=expenses_to_records(df),
+            style_header={
+                "backgroundColor": colors["button"],
+                "color": colors["text"],
+                "fontWeight": "bold",
+            },
+            style_cell={
+                "backgroundColor": colors["table_bg"],
+                "color": colors["text"],
+                "textAlign": "center",
+                "padding": "10px",
+            },
+            style_as_list_view=True,
+            page_size=10,
+            sort_action="native",
+        ),
+    ]
+
+
+def describe_rates(rates) -> str:
+    """Describe the sources of the exchange rates, listing the ones not live."""
+    stale = {currency: rate.source for currency, rate in rates.items()}
+    stale = {currency: source for currency, source in stale.items() if source != LIVE}
+    if not stale:
+        return LIVE
+    return ", ".join(
+        f"{currency}: {source}" for currency, source in sorted(stale.items())
+    )
+
+
+def create_statistics_table(statistics, rates=None, currency="EUR"):
+    """Create the table showing the statistics computed by compute_statistics.
+
+    The amounts are in the given currency. If the exchange rates to it are
+    given, their sources are shown too.
+    """
+    symbol = CURRENCY_SYMBOLS[currency]
+    total_income = statistics["total_income"]
+    total_expenses = statistics["total_expenses"]
+    total_profit_loss = statistics["total_profit_loss"]
+    mean_expenses = statistics["mean_expenses"]
+    mean_profit_loss = statistics["mean_profit_loss"]
+
+    return html.Table(
+        children=[
+            html.Tr(
+                [
+                    html.Td("Total Income:", style={"padding": "10px"}),
+                    html.Td(f"{total_income:.2f} {symbol}", style={"padding": "10px"}),
+                ]
+            ),
+            html.Tr(
+                [
+                    html.Td("Total Expenses:", style={"padding": "10px"}),
+                    html.Td(
+                        f"{total_expenses:.2f} {symbol}", style={"padding": "10px"}
+                    ),
+                ]
+            ),
+            html.Tr(
+                [
+                    html.Td("Total Profit/Loss:", style={"padding": "10px"}),
+                    html.Td(
+                        f"{total_profit_loss:.2f} {symbol}", style={"padding": "10px"}
+                    ),
+                ]
+            ),
+            html.Tr(
+                [
+                    html.Td("Mean Monthly Expenses:", style={"padding": "10px"}),
+                    html.Td(f"{mean_expenses:.2f} {symbol}", style={"padding": "10px"}),
+                ]
+            ),
+            html.Tr(
+                [
+                    html.Td("Mean Monthly Profit/Loss:", style={"padding": "10px"}),
+                    html.Td(
+                        f"{mean_profit_loss:.2f} {symbol}", style={"padding": "10px"}
+                    ),
+                ]
+            ),
+        ]
+        + (
+            []
+            if rates is None
+            else [
+                html.Tr(
+                    [
+                        html.Td("Exchange Rates:", style={"padding": "10px"}),
+                        html.Td(describe_rates(rates), style={"padding": "10px"}),
+                    ]
+                )
+            ]
+        ),
+        style={
+            "width": "90%",
+            "margin": "0 auto",
+            "color": colors["text"],
+            "textAlign": "left",
+            "borderCollapse": "collapse",
+            "fontSize": "15px",
+        },
+        className="statistics-table",
+    )
+
+
+def create_distribution_table(distributions, dimension, currency="EUR"):
+    """Create the table of the distributions computed by summarize_distributions."""
+    symbol = CURRENCY_SYMBOLS[currency]
+    cell_style = {"padding": "10px"}
+    header = [dimension.capitalize(), "Expenses", "Median", "P90", "Outliers"]
+    return html.Table(
+        children=[html.Tr([html.Th(name, style=cell_style) for name in header])]
+        + [
+            html.Tr(
+                [
+                    html.Td(row[dimension], style=cell_style),
+                    html.Td(f"{row['count']}", style=cell_style),
+                    html.Td(f"{row['median']:.2f} {symbol}", style=cell_style),
+                    html.Td(f"{row['p90']:.2f} {symbol}", style=cell_style),
+                    html.Td(
+                        f"{row['outliers']} above {row['outlier_above']:.2f} {symbol}",
+                        style=cell_style,
+                    ),
+                ]
+            )
+            for _, row in distributions.iterrows()
+        ],
+        style={
+            "width": "90%",
+            "margin": "20px auto 0",
+            "color": colors["text"],
+            "textAlign": "left",
+            "borderCollapse": "collapse",
+            "fontSize": "15px",
+        },
+        className="statistics-table",
+    )
+
+
+def create_statistics_panel(expense_tracker, statistics, rates, currency="EUR"):
+    """Create the statistics table, and the distributions of the costs.
+
+    The distributions by category and account come from the quantile
+    sketches of the tracker, so they take the same time for any ledger size.
+    """
+    return [
+        create_statistics_table(statistics, rates.rates_to(currency), currency),
+        *(
+            create_distribution_table(
+                summarize_distributions(expense_tracker, dimension, currency, rates),
+                dimension,
+                currency,
+            )
+            for dimension in ("category", "account")
+        ),
+    ]
+
+
+def index_figures(category_figure, monthly_figure):
+    """Return the labels and totals of the summary figures.
+
+    The add path patches the figures from this index, so that the browser
+    does not have to send the whole figures back with every new expense.
+    """
+    if not category_figure or not monthly_figure:
+        return None
+    bars = category_figure["data"][0]
+    annotations = monthly_figure["layout"]["annotations"]
+    return {
+        "categories": [str(category) for category in bars["x"]],
+        "category_totals": [float(total) for total in bars["y"]],
+        "stacks": [
+            [trace["name"], [str(month) for month in trace["x"]]]
+            for trace in monthly_figure["data"]
+        ],
+        "months": [annotation["x"] for annotation in annotations],
+        "month_totals": [float(annotation["y"]) for annotation in annotations],
+    }
+
+
+def build_expense_delta(
+    expense_tracker,
+    expense_id,
+    figure_index,
+    monthly_income,
+    income_currency,
+    reporting_currency,
+):
+    """Build partial updates of the table, figures and their index for a new expense.
+
+    Only the new row, the changed bar, stack and monthly total are sent to the
+    browser, so neither the request nor the response grows with the ledger.
+    Returns None if the figures cannot be patched (e.g. first expense of a
+    category or month or figures not rendered yet), in which case everything
+    is recomputed.
+    """
+    if not figure_index:
+        return None
+    rates = resolve_rates(
+        [*expense_tracker.expenses.currencies.values, income_currency or "EUR"],
+        reporting_currency,
+    )
+    columns = expense_tracker.read_view()
+    row = expense_tracker.row_of(expense_id)
+    if row >= len(columns) or columns.ids[row] != expense_id:
+        return None  # Renumbered by a compaction meanwhile
+    df = convert_costs(columns_to_frame(columns, [row]), reporting_currency, rates)
+    if df.empty:
+        return None
+    category = df["category"].iloc[0]
+    cost = float(df["converted_cost"].iloc[0])
+    month = df["date"].iloc[0].strftime(MONTH_LABEL_FORMAT)
+
+    categories = figure_index["categories"]
+    traces = [name for name, _ in figure_index["stacks"]]
+    if category not in categories or category not in traces:
+        return None
+    trace = traces.index(category)
+    if month not in figure_index["stacks"][trace][1]:
+        return None
+    bar = categories.index(category)
+    stack = figure_index["stacks"][trace][1].index(month)
+    months = figure_index["months"]
+    total = months.index(month)
+
+    category_totals = list(figure_index["category_totals"])
+    category_totals[bar] += cost
+    totals = list(figure_index["month_totals"])
+    totals[total] += cost
+
+    category_patch = Patch()
+    category_patch["data"][0]["y"][bar] = category_totals[bar]
+    category_patch["data"][0]["text"][bar] = f"{category_totals[bar]:.2f}"
+    category_patch["layout"]["yaxis"]["range"] = [0, max(category_totals) * 1.2]
+
+    monthly_patch = Patch()
+    monthly_patch["data"][trace]["y"][stack] += cost
+    monthly_patch["layout"]["annotations"][total]["y"] = totals[total]
+    monthly_patch["layout"]["annotations"][total]["text"] = f"{totals[total]:.2f}"
+    monthly_patch["layout"]["yaxis"]["range"] = [0, max(totals) * 1.2]
+
+    index_patch = Patch()
+    index_patch["category_totals"][bar] = category_totals[bar]
+    index_patch["month_totals"][total] = totals[total]
+
+    table_patch = Patch()
+    table_patch.append(expenses_to_records(df)[0])
+
+    if monthly_income is None:
+        monthly_income_converted = None
+    else:
+        monthly_income_converted = convert_amount(
+            monthly_income, income_currency, reporting_currency, rates
+        )
+    statistics = compute_statistics(
+        pd.DataFrame({"month": months, "converted_cost": totals}),
+        monthly_income_converted,
+    )
+
+    return (
+        table_patch,
+        category_patch,
+        monthly_patch,
+        create_statistics_panel(expense_tracker, statistics, rates, reporting_currency),
+        index_patch,
+    )
+
+
+# Shown while a background job runs, and its cancel button
+job_running = [
+    (
+        Output("job-progress", "style"),
+        {"display": "inline-block", "marginRight": "10px"},
+        {"display": "none"},
+    ),
+    (
+        Output("cancel-job-button", "style"),
+        {"display": "inline-block"},
+        {"display": "none"},
+    ),
+]
+
+
+@app.callback(
+    Output("expenses-table", "data", allow_duplicate=True),
+    Output("category-summary", "figure", allow_duplicate=True),
+    Output("monthly-summary", "figure", allow_duplicate=True),
+    Output("statistics-output", "children", allow_duplicate=True),
     Output("error-message", "children"),
+    Output("ledger-version", "data", allow_duplicate=True),
+    Output("ledger-delta", "data"),
+    Output("figure-index", "data", allow_duplicate=True),
     Input("add-expense-button", "n_clicks"),
-    Input("set-income-button", "n_clicks"),
+    State("ledger-id", "data"),
+    State("reporting-currency", "value"),
     State("input-category", "value"),
     State("input-cost", "value"),
     State("input-note", "value"),
@@ -170,11 +578,13 @@ def toggle_light_dark_mode(n_clicks):
     State("input-account", "value"),
     State("input-monthly-income", "value"),
     State("input-income-currency", "value"),
-    State("expenses-table", "data"),
+    State("figure-index", "data"),
+    prevent_initial_call=True,
 )
-def update_expenses(
+def add_expense(
     add_expense_clicks,
-    set_income_clicks,
+    ledger_id,
+    reporting_currency,
     category,
     cost,
     note,
@@ -183,74 +593,145 @@ def update_expenses(
     account,
     monthly_income,
     income_currency,
-    data,
+    figure_index,
 ):
-    df = pd.DataFrame(data)
-
-    # Handle income update
-    income_update_message = ""
-    if set_income_clicks > 0:
-        if monthly_income is None or income_currency is None:
-            income_update_message = "Please provide both income amount and currency."
-
-    # Handle adding a new expense
-    if add_expense_clicks > 0:
-        if not category or cost is None or not date or not currency or not account:
-            return (
-                dash.no_update,
-                dash.no_update,
-                dash.no_update,
-                dash.no_update,
-                income_update_message,
-                "Error: Please fill in all required fields.",
-            )
+    """Record a new expense.
+
+    The view is patched when possible, and otherwise refreshed in the
+    background by refresh_expenses, through the ledger version. The
+    panels not patched are updated through the ledger delta.
+    """
+    expense_tracker = get_session_tracker(ledger_id)
+    unchanged = (dash.no_update,) * 4
+
+    if not category or cost is None or not date or not currency or not account:
+        return (
+            *unchanged,
+            "Error: Please fill in all required fields.",
+            dash.no_update,
+            dash.no_update,
+            dash.no_update,
+        )
 
-        try:
-            formatted_date = datetime.strptime(date, "%Y-%m-%d").strftime("%d-%m-%Y")
-        except ValueError:
-            return (
-                dash.no_update,
-                dash.no_update,
-                dash.no_update,
-                dash.no_update,
-                income_update_message,
-                "Error: Invalid date format.",
-            )
+    try:
+        formatted_date = datetime.strptime(date, "%Y-%m-%d").strftime("%d-%m-%Y")
+    except ValueError:
+        return (
+            *unchanged,
+            "Error: Invalid date format.",
+            dash.no_update,
+            dash.no_update,
+            dash.no_update,
+        )
 
-        expense_tracker.add_expense(
+    try:
+        expense_id = expense_tracker.add_expense(
             category, cost, note, formatted_date, currency, account
         )
+    except ValueError as e:
+        return (
+            *unchanged,
+            f"Error: {e}",
+            dash.no_update,
+            dash.no_update,
+            dash.no_update,
+        )
 
-    df = load_expenses(expense_tracker)
-    df = convert_to_euro(df)
+    # Send only the changes to the browser when possible
+    delta = build_expense_delta(
+        expense_tracker,
+        expense_id,
+        figure_index,
+        monthly_income,
+        income_currency,
+        reporting_currency,
+    )
+    if delta is not None:
+        *view, index_patch = delta
+        return (*view, "", dash.no_update, expense_tracker.etag, index_patch)
+    return (*unchanged, "", expense_tracker.etag, dash.no_update, dash.no_update)
 
-    if df.empty or not all(
-        col in df.columns
-        for col in [
-            "category",
-            "cost",
-            "note",
-            "date",
-            "currency",
-            "account",
-            "cost_euro",
-        ]
-    ):
-        return [], {}, {}, "", income_update_message, "No expenses to display."
+
+@app.callback(
+    Output("error-message", "children", allow_duplicate=True),
+    Output("ledger-version", "data", allow_duplicate=True),
+    Input("expenses-table", "data_timestamp"),
+    State("ledger-id", "data"),
+    State("expenses-table", "data"),
+    State("expenses-table", "data_previous"),
+    prevent_initial_call=True,
+)
+def edit_expenses(data_timestamp, ledger_id, data, data_previous):
+    """Record the rows edited or deleted in the table.
+
+    Invalid edits are rejected and reverted by refreshing the view.
+    """
+    if data_previous is None:
+        return dash.no_update, dash.no_update
+    expense_tracker = get_session_tracker(ledger_id)
+    error_message = ""
+    try:
+        apply_table_edits(expense_tracker, data_previous, data)
+    except (KeyError, ValueError) as e:
+        error_message = f"Error: Invalid edit ({e})."
+    return error_message, expense_tracker.etag
+
+
+@app.callback(
+    Output("upload-message", "children"),
+    Output("ledger-version", "data", allow_duplicate=True),
+    Input("upload-data", "contents"),
+    State("upload-data", "filename"),
+    State("ledger-id", "data"),
+    background=True,
+    progress=[Output("job-progress", "value"), Output("job-progress", "max")],
+    running=job_running,
+    cancel=[Input("cancel-job-button", "n_clicks")],
+    interval=JOB_POLL_INTERVAL,
+    prevent_initial_call=True,
+)
+def import_uploads(set_progress, upload_contents, upload_filenames, ledger_id):
+    """Import the uploaded CSV files, skipping the expenses already recorded.
+
+    A cancelled import stops before its next file: the files imported
+    before are kept.
+    """
+    if not upload_contents:
+        return dash.no_update, dash.no_update
+    expense_tracker = get_session_tracker(ledger_id)
+    upload_message = import_csv_files(
+        expense_tracker,
+        upload_contents,
+        upload_filenames,
+        lambda done, total: set_progress((str(done), str(total))),
+    )
+    return upload_message, expense_tracker.etag
+
+
+def build_summary_view(
+    expense_tracker,
+    summary_df,
+    rates,
+    reporting_currency,
+    monthly_income,
+    income_currency,
+):
+    """Build the figures and statistics of the sums of aggregate_expenses."""
+    summary_df = convert_costs(summary_df, reporting_currency, rates)
 
     # Create category summary figure
-    category_summary = df.groupby("category")["cost_euro"].sum().reset_index()
+    category_summary = summarize_by_category(summary_df)
     category_figure = {
         "data": [
             {
                 "x": category_summary["category"],
-                "y": category_summary["cost_euro"],
+                "y": category_summary["converted_cost"],
                 "type": "bar",
                 "marker": {
                     "color": colors["button"],
                     "line": {"width": 0},  # No outline
                 },
-                "text": category_summary["cost_euro"].apply(lambda x: f"{x:.2f}"),
+                "text": category_summary["converted_cost"].apply(lambda x: f"{x:.2f}"),
                 "textposition": "outside",  # Position labels outside
             }
         ],
@@ -259,27 +740,22 @@ def update_expenses(
             "paper_bgcolor": colors["block"],
             "font": {"color": colors["text"]},
             "yaxis": {
-                "range": [0, category_summary["cost_euro"].max() * 1.2]
+                "range": [0, category_summary["converted_cost"].max() * 1.2]
             },  # Increase y-axis limit
             "barmode": "group",
         },
     }
 
     # Create monthly summary figure
-    df["month_year"] = pd.to_datetime(df["date"], format="%d-%m-%Y").dt.strftime(
-        "%B %Y"
-    )
-    monthly_summary = (
-        df.groupby(["month_year", "category"])["cost_euro"].sum().reset_index()
-    )
-    total_monthly_cost = df.groupby("month_year")["cost_euro"].sum().reset_index()
+    monthly_summary = summarize_by_month(summary_df)
+    total_monthly_cost = total_by_month(summary_df)
 
     category_colors = {
         category: color_palette[i % len(color_palette)]
         for i, category in enumerate(monthly_summary["category"].unique())
     }
 
-    monthly_summary = monthly_summary.sort_values(by="month_year", ascending=False)
+    monthly_summary = monthly_summary.sort_values(by="month", ascending=False)
 
     monthly_figure = {
         "data": [
@@ -288,7 +764,7 @@ def update_expenses(
                     "month_year"
                 ],
                 "y": monthly_summary[monthly_summary["category"] == category][
-                    "cost_euro"
+                    "converted_cost"
                 ],
                 "type": "bar",
                 "name": category,
@@ -305,13 +781,13 @@ def update_expenses(
             "font": {"color": colors["text"]},
             "barmode": "stack",
             "yaxis": {
-                "range": [0, total_monthly_cost["cost_euro"].max() * 1.2]
+                "range": [0, total_monthly_cost["converted_cost"].max() * 1.2]
             },  # Increase y-axis limit
             "annotations": [
                 {
                     "x": row["month_year"],
-                    "y": row["cost_euro"],
-                    "text": f"{row['cost_euro']:.2f}",
+                    "y": row["converted_cost"],
+                    "text": f"{row['converted_cost']:.2f}",
                     "showarrow": False,
                     "font": {"color": colors["text"]},
                     "yanchor": "bottom",
@@ -323,76 +799,172 @@ def update_expenses(
 
     # Compute statistics
     if monthly_income is None:
-        total_income = 0
+        monthly_income_converted = None
     else:
-        monthly_income_euro = convert_income_to_euro(monthly_income, income_currency)
-        total_income = monthly_income_euro * df["month_year"].nunique()
+        monthly_income_converted = convert_amount(
+            monthly_income, income_currency, reporting_currency, rates
+        )
+    statistics_output = create_statistics_panel(
+        expense_tracker,
+        compute_statistics(total_monthly_cost, monthly_income_converted),
+        rates,
+        reporting_currency,
+    )
 
-    total_expenses = df["cost_euro"].sum()
-    total_profit_loss = total_income - total_expenses
+    return category_figure, monthly_figure, statistics_output
 
-    monthly_expenses = df.groupby("month_year")["cost_euro"].sum()
-    mean_expenses = monthly_expenses.mean()
 
-    # Handle the case where monthly_income is None
-    if monthly_income is None:
-        profit_loss_by_month = (
-            monthly_expenses * 0
-        )  # Set profit/loss to zero if no income is provided
-    else:
-        profit_loss_by_month = monthly_income - monthly_expenses
+@app.callback(
+    Output("expenses-table", "data"),
+    Output("category-summary", "figure"),
+    Output("monthly-summary", "figure"),
+    Output("statistics-output", "children"),
+    Output("income-update-message", "children"),
+    Output("figure-index", "data"),
+    Input("set-income-button", "n_clicks"),
+    Input("ledger-id", "data"),
+    Input("ledger-version", "data"),
+    Input("reporting-currency", "value"),
+    State("input-monthly-income", "value"),
+    State("input-income-currency", "value"),
+    background=True,
+    progress=[Output("job-progress", "value"), Output("job-progress", "max")],
+    running=job_running,
+    cancel=[Input("cancel-job-button", "n_clicks")],
+    interval=JOB_POLL_INTERVAL,
+)
+def refresh_expenses(
+    set_progress,
+    set_income_clicks,
+    ledger_id,
+    ledger_version,
+    reporting_currency,
+    monthly_income,
+    income_currency,
+):
+    """Recompute the table, figures and statistics of the whole ledger.
 
-    mean_profit_loss = profit_loss_by_month.mean()
+    It runs as a background job: a newer refresh of the same session
+    cancels it, and identical refreshes in flight share a single job.
+    """
+    expense_tracker = get_session_tracker(ledger_id)
+    steps = "4"
 
-    statistics_output = html.Table(
-        children=[
-            html.Tr(
-                [
-                    html.Td("Total Income:", style={"padding": "10px"}),
-                    html.Td(f"{total_income:.2f} €", style={"padding": "10px"}),
-                ]
-            ),
-            html.Tr(
-                [
-                    html.Td("Total Expenses:", style={"padding": "10px"}),
-                    html.Td(f"{total_expenses:.2f} €", style={"padding": "10px"}),
-                ]
-            ),
-            html.Tr(
-                [
-                    html.Td("Total Profit/Loss:", style={"padding": "10px"}),
-                    html.Td(f"{total_profit_loss:.2f} €", style={"padding": "10px"}),
-                ]
-            ),
-            html.Tr(
-                [
-                    html.Td("Mean Monthly Expenses:", style={"padding": "10px"}),
-                    html.Td(f"{mean_expenses:.2f} €", style={"padding": "10px"}),
-                ]
-            ),
-            html.Tr(
-                [
-                    html.Td("Mean Monthly Profit/Loss:", style={"padding": "10px"}),
-                    html.Td(f"{mean_profit_loss:.2f} €", style={"padding": "10px"}),
-                ]
-            ),
-        ],
-        style={
-            "width": "90%",
-            "margin": "0 auto",
-            "color": colors["text"],
-            "textAlign": "left",
-            "borderCollapse": "collapse",
-            "fontSize": "15px",
-        },
-        className="statistics-table",
+    # Handle income update
+    income_update_message = ""
+    if set_income_clicks:
+        if monthly_income is None or income_currency is None:
+            income_update_message = "Please provide both income amount and currency."
+
+    # The figures are computed from the sums by month, category, account and
+    # currency, aggregated in parallel for large ledgers, including the
+    # expenses spilled out of memory, and shared by the server processes
+    # All the rates of the view are resolved at once, then applied by lookups
+    set_progress(("0", steps))
+    summary_df = aggregate_shared(expense_tracker)
+    set_progress(("1", steps))
+    rates = resolve_rates(
+        [*summary_df["currency"].unique(), income_currency or "EUR"],
+        reporting_currency,
     )
+    set_progress(("2", steps))
+    df = load_expenses(expense_tracker)
+    df = convert_costs(df, reporting_currency, rates)
+    set_progress(("3", steps))
+    if summary_df.empty or not all(
+        col in df.columns
+        for col in [
+            "category",
+            "cost",
+            "note",
+            "date",
+            "currency",
+            "account",
+            "converted_cost",
+        ]
+    ):
+        return (
+            [],
+            {},
+            {},
+            html.P("No expenses to display.", style={"textAlign": "center"}),
+            income_update_message,
+            None,
+        )
+
+    # The figures and statistics of a ledger version and view are built by a
+    # single server process, and shared with the others
+    category_figure, monthly_figure, statistics_output = shared_cache.get_or_compute(
+        (
+            "view",
+            str(expense_tracker.csv_file),
+            expense_tracker.content_tag,
+            reporting_currency,
+            monthly_income,
+            income_currency,
+            rates.signature(),
+        ),
+        lambda: build_summary_view(
+            expense_tracker,
+            summary_df,
+            rates,
+            reporting_currency,
+            monthly_income,
+            income_currency,
+        ),
+        AGGREGATE_CACHE_TTL,
+    )[0]
 
     return (
-        df.to_dict("records"),
+        expenses_to_records(df),
         category_figure,
         monthly_figure,
         statistics_output,
         income_update_message,
-        "",
+        index_figures(category_figure, monthly_figure),
     )
+
+
+# Callback to plot the spend of the accounts over the selected dates
+@app.callback(
+    Output("account-spend", "figure"),
+    Input("account-date-range", "start_date"),
+    Input("account-date-range", "end_date"),
+    Input("ledger-id", "data"),
+    Input("ledger-version", "data"),
+    Input("ledger-delta", "data"),
+    Input("reporting-currency", "value"),
+)
+def plot_account_spend(
+    start_date, end_date, ledger_id, ledger_version, ledger_delta, currency
+):
+    """Plot the cumulative spend of every account from the start date.
+
+    The curves are sampled from the running sums of the tracker, so the
+    callback stays cheap enough not to run as a background job.
+    """
+    expense_tracker = get_session_tracker(ledger_id)
+    spend = account_spend_over_time(expense_tracker, start_date, end_date, currency)
+    symbol = CURRENCY_SYMBOLS[currency]
+    return {
+        "data": [
+            {
+                "x": account_spend["date"],
+                "y": account_spend["spend"],
+                "type": "scatter",
+                "mode": "lines",
+                "name": f"{account}: {account_spend['spend'].iloc[-1]:.2f} {symbol}",
+                "line": {"color": color_palette[i % len(color_palette)]},
+            }
+            for i, (account, account_spend) in enumerate(
+                spend.groupby("account", sort=True)
+            )
+        ],
+        "layout": {
+            "plot_bgcolor": colors["block"],
+            "paper_bgcolor": colors["block"],
+            "font": {"color": colors["text"]},
+            "yaxis": {"title": f"Spent ({symbol})", "rangemode": "tozero"},
+            "legend": {"orientation": "h"},
+        },
+    }
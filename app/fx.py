@@ -0,0 +1,354 @@
+"""Module to fetch the exchange rates within the quota of the FX API.
+
+Calls to the API are limited by a monthly budget, shared through a usage file,
+and by a token bucket, and a circuit breaker stops calling the API after
+repeated failures until a cooldown has elapsed. Rates are cached, and shared
+by the server processes through the shared cache, so that a single process
+fetches them: every rate is returned with its source, so that figures computed
+from stale or default rates can be flagged.
+"""
+
+import json
+import logging
+import threading
+import time
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import requests
+
+from .cache import SharedCache, shared_cache
+from .config import (
+    BASE_URL,
+    FX_BURST,
+    FX_CACHE_TTL,
+    FX_COOLDOWN,
+    FX_FAILURE_THRESHOLD,
+    FX_MONTHLY_BUDGET,
+    FX_RATE_LIMIT,
+    FX_STALE_TTL,
+    FX_TIMEOUT,
+    FX_USAGE_FILE,
+)
+
+# Value of one unit of each currency in EUR, used when no rate can be fetched
+DEFAULT_RATES = {"EUR": 1.0, "USD": 0.8958, "GBP": 0.8465, "CHF": 0.9460}
+
+LIVE = "live"  # Fetched from the API less than FX_CACHE_TTL seconds ago
+CACHED = "cached"  # Older rate, used because the API cannot be called
+DEFAULT = "default"  # Fixed rate of DEFAULT_RATES
+RATE_SOURCES = [LIVE, CACHED, DEFAULT]
+PIVOT_CURRENCY = "EUR"  # Base currency of the fetch of the cross rates
+
+
+class Rate(NamedTuple):
+    value: Optional[float]
+    source: str
+
+
+class CrossRates:
+    """Exchange rates between every pair of a set of currencies.
+
+    All the rates are derived from the value of each currency in the pivot
+    currency, so a single fetch is needed, and the rates are consistent with
+    each other. `matrix[i, j]` is the value of one unit of `currencies[i]` in
+    `currencies[j]`, NaN if unknown.
+    """
+
+    def __init__(self, currencies: List[str], values: np.ndarray, sources: List[str]):
+        self.currencies = list(currencies)
+        self.index = {currency: i for i, currency in enumerate(self.currencies)}
+        self.matrix = values[:, np.newaxis] / values[np.newaxis, :]
+        self.sources = sources
+
+    def rate(self, from_currency: str, to_currency: str) -> Rate:
+        """Return the rate from one currency to another, and its source."""
+        if from_currency == to_currency:
+            return Rate(1.0, LIVE)
+        i = self.index.get(from_currency)
+        j = self.index.get(to_currency)
+        if i is None or j is None or np.isnan(self.matrix[i, j]):
+            return Rate(None, DEFAULT)
+        # The least reliable source of the two currencies
+        source = max(self.sources[i], self.sources[j], key=RATE_SOURCES.index)
+        return Rate(float(self.matrix[i, j]), source)
+
+    def signature(self) -> Tuple:
+        """Return a hashable summary of the rates, e.g. to key cached views."""
+        return (
+            tuple(self.currencies),
+            tuple(self.matrix[:, 0].tolist()),
+            tuple(self.sources),
+        )
+
+    def rates_to(self, currency: str) -> Dict[str, Rate]:
+        """Return the rates of all the currencies to one of them."""
+        return {other: self.rate(other, currency) for other in self.currencies}
+
+
+class TokenBucket:
+    """Rate limiter refilled at `rate` tokens per second, up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def acquire(self) -> bool:
+        """Take a token if one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class CircuitBreaker:
+    """Stop calling a failing service, and probe it again after a cooldown.
+
+    The breaker opens after `threshold` consecutive failures. Once the cooldown
+    has elapsed a single probe call is allowed: it closes the breaker if it
+    succeeds, and opens it for another cooldown otherwise.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+
+class QuotaBudget:
+    """Monthly budget of API calls, persisted so that restarts do not reset it.
+
+    The usage file is shared by the server processes: it is updated under
+    the lock of the shared cache, so that no call of another process is lost.
+    """
+
+    def __init__(self, budget: int, usage_file: Path, shared: SharedCache):
+        self.budget = budget
+        self.usage_file = Path(usage_file)
+        self.shared = shared
+        self.month = ""
+        self.calls = 0
+
+    def _refresh(self):
+        """Reload the usage of the current month from the usage file."""
+        month = date.today().strftime("%Y-%m")
+        usage = {}
+        try:
+            usage = json.loads(self.usage_file.read_text())
+        except (OSError, ValueError):
+            pass
+        self.month = month
+        self.calls = usage.get("calls", 0) if usage.get("month") == month else 0
+
+    def _save(self):
+        try:
+            self.usage_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.usage_file.with_name(self.usage_file.name + ".tmp")
+            tmp_file.write_text(json.dumps({"month": self.month, "calls": self.calls}))
+            tmp_file.replace(self.usage_file)
+        except OSError as e:
+            logging.error(f"Failed to save the FX API usage: {str(e)}")
+
+    def remaining(self) -> int:
+        self._refresh()
+        return max(self.budget - self.calls, 0)
+
+    def spend(self):
+        """Record a call, if the budget allows it, and return whether it does."""
+        with self.shared.lock(("fx-usage", str(self.usage_file))):
+            if not self.remaining():
+                return False
+            self.calls += 1
+            self._save()
+        return True
+
+    def exhaust(self):
+        """Record that the API reported the quota as reached."""
+        with self.shared.lock(("fx-usage", str(self.usage_file))):
+            self._refresh()
+            self.calls = max(self.calls, self.budget)
+            self._save()
+
+
+class ExchangeRateProvider:
+    """Exchange rates fetched from the FX API, one request per base currency."""
+
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        budget: int = FX_MONTHLY_BUDGET,
+        rate_limit: float = FX_RATE_LIMIT,
+        burst: float = FX_BURST,
+        failure_threshold: int = FX_FAILURE_THRESHOLD,
+        cooldown: float = FX_COOLDOWN,
+        cache_ttl: float = FX_CACHE_TTL,
+        usage_file: Path = FX_USAGE_FILE,
+        timeout: float = FX_TIMEOUT,
+        shared: SharedCache = shared_cache,
+        stale_ttl: float = FX_STALE_TTL,
+    ):
+        self.base_url = base_url
+        self.cache_ttl = cache_ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.shared = shared
+        self.quota = QuotaBudget(budget, usage_file, shared)
+        self.limiter = TokenBucket(rate_limit, burst)
+        self.breaker = CircuitBreaker(failure_threshold, cooldown)
+        # Base currency -> (time of the fetch, conversion rates)
+        self._cache: Dict[str, Tuple[float, Dict[str, float]]] = {}
+        # Guards the cache, limiter and breaker, never held across a call
+        self._lock = threading.Lock()
+
+    def get_rate(self, from_currency: str, to_currency: str = "EUR") -> Rate:
+        """Return the rate from one currency to another, and its source."""
+        if from_currency == to_currency:
+            return Rate(1.0, LIVE)
+        rates, source = self.get_rates(from_currency)
+        if rates is not None and to_currency in rates:
+            return Rate(rates[to_currency], source)
+        return Rate(default_rate(from_currency, to_currency), DEFAULT)
+
+    def get_rates(self, base: str) -> Tuple[Optional[Dict[str, float]], str]:
+        """Return the conversion rates of a base currency, and their source.
+
+        The rates are fetched from the API only if the cached ones are older
+        than the TTL, and the budget, rate limit and circuit breaker allow it.
+        Expired rates are fetched by a single server process and thread, the
+        others using the shared stale ones meanwhile.
+        """
+        with self._lock:
+            fetched_at, rates = self._cache.get(base, (None, None))
+        if fetched_at is not None and time.time() - fetched_at < self.cache_ttl:
+            return rates, LIVE
+        shared, fresh = self.shared.get_or_compute(
+            ("fx", base),
+            lambda: self._fetch_rates(base),
+            self.cache_ttl,
+            self.stale_ttl,
+        )
+        if shared is not None:
+            with self._lock:
+                self._cache[base] = shared
+            return shared[1], LIVE if fresh else CACHED
+        if rates is not None:
+            return rates, CACHED
+        return None, DEFAULT
+
+    def cross_rates(
+        self, currencies: Iterable[str], pivot: str = PIVOT_CURRENCY
+    ) -> CrossRates:
+        """Return the cross rates of the currencies, from one fetch of the pivot.
+
+        The currencies missing from the fetched rates fall back on their
+        default rates.
+        """
+        currencies = list(dict.fromkeys([pivot, *currencies]))
+        rates, source = self.get_rates(pivot)
+        values = []
+        sources = []
+        for currency in currencies:
+            if currency == pivot:
+                value, currency_source = 1.0, LIVE
+            elif rates and rates.get(currency):
+                value, currency_source = 1 / rates[currency], source
+            else:
+                value, currency_source = default_rate(currency, pivot), DEFAULT
+            values.append(np.nan if value is None else value)
+            sources.append(currency_source)
+        return CrossRates(currencies, np.array(values, dtype=float), sources)
+
+    def _may_call(self) -> bool:
+        with self._lock:
+            if not self.breaker.allow():
+                logging.warning("FX API circuit breaker open: not calling the API")
+                return False
+            if not self.limiter.acquire() or not self.quota.spend():
+                logging.warning("FX API rate limit or monthly budget reached")
+                self.breaker.probing = False  # The probe was not used
+                return False
+        return True
+
+    def _fetch_rates(self, base: str) -> Optional[Tuple[float, Dict[str, float]]]:
+        """Fetch the rates of a base currency if allowed, with the time of the fetch."""
+        if not self._may_call():
+            return None
+        rates = self._fetch(base)
+        return None if rates is None else (time.time(), rates)
+
+    def _fetch(self, base: str) -> Optional[Dict[str, float]]:
+        """Call the API, recording the outcome in the circuit breaker."""
+        try:
+            response = requests.get(f"{self.base_url}{base}", timeout=self.timeout)
+            data = response.json()
+            if response.status_code == 200 and "conversion_rates" in data:
+                with self._lock:
+                    self.breaker.record_success()
+                return data["conversion_rates"]
+            error = data.get("error-type", "Unknown error")
+            if error == "quota-reached":
+                self.quota.exhaust()
+            logging.error(f"Failed to fetch exchange rate: {error}")
+        except Exception as e:
+            logging.error(f"Error fetching exchange rate: {str(e)}")
+        with self._lock:
+            self.breaker.record_failure()
+        return None
+
+    def status(self) -> dict:
+        """Return the state of the quota and circuit breaker, for monitoring."""
+        with self._lock:
+            return {
+                "budget": self.quota.budget,
+                "remaining": self.quota.remaining(),
+                "breaker": self.breaker.state,
+                "cached": sorted(self._cache),
+            }
+
+
+def default_rate(from_currency: str, to_currency: str) -> Optional[float]:
+    """Rate between two currencies derived from DEFAULT_RATES."""
+    if from_currency not in DEFAULT_RATES or to_currency not in DEFAULT_RATES:
+        return None
+    return DEFAULT_RATES[from_currency] / DEFAULT_RATES[to_currency]
+
+
+# Provider shared by the whole app
+exchange_rates = ExchangeRateProvider()
@@ -0,0 +1,114 @@
+"""Module for a local stand-in of the FX API, to run the app without quota.
+
+It serves the same responses as exchangerate-api.com for
+GET /v6/<key>/latest/<base>, from fixed rates, and can simulate failures:
+
+    python -m app.fx_mock --port 8099 --fail-rate 0.2 --quota 100
+    FX_BASE_URL=http://127.0.0.1:8099/v6/mock/latest/ python run.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+from .fx import DEFAULT_RATES
+
+
+class MockFxServer(ThreadingHTTPServer):
+    """HTTP server answering like the FX API, with configurable failures."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int] = ("127.0.0.1", 0),
+        fail_rate: float = 0.0,
+        quota: Optional[int] = None,
+        latency: float = 0.0,
+    ):
+        super().__init__(address, MockFxHandler)
+        self.fail_rate = fail_rate
+        self.quota = quota
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v6/mock/latest/"
+
+    def rates(self, base: str) -> dict:
+        """Cross rates of the base currency, derived from DEFAULT_RATES."""
+        return {
+            currency: round(DEFAULT_RATES[base] / value, 6)
+            for currency, value in DEFAULT_RATES.items()
+        }
+
+
+class MockFxHandler(BaseHTTPRequestHandler):
+    server: MockFxServer
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.calls += 1
+            calls = self.server.calls
+        time.sleep(self.server.latency)
+        base = self.path.rstrip("/").rsplit("/", 1)[-1].upper()
+        if self.server.quota is not None and calls > self.server.quota:
+            self._reply(429, {"result": "error", "error-type": "quota-reached"})
+        elif random.random() < self.server.fail_rate:
+            self._reply(500, {"result": "error", "error-type": "internal-error"})
+        elif base not in DEFAULT_RATES:
+            self._reply(404, {"result": "error", "error-type": "unsupported-code"})
+        else:
+            self._reply(
+                200,
+                {
+                    "result": "success",
+                    "base_code": base,
+                    "time_last_update_unix": int(time.time()),
+                    "conversion_rates": self.server.rates(base),
+                },
+            )
+
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Keep the output of the app readable
+
+
+def start_mock_server(**options) -> MockFxServer:
+    """Start a mock FX server on a free local port, in a background thread."""
+    server = MockFxServer(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.fx_mock")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--quota", type=int, help="Calls before quota-reached.")
+    parser.add_argument("--latency", type=float, default=0.0, help="In seconds.")
+    args = parser.parse_args()
+    server = MockFxServer(
+        (args.host, args.port), args.fail_rate, args.quota, args.latency
+    )
+    print(f"Serving mock FX API at {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Module to run the heavy Dash callbacks as background jobs.
+
+The background callbacks (see dash.callback(background=True)) are run by a
+LocalJobManager on a pool of job threads of the server process, so that the
+request threads only start the jobs and poll them, and stay free for cheap
+requests. The results, progress and cancellation flags of the jobs are kept
+in a disk cache, shared by all the server processes, so that the poll of a
+job can be served by any of them.
+
+Jobs run in the server process, rather than in a subprocess like with
+dash.DiskcacheManager, because the expense trackers live in it: a write made
+by a subprocess would bypass the in-memory state of the tracker.
+
+The jobs set up the callback context the way Dash does in its own managers,
+through private modules of Dash: its version is pinned in requirements.txt.
+"""
+
+import logging
+import os
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from pathlib import Path
+
+import diskcache
+from dash._callback_context import context_value
+from dash._utils import AttributeDict
+from dash.background_callback._proxy_set_props import ProxySetProps
+from dash.background_callback.managers import BaseBackgroundCallbackManager
+from dash.exceptions import PreventUpdate
+
+from .config import JOB_DIR, JOB_RESULT_TTL, JOB_WORKERS
+
+NO_UPDATE = {"_dash_no_update": "_dash_no_update"}
+
+
+class JobCancelled(Exception):
+    """Raised by set_progress in a job which was cancelled."""
+
+
+class LocalJobManager(BaseBackgroundCallbackManager):
+    """Background callback manager running the jobs on local threads.
+
+    Identical jobs in flight are deduplicated: a request with the same
+    callback and arguments as a running job, or a finished job whose result
+    was not read yet, subscribes to it instead of starting a new one. The
+    result is kept until every subscriber has read it.
+
+    A job is cancelled when all of its subscribers are gone, i.e. superseded
+    by a newer request of the same callback or cancelled with its cancel
+    inputs. Threads cannot be killed, so the cancellation is cooperative:
+    the job stops at its next call of set_progress, or before starting if it
+    is still queued. Jobs must only call set_progress between their writes.
+    """
+
+    def __init__(
+        self,
+        directory: Path = JOB_DIR,
+        workers: int = JOB_WORKERS,
+        expire: float = JOB_RESULT_TTL,
+    ):
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.handle = diskcache.Cache(str(directory))
+        self.expire = expire  # Lifetime of the entries of abandoned jobs
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="expenses-job"
+        )
+        super().__init__(cache_by=None)
+
+    @staticmethod
+    def _job_key(job: str) -> str:
+        return f"job-{job}"
+
+    @staticmethod
+    def _subscribers_key(job: str) -> str:
+        return f"job-{job}-subscribers"
+
+    @staticmethod
+    def _cancel_key(job: str) -> str:
+        return f"job-{job}-cancel"
+
+    @staticmethod
+    def _inflight_key(key: str) -> str:
+        return f"{key}-job"
+
+    def call_job_fn(self, key, job_fn, args, context):
+        """Start a job, or subscribe to the identical one in flight."""
+        with self.handle.transact():
+            job = self.handle.get(self._inflight_key(key))
+            if job is not None and (
+                self.result_ready(key)
+                or (self.job_running(job) and not self._cancelled(job))
+            ):
+                self.handle.incr(self._subscribers_key(job))
+                return job
+            job = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+            self.handle.set(
+                self._job_key(job),
+                {"pid": os.getpid(), "key": key, "done": False},
+                expire=self.expire,
+            )
+            self.handle.set(self._subscribers_key(job), 1, expire=self.expire)
+            self.handle.set(self._inflight_key(key), job, expire=self.expire)
+            self.handle.delete(self._make_progress_key(key))
+        self.executor.submit(copy_context().run, job_fn, job, key, args, context)
+        return job
+
+    def make_job_fn(self, fn, progress, key=None):
+        def job_fn(job, result_key, args, context):
+            def set_progress(value):
+                if self._cancelled(job):
+                    raise JobCancelled()
+                if not isinstance(value, (list, tuple)):
+                    value = [value]
+                self.handle.set(
+                    self._make_progress_key(result_key), value, expire=self.expire
+                )
+
+            def set_props(component_id, props):
+                self.handle.set(
+                    self._make_set_props_key(result_key),
+                    {component_id: props},
+                    expire=self.expire,
+                )
+
+            callback_context = AttributeDict(**context)
+            callback_context.ignore_register_page = False
+            callback_context.updated_props = ProxySetProps(set_props)
+            context_value.set(callback_context)
+            maybe_progress = [set_progress] if progress else []
+            try:
+                if self._cancelled(job):
+                    raise JobCancelled()
+                if isinstance(args, dict):
+                    output = fn(*maybe_progress, **args)
+                elif isinstance(args, (list, tuple)):
+                    output = fn(*maybe_progress, *args)
+                else:
+                    output = fn(*maybe_progress, args)
+            except JobCancelled:
+                logging.info(f"Background job {job} cancelled")
+                self._finish(job, result_key)
+                return
+            except PreventUpdate:
+                output = NO_UPDATE
+            except Exception as err:
+                logging.exception(f"Background job {job} failed")
+                output = {
+                    "background_callback_error": {
+                        "msg": str(err),
+                        "tb": traceback.format_exc(),
+                    }
+                }
+            with self.handle.transact():
+                self.handle.set(result_key, output, expire=self.expire)
+                self.handle.set(
+                    self._job_key(job),
+                    {"pid": os.getpid(), "key": result_key, "done": True},
+                    expire=self.expire,
+                )
+
+        return job_fn
+
+    def _cancelled(self, job: str) -> bool:
+        return bool(self.handle.get(self._cancel_key(job)))
+
+    def _finish(self, job: str, key: str):
+        """Remove all the entries of a job, once cancelled or read by everyone."""
+        with self.handle.transact():
+            if self.handle.get(self._inflight_key(key)) == job:
+                self.handle.delete(self._inflight_key(key))
+                self.handle.delete(key)
+                self.handle.delete(self._make_progress_key(key))
+            for entry in (self._job_key, self._subscribers_key, self._cancel_key):
+                self.handle.delete(entry(job))
+
+    def _unsubscribe(self, job: str) -> bool:
+        """Remove a subscriber of a job, and return whether it was the last one."""
+        with self.handle.transact():
+            subscribers = self.handle.get(self._subscribers_key(job), 1) - 1
+            self.handle.set(self._subscribers_key(job), subscribers, expire=self.expire)
+        return subscribers <= 0
+
+    def terminate_job(self, job):
+        """Unsubscribe from a job, cancelling it if it has no subscriber left."""
+        if job is None:
+            return
+        state = self.handle.get(self._job_key(job))
+        if state is None or not self._unsubscribe(job):
+            return
+        if state["done"]:
+            self._finish(job, state["key"])  # Result nobody will read
+        else:
+            self.handle.set(self._cancel_key(job), True, expire=self.expire)
+
+    def terminate_unhealthy_job(self, job):
+        state = self.handle.get(self._job_key(job))
+        if state is not None and not state["done"] and not self.job_running(job):
+            self._finish(job, state["key"])
+            return True
+        return False
+
+    def job_running(self, job):
+        state = self.handle.get(self._job_key(job))
+        if state is None or state["done"]:
+            return False
+        try:
+            os.kill(state["pid"], 0)  # The server process of the job is alive
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def clear_cache_entry(self, key):
+        self.handle.delete(key)
+
+    def get_or_create_signing_secret(self, generate):
+        self.handle.add(self.SIGNING_SECRET_KEY, generate())
+        return self.handle.get(self.SIGNING_SECRET_KEY)
+
+    def get_progress(self, key):
+        # Kept for the other subscribers, and overwritten by the next progress
+        return self.handle.get(self._make_progress_key(key))
+
+    def result_ready(self, key):
+        return self.handle.get(key) is not None
+
+    def get_result(self, key, job):
+        result = self.handle.get(key, self.UNDEFINED)
+        if result is self.UNDEFINED:
+            return self.UNDEFINED
+        if self._unsubscribe(job):
+            self._finish(job, key)
+        return result
+
+    def get_updated_props(self, key):
+        set_props_key = self._make_set_props_key(key)
+        result = self.handle.get(set_props_key, self.UNDEFINED)
+        if result is self.UNDEFINED:
+            return {}
+        self.clear_cache_entry(set_props_key)
+        return result
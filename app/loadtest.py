@@ -0,0 +1,906 @@
+"""Module to load-test the Dash callbacks with concurrent simulated clients.
+
+The app is started in server processes against a synthetic ledger, with the
+local FX stand-in of app/fx_mock.py, and every client runs realistic sessions
+(page load, add expense, set income, toggle theme) through
+/_dash-update-component. The latencies, throughput and payload sizes of each
+server configuration (processes x threads) are reported as JSON:
+
+    python -m app.loadtest run --rows 20000 --clients 50 --configs 1x1,1x8,2x4
+
+The stress command checks instead that the readers of a tracker shared by
+many threads see consistent views while other threads write to it, and
+measures how the read throughput grows with the number of readers:
+
+    python -m app.loadtest stress --rows 20000 --writers 4 --readers 1,2,4,8
+
+The aggregate command times the aggregation of in-memory columns in-process
+and with process pools of increasing sizes, to measure its scaling with the
+cores of the machine:
+
+    python -m app.loadtest aggregate --rows 500000,2000000 --workers 2,4,8
+
+The memory command measures the bytes taken per expense by a synthetic
+ledger loaded as one pydantic Expense model per row, as the tracker used to,
+and as the ExpenseColumns it loads now, with tracemalloc:
+
+    python -m app.loadtest memory --rows 1000000
+
+The groupby command times the monthly and category sums of the app, and
+measures their memory, on the categorical and datetime64 frame of
+columns_to_frame and on the same expenses as object and date string columns,
+as read by pandas.read_csv before:
+
+    python -m app.loadtest groupby --rows 1000000
+"""
+
+import argparse
+import csv
+import gc
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import requests
+
+from .analytics import MONTH_LABEL_FORMAT, summarize_by_category, summarize_by_month
+from .config import CURRENCIES, DATE_FORMAT, JOB_POLL_INTERVAL
+from .data.aggregate import aggregate_expenses, pool_context
+from .data.records import ExpenseColumns, StringPool
+from .data.tracker import LOG_FIELDS, Expense, ExpenseTracker, read_ledger
+from .fx_mock import start_mock_server
+from .utils import columns_to_frame
+
+LEDGER_ID = "loadtest"
+CATEGORIES = ["Food", "Rent", "Transport", "Leisure", "Health", "Bills", "Travel"]
+ACCOUNTS = ["Bank", "Cash", "Credit Card"]
+STARTUP_TIMEOUT = 120.0
+
+
+def write_synthetic_ledger(path: Path, rows: int, seed: int = 0):
+    """Write a ledger of random expenses spread over the last three years."""
+    rng = random.Random(seed)
+    first_day = date.today() - timedelta(days=3 * 365)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open(mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(LOG_FIELDS)
+        for expense_id in range(rows):
+            day = first_day + timedelta(days=rng.randrange(3 * 365))
+            writer.writerow(
+                [
+                    expense_id,
+                    "add",
+                    rng.choice(CATEGORIES),
+                    round(rng.lognormvariate(3, 1), 2),
+                    f"expense {rng.randrange(10_000)}",
+                    day.strftime(DATE_FORMAT),
+                    rng.choice(CURRENCIES),
+                    rng.choice(ACCOUNTS),
+                ]
+            )
+
+
+def parse_config(value: str) -> Tuple[int, int]:
+    """Parse a server configuration given as "<processes>x<threads>"."""
+    processes, _, threads = value.lower().partition("x")
+    try:
+        config = int(processes), int(threads or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid configuration: {value}")
+    if min(config) < 1:
+        raise argparse.ArgumentTypeError(f"Invalid configuration: {value}")
+    return config
+
+
+def serve(fd: int, threads: int):
+    """Serve the app on an inherited listening socket, with a thread pool."""
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    from .expenses_tracker import app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    class PooledWSGIServer(BaseWSGIServer):
+        """WSGI server handling the requests in a bounded pool of threads."""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._process, request, client_address)
+
+        def _process(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    server = PooledWSGIServer("127.0.0.1", 0, app.server, handler=QuietHandler, fd=fd)
+    server.serve_forever()
+
+
+class AppProcesses:
+    """Server processes of the app sharing one listening socket."""
+
+    def __init__(self, workdir: Path, processes: int, threads: int, env: dict):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.listen(1024)
+        self.url = "http://127.0.0.1:{}".format(self.socket.getsockname()[1])
+        fd = self.socket.fileno()
+        command = [sys.executable, "-m", "app.loadtest", "serve", "--fd", str(fd)]
+        self.processes = [
+            subprocess.Popen(
+                [*command, "--threads", str(threads)],
+                cwd=workdir,
+                env=env,
+                pass_fds=[fd],
+                stdout=subprocess.DEVNULL,
+            )
+            for _ in range(processes)
+        ]
+
+    def wait_ready(self):
+        """Wait until every process has loaded the app and the ledger."""
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if any(process.poll() is not None for process in self.processes):
+                raise RuntimeError("A server process exited during startup")
+            try:
+                if requests.get(f"{self.url}/_dash-layout", timeout=5).ok:
+                    # The page is served once a process is up: give the
+                    # others the time to import the app too
+                    time.sleep(1.0 * (len(self.processes) - 1))
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        raise TimeoutError("The app did not start in time")
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+        self.socket.close()
+
+
+class Callbacks:
+    """Builder of the /_dash-update-component requests of the app."""
+
+    def __init__(self, dependencies: List[dict]):
+        self.dependencies = {dep["output"]: dep for dep in dependencies}
+
+    def find(self, output: str, duplicate: bool = False) -> dict:
+        """Return the callback of an output, or the one sharing it if duplicate."""
+        for key, dep in self.dependencies.items():
+            for name in key.strip(".").split("..."):
+                name, _, suffix = name.partition("@")
+                if name == output and bool(suffix) == duplicate:
+                    return dep
+        raise KeyError(output)
+
+    def body(
+        self, output: str, values: dict, changed: List[str], duplicate: bool = False
+    ) -> bytes:
+        """Serialize the request of a callback, with the given property values."""
+        dep = self.find(output, duplicate)
+        outputs = [
+            dict(zip(("id", "property"), key.partition("@")[0].rsplit(".", 1)))
+            for key in dep["output"].strip(".").split("...")
+        ]
+
+        def fill(items):
+            return [
+                dict(item, value=values.get(f"{item['id']}.{item['property']}"))
+                for item in items
+            ]
+
+        return json.dumps(
+            {
+                "output": dep["output"],
+                "outputs": outputs if len(outputs) > 1 else outputs[0],
+                "inputs": fill(dep["inputs"]),
+                "state": fill(dep.get("state", [])),
+                "changedPropIds": changed,
+            }
+        ).encode()
+
+
+class SimulatedClient:
+    """Browser session replaying the callbacks of a user, timing every request."""
+
+    def __init__(self, url: str, callbacks: Callbacks, seed: int, think: float):
+        self.url = url
+        self.callbacks = callbacks
+        self.rng = random.Random(seed)
+        self.think = think
+        self.http = requests.Session()
+        self.samples: List[Tuple[str, float, int, int, bool]] = []
+        self.end_id = ""  # Token of the page load, signing the background jobs
+        self.values: dict = {
+            "url.search": f"?ledger={LEDGER_ID}",
+            "ledger-id.data": None,
+            "toggle-button.n_clicks": None,
+            "add-expense-button.n_clicks": 0,
+            "set-income-button.n_clicks": 0,
+            "input-currency.value": "EUR",
+            "input-income-currency.value": "EUR",
+            "reporting-currency.value": "EUR",
+        }
+
+    def _request(self, step: str, method: str, path: str, body: bytes = None):
+        """Send a request and record its latency and payload sizes."""
+        start = time.perf_counter()
+        ok = False
+        content = b""
+        try:
+            response = self.http.request(
+                method,
+                f"{self.url}{path}",
+                data=body,
+                headers={"Content-Type": "application/json"} if body else None,
+                timeout=120,
+            )
+            content = response.content
+            ok = response.ok
+        except requests.RequestException:
+            pass
+        latency = time.perf_counter() - start
+        self.samples.append((step, latency, len(body or b""), len(content), ok))
+        return content if ok else None
+
+    def _callback(
+        self, step: str, output: str, changed: List[str], duplicate: bool = False
+    ) -> dict:
+        """Run a callback, polling its job until done if it is a background one.
+
+        The time to the result of a job is recorded as the "<step>:job" step.
+        """
+        start = time.perf_counter()
+        body = self.callbacks.body(output, self.values, changed, duplicate)
+        path = f"/_dash-update-component?endId={self.end_id}"
+        content = self._request(step, "POST", path, body)
+        data = json.loads(content) if content else {}
+        if "cacheKey" not in data:
+            return data.get("response", {})
+        path = f"{path}&cacheKey={data['cacheKey']}&job={data['job']}"
+        while True:
+            time.sleep(JOB_POLL_INTERVAL / 1000)
+            content = self._request(f"{step}:poll", "POST", path, body)
+            # Not found (204) once the job was cancelled by a newer request
+            result = json.loads(content) if content else {"response": {}}
+            if "response" in result:
+                break
+        latency = time.perf_counter() - start
+        self.samples.append(
+            (f"{step}:job", latency, len(body), len(content or b""), bool(content))
+        )
+        return result["response"]
+
+    def _refresh_expenses(self, step: str, changed: List[str], duplicate=False):
+        """Run refresh_expenses, or add_expense if duplicate, keeping the
+        table, figures and ledger version like the browser."""
+        response = self._callback(step, "expenses-table.data", changed, duplicate)
+        version = response.get("ledger-version", {}).get("data")
+        if version is not None:
+            self.values["ledger-version.data"] = version
+            self._refresh_expenses(f"{step}:refresh", ["ledger-version.data"])
+        for key in (
+            "expenses-table.data",
+            "category-summary.figure",
+            "monthly-summary.figure",
+            "figure-index.data",
+        ):
+            component, prop = key.rsplit(".", 1)
+            value = response.get(component, {}).get(prop)
+            # Patches are not applied: the previous value is kept instead
+            if value is not None and not (
+                isinstance(value, dict) and "__dash_patch_update" in value
+            ):
+                self.values[key] = value
+
+    def page_load(self):
+        page = self._request("page:index", "GET", "/") or b""
+        match = re.search(rb'"end_id":\s*"([^"]+)"', page)
+        self.end_id = match.group(1).decode() if match else ""
+        self._request("page:layout", "GET", "/_dash-layout")
+        self._request("page:dependencies", "GET", "/_dash-dependencies")
+        response = self._callback("page:ledger", "ledger-id.data", ["url.search"])
+        self.values["ledger-id.data"] = response.get("ledger-id", {}).get("data")
+        self._callback("page:theme", "main-container.style", [])
+        self._refresh_expenses("page:expenses", [])
+
+    def add_expense(self):
+        self.values["add-expense-button.n_clicks"] += 1
+        self.values.update(
+            {
+                "input-category.value": self.rng.choice(CATEGORIES),
+                "input-cost.value": round(self.rng.uniform(1, 200), 2),
+                "input-note.value": "load test",
+                "input-date.date": date.today().isoformat(),
+                "input-currency.value": self.rng.choice(CURRENCIES),
+                "input-account.value": self.rng.choice(ACCOUNTS),
+            }
+        )
+        self._refresh_expenses(
+            "add_expense", ["add-expense-button.n_clicks"], duplicate=True
+        )
+
+    def set_income(self):
+        self.values["set-income-button.n_clicks"] += 1
+        self.values["input-monthly-income.value"] = self.rng.choice([2000, 3000])
+        self._refresh_expenses("set_income", ["set-income-button.n_clicks"])
+
+    def toggle_theme(self):
+        self.values["toggle-button.n_clicks"] = (
+            self.values["toggle-button.n_clicks"] or 0
+        ) + 1
+        self._callback(
+            "toggle_theme", "main-container.style", ["toggle-button.n_clicks"]
+        )
+        # The new content re-renders the table and figures
+        self._refresh_expenses("toggle_theme:expenses", [])
+
+    def run(self, sessions: int):
+        for _ in range(sessions):
+            self.page_load()
+            for action in (self.add_expense, self.set_income, self.toggle_theme):
+                time.sleep(self.rng.uniform(0, 2 * self.think))
+                action()
+
+
+def summarize(samples: List[Tuple[str, float, int, int, bool]], elapsed: float) -> dict:
+    """Compute the latency percentiles and payload sizes of the samples."""
+
+    def stats(rows) -> dict:
+        latencies = np.array([row[1] for row in rows]) * 1000
+        return {
+            "requests": len(rows),
+            "errors": sum(not row[4] for row in rows),
+            "latency_ms": {
+                "mean": round(float(latencies.mean()), 2),
+                "p50": round(float(np.percentile(latencies, 50)), 2),
+                "p95": round(float(np.percentile(latencies, 95)), 2),
+                "p99": round(float(np.percentile(latencies, 99)), 2),
+                "max": round(float(latencies.max()), 2),
+            },
+            "request_bytes": int(np.mean([row[2] for row in rows])),
+            "response_bytes": int(np.mean([row[3] for row in rows])),
+        }
+
+    steps: Dict[str, list] = {}
+    for sample in samples:
+        steps.setdefault(sample[0], []).append(sample)
+    return {
+        **stats(samples),
+        "duration_s": round(elapsed, 2),
+        "throughput_rps": round(len(samples) / elapsed, 2),
+        "steps": {step: stats(rows) for step, rows in sorted(steps.items())},
+    }
+
+
+def run_config(
+    ledger: Path,
+    processes: int,
+    threads: int,
+    clients: int,
+    sessions: int,
+    think: float,
+    fx_url: str,
+) -> dict:
+    """Start the app with a configuration, load it, and report the results."""
+    workdir = Path(tempfile.mkdtemp(prefix="expenses-loadtest-"))
+    try:
+        ledger_dir = workdir / "app" / "data" / "ledgers"
+        ledger_dir.mkdir(parents=True)
+        shutil.copy(ledger, ledger_dir / f"{LEDGER_ID}.csv")
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(
+                filter(
+                    None, [str(Path(__file__).parents[1]), os.environ.get("PYTHONPATH")]
+                )
+            ),
+            FX_BASE_URL=fx_url,
+            FX_MONTHLY_BUDGET="1000000",
+        )
+        server = AppProcesses(workdir, processes, threads, env)
+        try:
+            server.wait_ready()
+            dependencies = requests.get(f"{server.url}/_dash-dependencies").json()
+            callbacks = Callbacks(dependencies)
+            simulated = [
+                SimulatedClient(server.url, callbacks, seed, think)
+                for seed in range(clients)
+            ]
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as executor:
+                for future in [
+                    executor.submit(client.run, sessions) for client in simulated
+                ]:
+                    future.result()
+            elapsed = time.perf_counter() - start
+        finally:
+            server.stop()
+        samples = [sample for client in simulated for sample in client.samples]
+        return {
+            "config": {"processes": processes, "threads": threads},
+            **summarize(samples, elapsed),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run(args: argparse.Namespace) -> dict:
+    fx_server = start_mock_server(latency=args.fx_latency)
+    with tempfile.TemporaryDirectory(prefix="expenses-ledger-") as directory:
+        ledger = Path(directory) / f"{LEDGER_ID}.csv"
+        write_synthetic_ledger(ledger, args.rows, args.seed)
+        results = []
+        for processes, threads in args.configs:
+            print(f"Running {processes}x{threads}...", file=sys.stderr)
+            results.append(
+                run_config(
+                    ledger,
+                    processes,
+                    threads,
+                    args.clients,
+                    args.sessions,
+                    args.think,
+                    fx_server.base_url,
+                )
+            )
+    fx_server.shutdown()
+    return {
+        "rows": args.rows,
+        "clients": args.clients,
+        "sessions": args.sessions,
+        "results": results,
+    }
+
+
+def check_view(view, expected: int) -> List[str]:
+    """Check that a view of the tracker is consistent, returning the errors.
+
+    Every expense must have exactly one live row, at least the `expected`
+    expenses acknowledged before the view was taken must be there, and the
+    rows written by the stress writers must not be torn.
+    """
+    errors = []
+    ids = np.sort(view.ids[view.live.astype(bool)])
+    duplicates = np.count_nonzero(ids[1:] == ids[:-1])
+    if duplicates:
+        errors.append(f"{duplicates} duplicate live expenses")
+    if len(ids) < expected:
+        errors.append(f"{expected - len(ids)} lost expenses")
+    for row in range(max(len(view) - 50, 0), len(view)):
+        note = view.notes[row]
+        if note.startswith("stress ") and float(note.split()[1]) != view.cost[row]:
+            errors.append(f"torn row {row}: cost {view.cost[row]}, note {note!r}")
+    return errors
+
+
+def stress_tracker(ledger: Path, writers: int, readers: int, writes: int) -> dict:
+    """Write to a tracker from threads while others read views of it."""
+    with tempfile.TemporaryDirectory(prefix="expenses-stress-") as directory:
+        path = Path(directory) / f"{LEDGER_ID}.csv"
+        shutil.copy(ledger, path)
+        tracker = ExpenseTracker(path, partition_period=None, resident_months=None)
+        initial = len(tracker.read_view().live_rows())
+        acknowledged = [0]  # Expenses added, read before taking a view
+        counter_lock = threading.Lock()
+        done = threading.Event()
+        errors: List[str] = []
+        reads = [0] * readers
+
+        def write(seed: int):
+            rng = random.Random(seed)
+            own: List[int] = []
+            for _ in range(writes):
+                cost = round(rng.uniform(1, 100), 2)
+                expense = (
+                    rng.choice(CATEGORIES),
+                    cost,
+                    f"stress {cost}",  # To detect torn rows
+                    (date.today() - timedelta(days=rng.randrange(365))).strftime(
+                        DATE_FORMAT
+                    ),
+                    rng.choice(CURRENCIES),
+                    rng.choice(ACCOUNTS),
+                )
+                if own and rng.random() < 0.5:
+                    tracker.update_expense(rng.choice(own), *expense)
+                    continue
+                own.append(tracker.add_expense(*expense))
+                with counter_lock:
+                    acknowledged[0] += 1
+
+        def read(reader: int):
+            version = -1
+            while not done.is_set():
+                expected = initial + acknowledged[0]
+                view = tracker.read_view()
+                problems = check_view(view, expected)
+                if view.version < version and len(view) >= 1:
+                    problems.append(f"version went back from {version}")
+                version = view.version
+                live = view.live.astype(bool)
+                np.bincount(view.category[live], weights=view.cost[live])
+                # The summaries are published with the views, lock-free too
+                distributions = tracker.distributions("category")
+                counted = sum(digest.count for digest in distributions.values())
+                if counted < expected:
+                    problems.append(f"{expected - counted} expenses not sketched")
+                tracker.account_spend()
+                errors.extend(problems)
+                reads[reader] += 1
+
+        threads = [
+            threading.Thread(target=read, args=(reader,)) for reader in range(readers)
+        ]
+        for thread in threads:
+            thread.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=writers) as executor:
+            for future in [executor.submit(write, seed) for seed in range(writers)]:
+                future.result()
+        elapsed = time.perf_counter() - start
+        done.set()
+        for thread in threads:
+            thread.join()
+
+        tracker.snapshot()  # Waits for the background maintenance
+        expected = sorted(tracker.get_expenses())
+        reloaded = ExpenseTracker(path, partition_period=None, resident_months=None)
+        reloaded = sorted(reloaded.get_expenses())
+        errors += check_view(tracker.read_view(), initial + acknowledged[0])
+        if reloaded != expected:
+            errors.append("the reloaded ledger differs from the tracker")
+        return {
+            "readers": readers,
+            "writes_per_s": round(writers * writes / elapsed, 2),
+            "reads_per_s": round(sum(reads) / elapsed, 2),
+            "expenses": len(expected),
+            "errors": len(errors),
+            "first_errors": errors[:5],
+        }
+
+
+def stress(args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory(prefix="expenses-ledger-") as directory:
+        ledger = Path(directory) / f"{LEDGER_ID}.csv"
+        write_synthetic_ledger(ledger, args.rows, args.seed)
+        results = []
+        for readers in args.readers:
+            print(f"Stressing with {readers} readers...", file=sys.stderr)
+            results.append(stress_tracker(ledger, args.writers, readers, args.writes))
+    return {
+        "rows": args.rows,
+        "writers": args.writers,
+        "writes": args.writes,
+        "results": results,
+    }
+
+
+def synthetic_columns(rows: int, seed: int = 0) -> ExpenseColumns:
+    """Build in memory the columns of random expenses over the last three years."""
+    rng = np.random.default_rng(seed)
+    today = date.today().toordinal()
+    arrays = {
+        "ids": np.arange(rows, dtype=np.int64),
+        "cost": np.round(rng.lognormal(3, 1, rows), 2),
+        "day": rng.integers(today - 3 * 365, today, rows, dtype=np.int32),
+        "category": rng.integers(len(CATEGORIES), size=rows, dtype=np.int32),
+        "currency": rng.integers(len(CURRENCIES), size=rows, dtype=np.int32),
+        "account": rng.integers(len(ACCOUNTS), size=rows, dtype=np.int32),
+    }
+    return ExpenseColumns.from_arrays(
+        arrays,
+        np.ones(rows, dtype=np.uint8),
+        [""] * rows,
+        StringPool.from_values(CATEGORIES),
+        StringPool.from_values(CURRENCIES),
+        StringPool.from_values(ACCOUNTS),
+    )
+
+
+def median_ms(function: Callable[[], object], repeats: int) -> float:
+    """Return the median duration of calls to the function, in ms."""
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return round(1000 * float(np.median(durations)), 2)
+
+
+def time_aggregation(columns: ExpenseColumns, repeats: int, **kwargs) -> float:
+    """Return the median duration of aggregations of the columns, in ms."""
+    return median_ms(lambda: aggregate_expenses(columns, **kwargs), repeats)
+
+
+def aggregate(args: argparse.Namespace) -> dict:
+    results = []
+    for rows in args.rows:
+        print(f"Aggregating {rows} rows...", file=sys.stderr)
+        columns = synthetic_columns(rows, args.seed)
+        expected = aggregate_expenses(columns, min_parallel_rows=rows + 1)
+        result = {
+            "rows": rows,
+            "in_process_ms": time_aggregation(
+                columns, args.repeats, min_parallel_rows=rows + 1
+            ),
+            "pools": [],
+        }
+        for workers in args.workers:
+            options = dict(min_parallel_rows=0, partitions=workers)
+            with ProcessPoolExecutor(workers, mp_context=pool_context()) as executor:
+                # The first aggregation starts the workers
+                cube = aggregate_expenses(columns, executor=executor, **options)
+                result["pools"].append(
+                    {
+                        "workers": workers,
+                        "ms": time_aggregation(
+                            columns, args.repeats, executor=executor, **options
+                        ),
+                        "same_cells": bool(
+                            cube[["date", "category", "account", "currency"]].equals(
+                                expected[["date", "category", "account", "currency"]]
+                            )
+                            and np.allclose(cube["cost"], expected["cost"])
+                        ),
+                    }
+                )
+        results.append(result)
+    return {"cpus": os.cpu_count(), "repeats": args.repeats, "results": results}
+
+
+def traced_bytes(build: Callable[[], object]) -> Tuple[object, int, int]:
+    """Build a value, returning it with the bytes it holds and the peak bytes
+    allocated meanwhile.
+
+    Only the memory allocated while building it is counted. Tracing slows
+    the allocations down about tenfold, so no duration is measured.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        value = build()
+        size, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return value, size, peak
+
+
+def expense_models(path: Path) -> List[Expense]:
+    """Load a ledger as one validated pydantic model per row, as before the
+    column store."""
+    with path.open(mode="r", newline="") as file:
+        return [Expense(**row) for row in csv.DictReader(file)]
+
+
+def memory(args: argparse.Namespace) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory(prefix="expenses-memory-") as directory:
+        for rows in args.rows:
+            print(f"Measuring {rows} rows...", file=sys.stderr)
+            ledger = Path(directory) / f"{LEDGER_ID}-{rows}.csv"
+            write_synthetic_ledger(ledger, rows, args.seed)
+            result = {"rows": rows}
+            for name, load in (
+                ("models", expense_models),
+                ("columns", read_ledger),
+            ):
+                value, size, peak = traced_bytes(lambda: load(ledger))
+                assert len(value) == rows
+                result[name] = {
+                    "bytes_per_expense": round(size / rows, 1),
+                    "peak_bytes_per_expense": round(peak / rows, 1),
+                }
+                del value
+            result["ratio"] = round(
+                result["models"]["bytes_per_expense"]
+                / result["columns"]["bytes_per_expense"],
+                1,
+            )
+            results.append(result)
+    return {"seed": args.seed, "results": results}
+
+
+def object_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert a frame of columns_to_frame to object columns and date strings."""
+    return df.astype(
+        {"category": object, "currency": object, "account": object}
+    ).assign(date=df["date"].dt.strftime(DATE_FORMAT))
+
+
+def object_groupby(df: pd.DataFrame) -> Tuple[pd.Series, pd.Series]:
+    """Sum the costs by category and by month like the app did on object
+    columns, parsing and formatting the date of every expense."""
+    month_year = pd.to_datetime(df["date"], format=DATE_FORMAT).dt.strftime(
+        MONTH_LABEL_FORMAT
+    )
+    return (
+        df.groupby("category")["converted_cost"].sum(),
+        df.groupby([month_year.rename("month_year"), "category"])[
+            "converted_cost"
+        ].sum(),
+    )
+
+
+def typed_groupby(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Sum the costs by category and by month like the app does now."""
+    return summarize_by_category(df), summarize_by_month(df)
+
+
+def labelled_sums(sums: pd.Series) -> Dict[tuple, float]:
+    """Key the sums of a groupby by their labels, as strings."""
+    return {
+        tuple(map(str, key if isinstance(key, tuple) else (key,))): float(value)
+        for key, value in sums.items()
+    }
+
+
+def groupby(args: argparse.Namespace) -> dict:
+    results = []
+    for rows in args.rows:
+        print(f"Grouping {rows} rows...", file=sys.stderr)
+        typed = columns_to_frame(synthetic_columns(rows, args.seed))
+        typed["converted_cost"] = typed["cost"]
+        result, sums = {"rows": rows}, {}
+        for name, df, function in (
+            ("object", object_frame(typed), object_groupby),
+            ("typed", typed, typed_groupby),
+        ):
+            (by_category, by_month), _, peak = traced_bytes(lambda: function(df))
+            if name == "typed":
+                by_category = by_category.set_index("category")["converted_cost"]
+                by_month = by_month.set_index(["month_year", "category"])[
+                    "converted_cost"
+                ]
+            sums[name] = [labelled_sums(by_category), labelled_sums(by_month)]
+            result[name] = {
+                "frame_bytes_per_expense": round(
+                    int(df.memory_usage(deep=True).sum()) / rows, 1
+                ),
+                "groupby_ms": median_ms(lambda: function(df), args.repeats),
+                "groupby_peak_bytes_per_expense": round(peak / rows, 1),
+            }
+        result["same_sums"] = all(
+            expected.keys() == actual.keys()
+            and all(bool(np.isclose(expected[key], actual[key])) for key in expected)
+            for expected, actual in zip(sums["object"], sums["typed"])
+        )
+        result["speedup"] = round(
+            result["object"]["groupby_ms"] / result["typed"]["groupby_ms"], 1
+        )
+        results.append(result)
+    return {"repeats": args.repeats, "seed": args.seed, "results": results}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.loadtest")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("run", help="Load-test the app.")
+    load.add_argument("--rows", type=int, default=20_000, help="Ledger size.")
+    load.add_argument("--clients", type=int, default=50)
+    load.add_argument("--sessions", type=int, default=1, help="Sessions per client.")
+    load.add_argument("--think", type=float, default=0.5, help="Mean think time (s).")
+    load.add_argument(
+        "--configs",
+        type=lambda value: [parse_config(config) for config in value.split(",")],
+        default=[(1, 8)],
+        help="Server configurations, as <processes>x<threads>[,...].",
+    )
+    load.add_argument("--fx-latency", type=float, default=0.0)
+    load.add_argument("--seed", type=int, default=0)
+    load.add_argument("--output", type=Path, help="JSON report file.")
+
+    check = commands.add_parser(
+        "stress", help="Check concurrent reads and writes of a tracker."
+    )
+    check.add_argument("--rows", type=int, default=20_000, help="Ledger size.")
+    check.add_argument("--writers", type=int, default=4, help="Writer threads.")
+    check.add_argument("--writes", type=int, default=500, help="Writes per writer.")
+    check.add_argument(
+        "--readers",
+        type=lambda value: [int(readers) for readers in value.split(",")],
+        default=[1, 2, 4, 8],
+        help="Numbers of reader threads, as <readers>[,...].",
+    )
+    check.add_argument("--seed", type=int, default=0)
+    check.add_argument("--output", type=Path, help="JSON report file.")
+
+    bench = commands.add_parser(
+        "aggregate", help="Time the aggregations in-process and in process pools."
+    )
+    bench.add_argument(
+        "--rows",
+        type=lambda value: [int(rows) for rows in value.split(",")],
+        default=[500_000, 2_000_000],
+        help="Numbers of expenses, as <rows>[,...].",
+    )
+    bench.add_argument(
+        "--workers",
+        type=lambda value: [int(workers) for workers in value.split(",")],
+        default=[2, 4, 8],
+        help="Pool sizes, as <workers>[,...].",
+    )
+    bench.add_argument("--repeats", type=int, default=5)
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--output", type=Path, help="JSON report file.")
+
+    footprint = commands.add_parser(
+        "memory", help="Measure the memory per expense of the models and columns."
+    )
+    footprint.add_argument(
+        "--rows",
+        type=lambda value: [int(rows) for rows in value.split(",")],
+        default=[1_000_000],
+        help="Numbers of expenses, as <rows>[,...].",
+    )
+    footprint.add_argument("--seed", type=int, default=0)
+    footprint.add_argument("--output", type=Path, help="JSON report file.")
+
+    grouping = commands.add_parser(
+        "groupby", help="Time the sums of the app on typed and object frames."
+    )
+    grouping.add_argument(
+        "--rows",
+        type=lambda value: [int(rows) for rows in value.split(",")],
+        default=[1_000_000],
+        help="Numbers of expenses, as <rows>[,...].",
+    )
+    grouping.add_argument("--repeats", type=int, default=5)
+    grouping.add_argument("--seed", type=int, default=0)
+    grouping.add_argument("--output", type=Path, help="JSON report file.")
+
+    server = commands.add_parser("serve", help="Serve the app (used by run).")
+    server.add_argument("--fd", type=int, required=True)
+    server.add_argument("--threads", type=int, default=8)
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        serve(args.fd, args.threads)
+        return 0
+    command = {
+        "run": run,
+        "stress": stress,
+        "aggregate": aggregate,
+        "memory": memory,
+        "groupby": groupby,
+    }[args.command]
+    report = json.dumps(command(args), indent=2)
+    if args.output:
+        args.output.write_text(report + "\n")
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,65 +1,81 @@
 """Module containing utility functions for the expenses tracker app."""
 
-import logging
+import base64
+import csv
+import io
+from datetime import date
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
 
+import numpy as np
 import pandas as pd
-import requests
 
-from .config import BASE_URL, CSV_PATH
-from .data.tracker import ExpenseTracker
+from .analytics import filter_by_date
+from .cache import SharedCache, shared_cache
+from .config import ACCOUNT_SPEND_POINTS, AGGREGATE_CACHE_TTL, CSV_PATH, DATE_FORMAT
+from .data.partitions import PartitionStore
+from .data.records import ExpenseColumns, StringPool, format_day
+from .data.sketch import TDigest
+from .data.balances import BalanceKey
+from .data.tracker import LOG_FIELDS, Expense, ExpenseTracker, read_ledger
+from .fx import DEFAULT, RATE_SOURCES, CrossRates, Rate, exchange_rates
 
-DEFAULT_RATES = {"EUR": 1.0, "USD": 0.8958, "GBP": 0.8465, "CHF": 0.9460}
+EXPENSE_COLUMNS = ["category", "cost", "note", "date", "currency", "account"]
+TABLE_COLUMNS = ["id"] + EXPENSE_COLUMNS + ["converted_cost", "rate_source"]
+UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+DISTRIBUTION_COLUMNS = ["count", "median", "p90", "outlier_above", "outliers"]
 
 
-def get_exchange_rate(from_currency: str, to_currency: str = "EUR") -> float:
-    """Fetch the exchange rate from one currency to another, using default rates if necessary."""
-    try:
-        url = f"{BASE_URL}{from_currency}"
-        response = requests.get(url)
-        data = response.json()
+def resolve_rates(currencies: Iterable[str], target: str = "EUR") -> CrossRates:
+    """Resolve the rates between the currencies and the target with one lookup."""
+    return exchange_rates.cross_rates([*currencies, target])
 
-        if response.status_code != 200 or "conversion_rates" not in data:
-            logging.error(
-                f"Failed to fetch exchange rate: {data.get('error-type', 'Unknown error')}"
-            )
-            return DEFAULT_RATES.get(
-                to_currency, 1.0
-            )  # Return default rate if API fails
 
-        rate = data["conversion_rates"].get(to_currency)
-        if rate is None:
-            logging.error(f"Conversion rate for {to_currency} not found in response.")
-            return DEFAULT_RATES.get(
-                to_currency, 1.0
-            )  # Return default rate if conversion rate not found
+def aggregate_shared(
+    expense_tracker: ExpenseTracker, cache: SharedCache = shared_cache
+) -> pd.DataFrame:
+    """Sum all the expenses like ExpenseTracker.aggregate, once per ledger version.
 
-        return rate
-    except Exception as e:
-        logging.error(f"Error fetching exchange rate: {str(e)}")
-        return DEFAULT_RATES.get(to_currency, 1.0)  # Return default rate on exception
+    The sums are shared by the server processes through the shared cache,
+    keyed by the content of the ledger.
+    """
+    summary, _ = cache.get_or_compute(
+        ("aggregate", str(expense_tracker.csv_file), expense_tracker.content_tag),
+        expense_tracker.aggregate,
+        AGGREGATE_CACHE_TTL,
+    )
+    return summary
 
 
-def convert_to_euro(df: pd.DataFrame) -> pd.DataFrame:
-    """Convert the cost column to EUR using the exchange rates."""
+def convert_costs(
+    df: pd.DataFrame, target: str = "EUR", rates: Optional[CrossRates] = None
+) -> pd.DataFrame:
+    """Convert the cost column to the target currency.
 
-    def safe_convert(row: pd.Series) -> float | None:
-        """Safely convert the cost to EUR."""
-        try:
-            if row["currency"] == "EUR":
-                return row["cost"]
-            else:
-                rate = get_exchange_rate(row["currency"], "EUR")
-                if rate is not None:
-                    return row["cost"] * rate
-                else:
-                    return None
-        except Exception as e:
-            logging.error(f"Failed to convert {row['currency']} to EUR: {str(e)}")
-            return None
-
-    df["cost_euro"] = df.apply(safe_convert, axis=1)
+    The rates are resolved once for all the currencies, unless given, and
+    applied to the whole column through the currency codes, keeping the
+    categorical columns intact. The rate_source column tells whether each
+    converted cost used a live, cached or default rate.
+    """
+    currency = df["currency"].astype("category")
+    if rates is None:
+        rates = resolve_rates(currency.cat.categories, target)
+    rates_to_target = rates.rates_to(target)
+    missing = Rate(None, DEFAULT)  # Code -1 marks a missing currency
+    currency_rates = [rates_to_target.get(c, missing) for c in currency.cat.categories]
+    currency_rates.append(missing)
+    codes = currency.cat.codes.to_numpy()
+    values = np.array(
+        [np.nan if rate.value is None else rate.value for rate in currency_rates],
+        dtype=float,
+    )
+    df["converted_cost"] = df["cost"].to_numpy(dtype=float) * values[codes]
+    df["rate_source"] = pd.Categorical(
+        np.array([rate.source for rate in currency_rates], dtype=object)[codes],
+        categories=RATE_SOURCES,
+    )
     # Handle any rows where conversion failed by dropping or filling with 0
-    df = df.dropna(subset=["cost_euro"])
+    df = df.dropna(subset=["converted_cost"])
     return df
 
 
@@ -67,34 +83,314 @@ def ensure_csv_exists():
     """Ensure the CSV file exists, creating it if necessary."""
     CSV_PATH.parent.mkdir(parents=True, exist_ok=True)
     if not CSV_PATH.exists():
-        pd.DataFrame(
-            columns=["category", "cost", "note", "date", "currency", "account"]
-        ).to_csv(CSV_PATH, index=False)
+        pd.DataFrame(columns=LOG_FIELDS).to_csv(CSV_PATH, index=False)
 
 
-def load_expenses(expense_tracker: ExpenseTracker) -> pd.DataFrame:
-    """Load expenses from the CSV file."""
-    df = pd.DataFrame([expense.dict() for expense in expense_tracker.get_expenses()])
-    if df.empty:
-        df = pd.DataFrame(
-            columns=["category", "cost", "note", "date", "currency", "account"]
-        )
-    return df
+def _categorical(codes: np.ndarray, pool: StringPool, rows) -> pd.Categorical:
+    """Build a categorical column from dictionary-coded values."""
+    return pd.Categorical.from_codes(codes[rows], categories=pool.values)
+
+
+def load_expenses(
+    expense_tracker: ExpenseTracker, rows: Optional[List[int]] = None
+) -> pd.DataFrame:
+    """Load the expenses of the tracker into a DataFrame.
+
+    Category, currency and account are categorical columns built straight from
+    the tracker codes, and the date is a native datetime64 column. If rows is
+    given, only those rows are loaded, otherwise all the live expenses. They
+    are read from a view of the expenses, see ExpenseTracker.read_view.
+    """
+    return columns_to_frame(expense_tracker.read_view(), rows)
+
+
+def describe_archived(expense_tracker: ExpenseTracker) -> str:
+    """Describe the spilled expenses, which the table does not list, if any."""
+    count, last_day = expense_tracker.archived()
+    if not count:
+        return ""
+    return (
+        f"{count} expenses up to {format_day(last_day)} are archived: they are "
+        'included in the figures but not listed, see "Include archived expenses".'
+    )
 
 
-def convert_income_to_euro(amount: float, currency: str) -> float:
-    """Convert the given amount from the specified currency to euros.
+def columns_to_frame(
+    columns: ExpenseColumns, rows: Optional[List[int]] = None
+) -> pd.DataFrame:
+    """Convert the rows of the columns into a DataFrame, see load_expenses."""
+    if rows is None:
+        rows = np.flatnonzero(columns.view("live"))
+    rows = np.asarray(rows, dtype=np.intp)
+    notes = [columns.notes[row] for row in rows]
+    days = columns.view("day")[rows].astype(np.int64)
+    return pd.DataFrame(
+        {
+            "id": columns.view("ids")[rows],
+            "category": _categorical(
+                columns.view("category"), columns.categories, rows
+            ),
+            "cost": columns.view("cost")[rows],
+            "note": pd.Series(notes, dtype=object),
+            "date": (days - UNIX_EPOCH_ORDINAL).astype("datetime64[D]"),
+            "currency": _categorical(
+                columns.view("currency"), columns.currencies, rows
+            ),
+            "account": _categorical(columns.view("account"), columns.accounts, rows),
+        },
+        columns=["id"] + EXPENSE_COLUMNS,
+    ).astype({"date": "datetime64[ns]"})
 
-    Args:
-        amount (float): The amount of money to convert.
-        currency (str): The currency of the amount (e.g., 'EUR', 'USD', 'GBP', 'CHF').
 
-    Returns:
-        float: The equivalent amount in euros.
+def load_expense_range(
+    csv_file: Path, start: Optional[str] = None, end: Optional[str] = None
+) -> pd.DataFrame:
+    """Load the expenses of a ledger file between two dates (YYYY-MM-DD).
+
+    The ledger is only read, see read_ledger. For a partitioned ledger only
+    the overlapping partitions are read, and the partitions within the range
+    are returned as monthly sums (see aggregate_expenses): the result can be
+    summarized, but not listed.
+    """
+    store = PartitionStore(Path(csv_file).with_suffix(".parts"))
+    if not store.exists():
+        return filter_by_date(columns_to_frame(read_ledger(csv_file)), start, end)
+    columns, aggregates = store.read_range(
+        Path(csv_file),
+        None if start is None else date.fromisoformat(start).toordinal(),
+        None if end is None else date.fromisoformat(end).toordinal(),
+    )
+    df = columns_to_frame(columns)
+    if aggregates.empty:
+        return df
+    return pd.concat([df, aggregates], ignore_index=True)
+
+
+def load_expenses_between(
+    expense_tracker: ExpenseTracker,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    raw: bool = True,
+) -> pd.DataFrame:
+    """Load the expenses of the tracker between two dates (YYYY-MM-DD).
+
+    The expenses spilled out of memory are read from disk. Unless raw, the
+    spilled periods within the range are returned as monthly sums (see
+    aggregate_expenses): the result can be summarized, but not listed.
     """
-    if currency == "EUR":
+    df = filter_by_date(load_expenses(expense_tracker), start, end)
+    if not expense_tracker.spilled:
+        return df
+    columns, aggregates = expense_tracker.read_history(
+        None if start is None else date.fromisoformat(start).toordinal(),
+        None if end is None else date.fromisoformat(end).toordinal(),
+        raw,
+    )
+    frames = [df, columns_to_frame(columns), aggregates]
+    return pd.concat([frame for frame in frames if not frame.empty], ignore_index=True)
+
+
+def expenses_to_records(df: pd.DataFrame) -> list:
+    """Convert an expenses DataFrame into DataTable records."""
+    table = df[[col for col in TABLE_COLUMNS if col in df.columns]].copy()
+    if pd.api.types.is_datetime64_any_dtype(table["date"]):
+        table["date"] = table["date"].dt.strftime(DATE_FORMAT)
+    return table.to_dict("records")
+
+
+def apply_table_edits(
+    expense_tracker: ExpenseTracker, previous: list, current: list
+) -> int:
+    """Record the rows edited or deleted in the DataTable and return their count."""
+    current_by_id = {row["id"]: row for row in current}
+    changes = 0
+    for old in previous:
+        new = current_by_id.get(old["id"])
+        if new is None:
+            expense_tracker.delete_expense(old["id"])
+            changes += 1
+        elif any(new.get(col) != old.get(col) for col in EXPENSE_COLUMNS):
+            expense_tracker.update_expense(
+                new["id"], *(new.get(col) for col in EXPENSE_COLUMNS)
+            )
+            changes += 1
+    return changes
+
+
+def import_csv_files(
+    expense_tracker: ExpenseTracker,
+    contents: List[str],
+    filenames: List[str],
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> str:
+    """Import the CSV files of a dcc.Upload, and describe what was imported.
+
+    Every file needs the category, cost, note, date, currency and account
+    columns. Invalid rows are reported and skipped, as are the expenses
+    already in the ledger, so overlapping exports can be imported again.
+    The progress function, if any, is called before every file with the
+    number of files imported so far and the number of files.
+    """
+    messages = []
+    for done, (content, filename) in enumerate(zip(contents, filenames)):
+        if progress is not None:
+            progress(done, len(contents))
+        try:
+            data = base64.b64decode(content.split(",", 1)[1])
+            rows = list(csv.DictReader(io.StringIO(data.decode("utf-8-sig"))))
+        except (IndexError, ValueError) as e:
+            messages.append(f"{filename}: not a valid CSV file ({e}).")
+            continue
+        expenses, errors = Expense.validate_batch(rows)
+        ids, duplicates = expense_tracker.import_expenses(expenses)
+        invalid = len({error["row"] for error in errors})
+        messages.append(
+            f"{filename}: {len(ids)} expenses imported, "
+            f"{duplicates} duplicates skipped, {invalid} invalid rows."
+        )
+    return " ".join(messages)
+
+
+def convert_amount(
+    amount: float,
+    currency: str,
+    target: str = "EUR",
+    rates: Optional[CrossRates] = None,
+) -> Optional[float]:
+    """Convert an amount, e.g. the monthly income, to the target currency.
+
+    Returns None if the rate is unknown.
+    """
+    if currency == target:
         return amount
-    rate = get_exchange_rate(currency, "EUR")
+    if rates is None:
+        rates = resolve_rates([currency], target)
+    rate = rates.rate(currency, target).value
     if rate is not None:
         return amount * rate
     return None
+
+
+def summarize_distributions(
+    expense_tracker: ExpenseTracker,
+    dimension: str = "category",
+    target: str = "EUR",
+    rates: Optional[CrossRates] = None,
+) -> pd.DataFrame:
+    """Summarize the distribution of the costs by category or account.
+
+    The median, 90th percentile and outliers are estimated from the quantile
+    sketches of the tracker, converted to the target currency and merged, so
+    the time taken does not depend on the number of expenses. Costs above
+    the upper Tukey fence (third quartile plus 1.5 interquartile range) are
+    counted as outliers.
+    """
+    sketches = expense_tracker.distributions(dimension)
+    currencies = {currency for _, currency in sketches}
+    if rates is None or not currencies <= set(rates.currencies):
+        rates = resolve_rates(currencies, target)
+    by_value = {}
+    for (value, currency), digest in sketches.items():
+        rate = rates.rate(currency, target).value
+        if rate is not None:
+            digests, scales = by_value.setdefault(value, ([], []))
+            digests.append(digest)
+            scales.append(rate)
+    rows = []
+    for value, (digests, scales) in sorted(by_value.items()):
+        digest = TDigest.merge(digests, scales)
+        q1, median, q3, p90 = (digest.quantile(q) for q in (0.25, 0.5, 0.75, 0.9))
+        fence = q3 + 1.5 * (q3 - q1)
+        rows.append(
+            {
+                dimension: value,
+                "count": digest.count,
+                "median": median,
+                "p90": p90,
+                "outlier_above": fence,
+                "outliers": round(digest.count_above(fence)),
+            }
+        )
+    return pd.DataFrame(rows, columns=[dimension, *DISTRIBUTION_COLUMNS])
+
+
+def _convert_by_account(
+    amounts: Dict[BalanceKey, np.ndarray], target: str, rates: Optional[CrossRates]
+) -> Dict[str, np.ndarray]:
+    """Sum amounts keyed by account and currency into the target, by account."""
+    currencies = {currency for _, currency in amounts}
+    if rates is None or not currencies <= set(rates.currencies):
+        rates = resolve_rates(currencies, target)
+    by_account: Dict[str, np.ndarray] = {}
+    for (account, currency), values in sorted(amounts.items()):
+        rate = rates.rate(currency, target).value
+        if rate is not None:
+            by_account[account] = by_account.get(account, 0.0) + values * rate
+    return by_account
+
+
+def summarize_account_spend(
+    expense_tracker: ExpenseTracker,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    target: str = "EUR",
+    rates: Optional[CrossRates] = None,
+) -> pd.DataFrame:
+    """Sum the costs of every account between two dates (YYYY-MM-DD), included.
+
+    The sums come from the running sums of the tracker: two binary searches
+    per account and currency, whatever the number of expenses.
+    """
+    spend = expense_tracker.account_spend(
+        None if start is None else date.fromisoformat(start).toordinal(),
+        None if end is None else date.fromisoformat(end).toordinal(),
+    )
+    by_account = _convert_by_account(
+        {key: np.array(value) for key, value in spend.items()}, target, rates
+    )
+    return pd.DataFrame(
+        {"account": list(by_account), "spend": [float(v) for v in by_account.values()]}
+    )
+
+
+def account_spend_over_time(
+    expense_tracker: ExpenseTracker,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    target: str = "EUR",
+    rates: Optional[CrossRates] = None,
+    points: int = ACCOUNT_SPEND_POINTS,
+) -> pd.DataFrame:
+    """Return the cumulative spend of every account from a date, over time.
+
+    The range (YYYY-MM-DD, both included) defaults to the first expense and
+    today, and is sampled at `points` evenly spaced days. Every sample is read
+    from the running sums of the tracker, so the cost does not depend on the
+    number of expenses.
+    """
+    first = (
+        expense_tracker.first_day()
+        if start is None
+        else date.fromisoformat(start).toordinal()
+    )
+    last = (
+        date.today().toordinal() if end is None else date.fromisoformat(end).toordinal()
+    )
+    if first is None or last < first:
+        return pd.DataFrame(columns=["date", "account", "spend"])
+    days = np.unique(np.linspace(first, last, points).round().astype(np.int64))
+    # The first day sampled is the day before the range, to subtract its total
+    days = np.concatenate(([first - 1], days))
+    by_account = _convert_by_account(
+        expense_tracker.account_spend_at(days), target, rates
+    )
+    dates = (days[1:] - UNIX_EPOCH_ORDINAL).astype("datetime64[D]")
+    return pd.DataFrame(
+        {
+            "date": np.tile(dates, len(by_account)),
+            "account": np.repeat(list(by_account), len(dates)),
+            "spend": np.concatenate(
+                [totals[1:] - totals[0] for totals in by_account.values()] or [[]]
+            ),
+        }
+    ).astype({"date": "datetime64[ns]"})
@@ -4,7 +4,11 @@ from pathlib import Path
 
 from setuptools import find_packages, setup
 
-required = Path("requirements.txt").read_text().splitlines()
+required = [
+    line
+    for line in Path("requirements.txt").read_text().splitlines()
+    if line and not line.startswith("#")
+]
 
 setup(
     name="app",
@@ -0,0 +1,11 @@
+"""Fixtures shared by the tests."""
+
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def ledger(tmp_path) -> Path:
+    """Path of the CSV file of a new ledger."""
+    return tmp_path / "ledger.csv"
@@ -0,0 +1,85 @@
+"""Tests of the JSON API, served by several workers sharing the ledgers."""
+
+import pytest
+from flask import Flask
+
+from app import fx
+from app.api import register_api
+from app.cache import SharedCache
+from app.data.registry import TrackerRegistry
+
+EXPENSE = {
+    "category": "Food",
+    "cost": 12.5,
+    "note": "lunch",
+    "date": "03-02-2025",
+    "currency": "USD",
+    "account": "Cash",
+}
+
+
+@pytest.fixture(autouse=True)
+def rates(monkeypatch):
+    rates = {"USD": 1.25, "GBP": 0.8, "CHF": 1.0}
+    monkeypatch.setattr(
+        fx.exchange_rates, "get_rates", lambda base: (dict(rates), fx.LIVE)
+    )
+    return rates
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Return the test clients of two workers, each with its own trackers."""
+    cache = SharedCache(tmp_path / "cache")
+    clients = []
+    for _ in range(2):
+        server = Flask(__name__)
+        registry = TrackerRegistry(
+            tmp_path / "ledgers", default_csv_file=tmp_path / "default.csv"
+        )
+        register_api(server, registry, cache)
+        clients.append(server.test_client())
+    return clients
+
+
+def test_etag_changes_with_a_write_of_another_worker(workers):
+    first, second = workers
+    url = "/api/ledgers/shared/expenses"
+    etag = second.get(url).headers["ETag"]
+    assert first.get(url).headers["ETag"] == etag  # Same data, same tag
+    assert second.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    assert first.post(url, json=[EXPENSE]).status_code == 201
+    response = second.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [row["note"] for row in response.json] == ["lunch"]
+    assert response.headers["ETag"] != etag
+    assert first.get(url).headers["ETag"] == response.headers["ETag"]
+
+
+def test_summary_etag_changes_with_the_rates(workers, rates):
+    client = workers[0]
+    client.post("/api/ledgers/shared/expenses", json=[EXPENSE])
+    url = "/api/ledgers/shared/summary?currency=EUR"
+    response = client.get(url)
+    assert response.json == [{"category": "Food", "converted_cost": 10.0}]
+    etag = response.headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    rates["USD"] = 2.5
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json == [{"category": "Food", "converted_cost": 5.0}]
+    assert client.get("/api/ledgers/shared/summary?currency=XXX").status_code == 400
+
+
+def test_idempotency_key_adds_the_expenses_once(workers):
+    first, second = workers
+    url = "/api/ledgers/shared/expenses"
+    headers = {"Idempotency-Key": "retry-1"}
+    response = first.post(url, json=[EXPENSE], headers=headers)
+    assert response.status_code == 201
+    retry = second.post(url, json=[EXPENSE], headers=headers)
+    assert retry.status_code == 201 and retry.json == response.json
+    assert len(second.get(url).json) == 1
+    other = dict(EXPENSE, cost=1.0)
+    assert first.post(url, json=[other], headers=headers).status_code == 422
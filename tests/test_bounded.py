@@ -0,0 +1,85 @@
+"""Tests of the bounded-memory mode, paging the old periods in and out."""
+
+from datetime import date
+
+import pytest
+
+from app.data.records import parse_day
+from app.data.tracker import ExpenseTracker
+from app.utils import describe_archived
+
+TODAY = date.today().strftime("%d-%m-%Y")
+EXPENSES = [
+    ("Food", 10.0, "january lunch", "05-01-2024", "EUR", "Cash"),
+    ("Rent", 20.0, "january flat", "20-01-2024", "EUR", "Card"),
+    ("Food", 30.0, "february dinner", "03-02-2024", "USD", "Cash"),
+    ("Fun", 40.0, "recent cinema", TODAY, "EUR", "Card"),
+]
+
+
+def sums(cube):
+    keys = ["date", "category", "account", "currency"]
+    return cube.groupby(keys)[["cost", "count"]].sum().sort_index()
+
+
+@pytest.fixture
+def trackers(tmp_path):
+    """A bounded tracker with its old periods spilled, and an unbounded one."""
+    bounded = ExpenseTracker(tmp_path / "bounded.csv", resident_months=2)
+    unbounded = ExpenseTracker(tmp_path / "unbounded.csv")
+    for tracker in (bounded, unbounded):
+        for expense in EXPENSES:
+            tracker.add_expense(*expense)
+    bounded.compact()
+    return bounded, unbounded
+
+
+def test_old_periods_are_spilled(trackers):
+    bounded, unbounded = trackers
+    assert sorted(bounded.spilled) == ["2024-01", "2024-02"]
+    assert [e.note for e in bounded.get_expenses()] == ["recent cinema"]
+    assert bounded.archived() == (3, parse_day("03-02-2024"))
+    assert describe_archived(bounded).startswith("3 expenses up to 03-02-2024")
+    assert describe_archived(unbounded) == ""
+
+
+def test_figures_include_the_spilled_expenses(trackers):
+    bounded, unbounded = trackers
+    assert sums(bounded.aggregate()).equals(sums(unbounded.aggregate()))
+    assert bounded.account_spend() == unbounded.account_spend()
+    reopened = ExpenseTracker(bounded.csv_file, resident_months=2)
+    assert sorted(reopened.spilled) == ["2024-01", "2024-02"]
+    assert sums(reopened.aggregate()).equals(sums(unbounded.aggregate()))
+
+
+def test_history_is_read_without_paging_in(trackers):
+    bounded, _ = trackers
+    matches = bounded.search_history("january")
+    assert sorted(matches.notes[row] for row in range(len(matches))) == [
+        "january flat",
+        "january lunch",
+    ]
+    # January is only partly in the range: read from its file
+    start, end = parse_day("10-01-2024"), parse_day("10-02-2024")
+    columns, aggregates = bounded.read_history(start, end, raw=False)
+    assert [columns.notes[row] for row in range(len(columns))] == ["january flat"]
+    assert aggregates["cost"].sum() == 30.0
+    assert sorted(bounded.spilled) == ["2024-01", "2024-02"]
+    assert len(bounded.get_expenses()) == 1
+
+
+def test_writes_page_in_their_period(trackers):
+    bounded, unbounded = trackers
+    for tracker in (bounded, unbounded):
+        tracker.update_expense(
+            0, "Food", 15.0, "january lunch", "05-01-2024", "EUR", "Cash"
+        )
+    assert sorted(bounded.spilled) == ["2024-02"]
+    assert bounded.get_expense(0).cost == 15.0
+    for tracker in (bounded, unbounded):
+        tracker.add_expense("Food", 5.0, "february snack", "10-02-2024", "EUR", "Cash")
+    assert bounded.spilled == {}
+    assert sorted(bounded.get_expenses()) == sorted(unbounded.get_expenses())
+    assert sums(bounded.aggregate()).equals(sums(unbounded.aggregate()))
+    assert bounded.account_spend() == unbounded.account_spend()
+    assert bounded.archived() == (0, None)
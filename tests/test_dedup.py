@@ -0,0 +1,89 @@
+"""Tests of the duplicate detection of the imports."""
+
+from app.data.dedup import FingerprintIndex, fingerprint
+from app.data.records import parse_day
+from app.data.tracker import ExpenseTracker
+
+
+def row(**values) -> dict:
+    return {
+        "category": "Food",
+        "cost": 12.5,
+        "note": "lunch",
+        "date": "03-02-2025",
+        "currency": "EUR",
+        "account": "Cash",
+        **values,
+    }
+
+
+def test_identical_expenses_of_an_import_are_counted(ledger):
+    tracker = ExpenseTracker(ledger)
+    ids, duplicates = tracker.import_expenses([row(), row(), row(note="dinner")])
+    assert (len(ids), duplicates) == (3, 0)
+    # Twice in the import, twice in the ledger: nothing new
+    ids, duplicates = tracker.import_expenses([row(), row()])
+    assert (ids, duplicates) == ([], 2)
+    # Three times in the import, twice in the ledger: one new
+    ids, duplicates = tracker.import_expenses([row(), row(), row()])
+    assert (len(ids), duplicates) == (1, 2)
+    assert len(tracker.get_expenses()) == 4
+
+
+def test_reimport_is_idempotent_across_reloads(ledger):
+    rows = [row(cost=float(cost)) for cost in range(1, 6)]
+    ids, duplicates = ExpenseTracker(ledger).import_expenses(rows)
+    assert (len(ids), duplicates) == (5, 0)
+    reopened = ExpenseTracker(ledger)
+    assert reopened.import_expenses(rows) == ([], 5)
+    reopened.snapshot()
+    assert ExpenseTracker(ledger).import_expenses(rows) == ([], 5)
+
+
+def test_duplicates_are_matched_after_normalization(ledger):
+    tracker = ExpenseTracker(ledger)
+    tracker.import_expenses([row()])
+    variants = [
+        row(note="  LUNCH "),
+        row(cost=12.499),
+        row(currency="eur"),
+        row(account="cash"),
+        row(category="Restaurant"),  # The category is not compared
+    ]
+    for variant in variants:
+        assert tracker.import_expenses([variant]) == ([], 1)
+    for other in (row(cost=12.6), row(date="04-02-2025"), row(note="dinner")):
+        ids, duplicates = tracker.import_expenses([other])
+        assert (len(ids), duplicates) == (1, 0)
+
+
+def test_edited_expenses_are_no_longer_duplicates(ledger):
+    tracker = ExpenseTracker(ledger)
+    (expense_id,), _ = tracker.import_expenses([row()])
+    tracker.update_expense(
+        expense_id, "Food", 15.0, "lunch", "03-02-2025", "EUR", "Cash"
+    )
+    assert tracker.import_expenses([row(cost=15.0)]) == ([], 1)
+    ids, duplicates = tracker.import_expenses([row()])
+    assert (len(ids), duplicates) == (1, 0)
+    tracker.delete_expense(ids[0])
+    ids, duplicates = tracker.import_expenses([row()])
+    assert (len(ids), duplicates) == (1, 0)
+
+
+def test_fingerprint_index_counts_values():
+    index = FingerprintIndex()
+    values = [
+        fingerprint(parse_day("03-02-2025"), float(cost), "EUR", "Cash", "")
+        for cost in range(2000)  # Beyond the initial capacity
+    ]
+    for value in values:
+        index.add(value)
+    index.add(values[0])
+    assert len(index) == 2001
+    assert index.count(values[0]) == 2
+    assert index.remove(values[0])
+    assert index.count(values[0]) == 1
+    assert all(value in index for value in values)
+    assert index.remove(values[1]) and values[1] not in index
+    assert not index.remove(values[1])
@@ -0,0 +1,191 @@
+"""Tests of the rate limiting, circuit breaker and quota of the FX provider."""
+
+import json
+import threading
+from datetime import date
+
+import pytest
+
+from app import fx
+from app.cache import SharedCache
+from app.fx import CircuitBreaker, ExchangeRateProvider, QuotaBudget, TokenBucket
+
+
+class Clock:
+    """Monotonic clock advanced by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, data: dict):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self) -> dict:
+        return self.data
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(fx.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def shared(tmp_path):
+    return SharedCache(tmp_path / "cache")
+
+
+def make_provider(tmp_path, shared, **kwargs) -> ExchangeRateProvider:
+    options = dict(
+        base_url="http://fx.test/",
+        budget=10,
+        rate_limit=1.0,
+        burst=5,
+        failure_threshold=2,
+        cooldown=60.0,
+        usage_file=tmp_path / "fx_usage.json",
+        shared=shared,
+    )
+    options.update(kwargs)
+    return ExchangeRateProvider(**options)
+
+
+def test_token_bucket_allows_a_burst_then_refills(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    assert [bucket.acquire() for _ in range(4)] == [True, True, True, False]
+    clock.now += 0.5  # One token
+    assert bucket.acquire()
+    assert not bucket.acquire()
+    clock.now += 60  # Refilled up to the capacity only
+    assert [bucket.acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_circuit_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=10.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # Resets the count
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_circuit_breaker_allows_a_single_probe_after_the_cooldown(clock):
+    breaker = CircuitBreaker(threshold=1, cooldown=10.0)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()  # The probe is in flight
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_quota_is_persisted_and_reset_every_month(tmp_path, shared):
+    usage_file = tmp_path / "fx_usage.json"
+    quota = QuotaBudget(2, usage_file, shared)
+    assert quota.spend() and quota.spend()
+    assert not quota.spend()
+    assert QuotaBudget(2, usage_file, shared).remaining() == 0  # After a restart
+    usage_file.write_text(json.dumps({"month": "2000-01", "calls": 2}))
+    assert quota.remaining() == 2
+    quota.exhaust()
+    assert quota.remaining() == 0
+    month = date.today().strftime("%Y-%m")
+    assert json.loads(usage_file.read_text()) == {"month": month, "calls": 2}
+
+
+def test_quota_is_shared_by_concurrent_processes(tmp_path, shared):
+    usage_file = tmp_path / "fx_usage.json"
+    # One budget per process, sharing the usage file and the cache
+    quotas = [QuotaBudget(30, usage_file, shared) for _ in range(2)]
+    spent = []
+
+    def spend(quota):
+        spent.extend(quota.spend() for _ in range(10))
+
+    threads = [threading.Thread(target=spend, args=(q,)) for q in quotas * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert spent.count(True) == 30
+    assert json.loads(usage_file.read_text())["calls"] == 30
+
+
+def test_rates_are_fetched_once_and_cached(tmp_path, shared, clock, monkeypatch):
+    calls = []
+
+    def get(url, timeout):
+        calls.append(url)
+        return FakeResponse(200, {"conversion_rates": {"USD": 1.1}})
+
+    monkeypatch.setattr(fx.requests, "get", get)
+    provider = make_provider(tmp_path, shared)
+    assert provider.get_rates("EUR") == ({"USD": 1.1}, fx.LIVE)
+    assert provider.get_rate("EUR", "USD") == fx.Rate(1.1, fx.LIVE)
+    assert calls == ["http://fx.test/EUR"]
+    assert provider.quota.remaining() == 9
+
+
+def test_failures_open_the_breaker_and_fall_back_on_defaults(
+    tmp_path, shared, clock, monkeypatch
+):
+    calls = []
+
+    def get(url, timeout):
+        calls.append(url)
+        return FakeResponse(500, {"error-type": "unavailable"})
+
+    monkeypatch.setattr(fx.requests, "get", get)
+    provider = make_provider(tmp_path, shared)
+    for _ in range(4):
+        assert provider.get_rate("USD", "EUR").source == fx.DEFAULT
+    assert len(calls) == 2  # Then the breaker is open
+    assert provider.status()["breaker"] == "open"
+
+
+def test_quota_reached_by_the_api_exhausts_the_budget(
+    tmp_path, shared, clock, monkeypatch
+):
+    response = FakeResponse(403, {"error-type": "quota-reached"})
+    monkeypatch.setattr(fx.requests, "get", lambda url, timeout: response)
+    provider = make_provider(tmp_path, shared)
+    assert provider.get_rates("EUR") == (None, fx.DEFAULT)
+    assert provider.quota.remaining() == 0
+
+
+def test_lock_is_not_held_during_the_call(tmp_path, shared, clock, monkeypatch):
+    provider = make_provider(tmp_path, shared)
+    started, release = threading.Event(), threading.Event()
+
+    def get(url, timeout):
+        started.set()
+        assert release.wait(5)
+        return FakeResponse(200, {"conversion_rates": {"USD": 1.1}})
+
+    monkeypatch.setattr(fx.requests, "get", get)
+    fetch = threading.Thread(target=provider.get_rates, args=("EUR",))
+    fetch.start()
+    try:
+        assert started.wait(5)
+        assert not provider._lock.locked()
+        assert provider.status()["remaining"] == 9
+    finally:
+        release.set()
+        fetch.join()
+    assert provider.get_rates("EUR") == ({"USD": 1.1}, fx.LIVE)
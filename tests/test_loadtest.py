@@ -0,0 +1,16 @@
+"""Short version of the stress and consistency check of the load test."""
+
+from app.data import tracker as tracker_module
+from app.loadtest import stress_tracker, write_synthetic_ledger
+
+
+def test_concurrent_writers_and_readers_stay_consistent(tmp_path, monkeypatch):
+    # Compactions and snapshots run in the background during the writes
+    monkeypatch.setattr(tracker_module, "COMPACTION_MIN_ENTRIES", 100)
+    monkeypatch.setattr(tracker_module, "COMPACTION_THRESHOLD", 0.1)
+    monkeypatch.setattr(tracker_module, "SNAPSHOT_INTERVAL", 50)
+    ledger = tmp_path / "stress.csv"
+    write_synthetic_ledger(ledger, 500)
+    result = stress_tracker(ledger, writers=4, readers=2, writes=60)
+    assert result["errors"] == 0, result["first_errors"]
+    assert result["expenses"] >= 500
@@ -0,0 +1,95 @@
+"""Tests of the time-partitioned archive of a ledger."""
+
+import csv
+import zlib
+
+import pytest
+
+from app.data.partitions import PartitionStore
+from app.data.records import ExpenseColumns, parse_day
+from app.data.tracker import LOG_FIELDS
+
+# (id, category, cost, note, date, currency, account), sorted by date
+EXPENSES = [
+    (0, "Food", 10.0, "lunch", "05-01-2025", "EUR", "Cash"),
+    (1, "Rent", 20.0, "flat", "20-01-2025", "EUR", "Card"),
+    (2, "Food", 30.0, "dinner", "03-02-2025", "EUR", "Cash"),
+    (3, "Fun", 40.0, "cinema", "14-02-2025", "USD", "Card"),
+    (4, "Food", 50.0, "brunch", "09-03-2025", "EUR", "Cash"),
+]
+RANGES = {"2025-01": (0, 2), "2025-02": (2, 4), "2025-03": (4, 5)}
+
+
+def columns_of(expenses) -> ExpenseColumns:
+    columns = ExpenseColumns()
+    for expense_id, category, cost, note, day, currency, account in expenses:
+        columns.append(
+            expense_id, category, cost, note, parse_day(day), currency, account
+        )
+    return columns
+
+
+@pytest.fixture
+def store(tmp_path) -> PartitionStore:
+    store = PartitionStore(tmp_path / "ledger.parts", "month")
+    store.write(columns_of(EXPENSES), RANGES)
+    return store
+
+
+def test_write_partitions(store):
+    manifest = store.load()
+    assert list(manifest) == list(RANGES)
+    february = manifest["2025-02"]
+    data = (store.directory / february.file).read_bytes()
+    assert february.checksum == zlib.crc32(data)
+    assert (february.rows, february.min_id, february.max_id) == (2, 2, 3)
+    assert (february.first_date, february.last_date) == ("03-02-2025", "14-02-2025")
+    assert sum(aggregate[4] for aggregate in february.aggregates) == 70.0
+    assert [int(entry["id"]) for entry in store.entries()] == [0, 1, 2, 3, 4]
+
+
+def test_rewrite_keeps_unchanged_partitions(store):
+    before = store.load()
+    january = store.directory / before["2025-01"].file
+    inode = january.stat().st_ino
+    changed = list(EXPENSES)
+    changed[2] = (2, "Food", 35.0, "dinner", "03-02-2025", "EUR", "Cash")
+    obsolete = store.write(columns_of(changed), RANGES)
+    after = store.load()
+    assert after["2025-01"] == before["2025-01"]
+    assert after["2025-03"] == before["2025-03"]
+    assert january.stat().st_ino == inode  # Not rewritten
+    assert after["2025-02"].checksum != before["2025-02"].checksum
+    assert obsolete == [store.directory / before["2025-02"].file]
+    store.delete(obsolete)
+    assert sorted(path.name for path in store.directory.iterdir()) == sorted(
+        [*(partition.file for partition in after.values()), "manifest.json"]
+    )
+
+
+def test_read_range_applies_the_ledger_file_to_archived_ids(store, tmp_path):
+    log_file = tmp_path / "ledger.csv"
+    with log_file.open(mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(LOG_FIELDS)
+        writer.writerow(
+            [2, "update", "Food", 100.0, "dinner", "03-02-2025", "EUR", "Cash"]
+        )
+        writer.writerow([3, "delete", "", "", "", "", "", ""])
+        writer.writerow([5, "add", "Fun", 7.0, "bowling", "20-02-2025", "EUR", "Cash"])
+    columns, aggregates = store.read_range(
+        log_file, parse_day("01-01-2025"), parse_day("28-02-2025")
+    )
+    # January is served from its aggregates, February is edited by the log
+    assert sorted((e.id, e.cost) for e in columns) == [(2, 100.0), (5, 7.0)]
+    assert aggregates["cost"].sum() == 30.0
+    assert aggregates["count"].sum() == 2
+    assert set(aggregates["date"].dt.strftime("%Y-%m")) == {"2025-01"}
+
+
+def test_read_range_reads_partially_covered_partitions(store, tmp_path):
+    columns, aggregates = store.read_range(
+        tmp_path / "missing.csv", parse_day("10-01-2025"), parse_day("10-02-2025")
+    )
+    assert sorted(e.id for e in columns) == [1, 2]
+    assert aggregates.empty
@@ -0,0 +1,42 @@
+"""Tests of the LRU registry of the trackers and of its counters."""
+
+import pytest
+
+from app.data.registry import TrackerRegistry
+
+
+@pytest.fixture
+def registry(tmp_path) -> TrackerRegistry:
+    return TrackerRegistry(
+        tmp_path / "ledgers",
+        max_trackers=2,
+        default_csv_file=tmp_path / "default.csv",
+        max_stats=4,
+    )
+
+
+def test_counters_outlive_eviction(registry):
+    registry.get("a")
+    registry.get("a")
+    registry.get("b")
+    registry.get("c")  # Evicts a
+    assert registry.loaded_ledgers() == ["b", "c"]
+    registry.get("a")  # Reloads a, evicts b
+    stats = registry.get_stats()
+    assert stats["a"] == {"hits": 1, "loads": 2, "evictions": 1, "loaded": True}
+    assert stats["b"] == {"hits": 0, "loads": 1, "evictions": 1, "loaded": False}
+    assert registry.evict("a")
+    assert not registry.evict("a")
+    assert registry.get_stats()["a"]["evictions"] == 2
+    assert registry.evictions == 3
+
+
+def test_counters_are_bounded(registry):
+    for ledger_id in "abcdef":
+        registry.get(ledger_id)
+    stats = registry.get_stats()
+    assert list(stats) == ["c", "d", "e", "f"]
+    assert [ledger_id for ledger_id in stats if stats[ledger_id]["loaded"]] == [
+        "e",
+        "f",
+    ]
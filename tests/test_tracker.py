@@ -0,0 +1,161 @@
+"""Tests of the expense tracker storage: log, recovery, compaction and catch up."""
+
+import pytest
+
+from app.data import tracker as tracker_module
+from app.data.records import ExpenseColumns
+from app.data.tracker import ExpenseTracker
+
+EXPENSE = ("Food", 12.5, "lunch", "03-02-2025", "EUR", "Cash")
+
+
+def expense(**values) -> tuple:
+    fields = dict(
+        zip(("category", "cost", "note", "date", "currency", "account"), EXPENSE)
+    )
+    fields.update(values)
+    return tuple(fields.values())
+
+
+def test_readers_catch_up_with_another_tracker(ledger):
+    writer, reader = ExpenseTracker(ledger), ExpenseTracker(ledger)
+    expense_id = writer.add_expense(*EXPENSE)
+    assert [e.id for e in reader.get_expenses()] == [expense_id]
+    assert reader.content_tag == writer.content_tag
+    writer.update_expense(expense_id, *expense(cost=20.0))
+    assert reader.get_expense(expense_id).cost == 20.0
+    assert reader.account_spend() == {("Cash", "EUR"): 20.0}
+    writer.delete_expense(expense_id)
+    assert reader.get_expenses() == []
+    assert reader.content_tag == writer.content_tag
+
+
+def state(tracker: ExpenseTracker) -> list:
+    return sorted(tracker.get_expenses())
+
+
+def test_torn_csv_entry_is_replayed_from_the_wal(ledger):
+    tracker = ExpenseTracker(ledger)
+    tracker.add_expense(*EXPENSE)
+    tracker.add_expense(*expense(note="dinner"))
+    expected = state(tracker)
+    with ledger.open(mode="rb+") as file:
+        file.truncate(ledger.stat().st_size - 5)
+    recovered = ExpenseTracker(ledger)
+    assert state(recovered) == expected
+    assert state(ExpenseTracker(ledger)) == expected
+
+
+def test_torn_csv_and_wal_entries_are_dropped(ledger):
+    tracker = ExpenseTracker(ledger)
+    first = tracker.add_expense(*EXPENSE)
+    tracker.add_expense(*expense(note="dinner"))
+    expected = [tracker.get_expense(first)]
+    for path in (ledger, ledger.with_suffix(".wal")):
+        with path.open(mode="rb+") as file:
+            file.truncate(path.stat().st_size - 5)
+    recovered = ExpenseTracker(ledger)
+    assert state(recovered) == expected
+    # New entries are not appended after the torn ones
+    added = recovered.add_expense(*expense(note="breakfast"))
+    assert added != first
+    assert state(ExpenseTracker(ledger)) == state(recovered)
+    assert len(state(recovered)) == 2
+
+
+def test_snapshot_checksum_mismatch_rebuilds_from_the_csv(ledger):
+    tracker = ExpenseTracker(ledger)
+    expense_id = tracker.add_expense(*EXPENSE)
+    tracker.snapshot()
+    assert ledger.with_suffix(".snapshot").exists()
+    # Same size, different content: only the checksum tells them apart
+    ledger.write_bytes(ledger.read_bytes().replace(b"lunch", b"lunce"))
+    assert ExpenseTracker(ledger).get_expense(expense_id).note == "lunce"
+
+
+def test_compaction_applies_a_concurrent_append(ledger, monkeypatch):
+    tracker, other = ExpenseTracker(ledger), ExpenseTracker(ledger)
+    for cost in range(1, 6):
+        tracker.add_expense(*expense(cost=float(cost)))
+    tracker.delete_expense(0)
+    live_rows = ExpenseColumns.live_rows
+    appended = []
+
+    def append_meanwhile(columns):
+        # Runs once the compaction copied the ledger, outside of its locks
+        if not appended:
+            appended.append(other.add_expense(*expense(note="meanwhile")))
+        return live_rows(columns)
+
+    monkeypatch.setattr(ExpenseColumns, "live_rows", append_meanwhile)
+    tracker.compact()
+    monkeypatch.undo()
+    assert tracker.get_expense(appended[0]).note == "meanwhile"
+    assert [e.id for e in state(tracker)] == [1, 2, 3, 4, appended[0]]
+    assert state(other) == state(tracker)
+    assert state(ExpenseTracker(ledger)) == state(tracker)
+    assert tracker.search_expenses("meanwhile") == [tracker.row_of(appended[0])]
+
+
+def test_update_delete_and_compaction_round_trip(ledger):
+    tracker = ExpenseTracker(ledger)
+    kept = tracker.add_expense(*EXPENSE)
+    deleted = tracker.add_expense(*expense(note="dinner"))
+    tracker.update_expense(kept, *expense(cost=20.0, account="Card"))
+    tracker.delete_expense(deleted)
+    expected = [tracker.get_expense(kept)]
+    assert expected[0].cost == 20.0 and expected[0].account == "Card"
+    assert state(ExpenseTracker(ledger)) == expected
+    tracker.compact()
+    assert state(tracker) == expected
+    assert tracker.dead_ratio() == 0
+    assert len(ledger.read_text().splitlines()) == 2  # Header and one entry
+    reopened = ExpenseTracker(ledger)
+    assert state(reopened) == expected
+    assert reopened.account_spend() == tracker.account_spend()
+    assert reopened.account_spend()[("Card", "EUR")] == 20.0
+    assert reopened.add_expense(*EXPENSE) > deleted
+
+
+def test_deletes_are_logged_as_tombstones(ledger):
+    tracker = ExpenseTracker(ledger)
+    kept = tracker.add_expense(*EXPENSE)
+    deleted = tracker.add_expense(*expense(note="dinner"))
+    tracker.delete_expense(deleted)
+    last = ledger.read_text().splitlines()[-1].split(",")
+    assert last[:2] == [str(deleted), "delete"]
+    assert [e.id for e in state(ExpenseTracker(ledger))] == [kept]
+    with pytest.raises(KeyError):
+        tracker.update_expense(deleted, *EXPENSE)
+    assert tracker.dead_ratio() == pytest.approx(2 / 3)
+
+
+def test_latest_version_of_each_id_wins(ledger):
+    tracker = ExpenseTracker(ledger)
+    expense_id = tracker.add_expense(*EXPENSE)
+    other = tracker.add_expense(*expense(note="dinner"))
+    for cost in (1.0, 2.0, 3.0):
+        tracker.update_expense(expense_id, *expense(cost=cost))
+    assert len(ledger.read_text().splitlines()) == 6  # Every version is logged
+    for reader in (tracker, ExpenseTracker(ledger)):
+        assert reader.get_expense(expense_id).cost == 3.0
+        assert reader.get_expense(other).note == "dinner"
+        assert len(reader.get_expenses()) == 2
+
+
+def test_compaction_runs_in_the_background_above_the_threshold(ledger, monkeypatch):
+    monkeypatch.setattr(tracker_module, "COMPACTION_MIN_ENTRIES", 10)
+    tracker = ExpenseTracker(ledger)
+    expense_id = tracker.add_expense(*EXPENSE)
+    for cost in range(1, 5):
+        tracker.update_expense(expense_id, *expense(cost=float(cost)))
+    assert tracker._maintenance is None  # Below the minimum number of entries
+    for cost in range(5, 10):
+        tracker.update_expense(expense_id, *expense(cost=float(cost)))
+        if tracker._maintenance is not None:
+            break
+    tracker._maintenance.join()
+    assert tracker.dead_ratio() == 0
+    assert len(ledger.read_text().splitlines()) == 2
+    assert state(ExpenseTracker(ledger)) == state(tracker)
+    assert tracker.get_expense(expense_id).cost == 9.0